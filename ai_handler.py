@@ -1,60 +1,92 @@
 import os
 import logging
+import time
+import threading
+import json
+import asyncio
 from typing import List, Dict, Tuple
-import torch
-from transformers import AutoModelForQuestionAnswering, AutoTokenizer, BartForConditionalGeneration, T5ForConditionalGeneration
-import PyPDF2
+from functools import lru_cache
+from itertools import accumulate, chain
+from bisect import bisect_left, bisect_right
 import re
 import traceback
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
-import openai
-import anthropic
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
-import textwrap
-import tiktoken
-
-# Set up NLTK data
-nltk.download('punkt', quiet=True)
-nltk.download('stopwords', quiet=True)
+from text_cache import get_page_texts, load_corpus, corpus_fingerprint
+from qa_engine import QA_BATCH_SIZE, get_window_index, answer_windows
+from model_registry import model_registry
+from model_backends import MODEL_BACKENDS, model_backend, apply_backend
+from retrieval import RETRIEVAL_TOP_K, DENSE_RETRIEVAL, DENSE_TOP_K, get_dense_index, fuse_rankings
+from corpus_catalog import corpus_catalog
+from llm_dispatch import LLM_CONCURRENCY, RateLimiter, OrderedAnswerMerge, JsonArrayStream, call_with_retries, run_concurrently
+from answer_cache import answer_cache
+from upload_store import ANONYMIZED_DIR
+
+# Tokeniser for LLM token counts and chunking; consecutive chunks share CHUNK_OVERLAP_TOKENS tokens
+TOKEN_ENCODING = "cl100k_base"
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 200))
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Check CUDA availability
-print(f"CUDA available: {torch.cuda.is_available()}")
-if torch.cuda.is_available():
-    print(f"Current device: {torch.cuda.current_device()}")
-    print(f"Device name: {torch.cuda.get_device_name(0)}")
-else:
-    print("CUDA is not available. Using CPU.")
-
-# Function to extract text from PDF
+# torch, transformers, NLTK, tiktoken and the API clients are imported by the
+# functions that use them, so importing this module (and starting the app)
+# stays fast; warm_up() loads them ahead of the first request.
+
+# Function to pick the torch device, checking for CUDA once per process
+@lru_cache(maxsize=1)
+def get_device():
+    import torch
+    if torch.cuda.is_available():
+        logging.info(f"CUDA available. Current device: {torch.cuda.current_device()}, device name: {torch.cuda.get_device_name(0)}")
+        return torch.device("cuda")
+    logging.info("CUDA is not available. Using CPU.")
+    return torch.device("cpu")
+
+# Function to get NLTK with its tokeniser and stopword data, downloading the data on first use
+@lru_cache(maxsize=1)
+def get_nltk():
+    import nltk
+    nltk.download('punkt', quiet=True)
+    nltk.download('stopwords', quiet=True)
+    return nltk
+
+# Function to import the heavy libraries in the background so the first request does not pay for them
+def warm_up():
+    start = time.perf_counter()
+    get_device()
+    import transformers
+    import openai
+    import anthropic
+    get_nltk()
+    get_encoding()
+    logging.info(f"AI libraries warmed up in {time.perf_counter() - start:.2f}s")
+
+# Corpus loaded from the catalog, reused until the catalog changes
+_corpus_cache = {}
+_corpus_lock = threading.Lock()
+
+# Function to extract text from PDF (served from the page-text cache)
 def extract_text_from_pdf(file_path):
     try:
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = []
-            for page_num, page in enumerate(reader.pages, 1):
-                page_text = page.extract_text()
-                text.append((page_text, page_num))
-        return text
+        return get_page_texts(file_path)
     except Exception as e:
         logging.error(f"Error extracting text from PDF {file_path}: {str(e)}")
         return []
 
-# Function to preprocess text
-def preprocess_text(text):
-    text = re.sub(r'[^\w\s.,?!]', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
-
-# Function to load model and tokeniser
-def load_model_and_tokenizer(model_name):
+# Function to load model and tokeniser, reusing the copy kept warm in the model registry.
+# backend defaults to the one configured for the model (see model_backends).
+def load_model_and_tokenizer(model_name, backend=None):
+    backend = backend or model_backend(model_name)
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unsupported backend: {backend}")
+    key = model_name if backend == "torch" else f"{model_name}:{backend}"
+    return model_registry.get(key, lambda: _load_model_and_tokenizer(model_name, backend))
+
+# Function to load model and tokeniser from disk
+def _load_model_and_tokenizer(model_name, backend="torch"):
     try:
-        logging.info(f"Loading {model_name} model and tokeniser")
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        logging.info(f"Loading {model_name} model and tokeniser ({backend} backend)")
+        from transformers import AutoModelForQuestionAnswering, AutoTokenizer, BartForConditionalGeneration, T5ForConditionalGeneration
+        device = get_device()
         
         if model_name == 'mpnet':
             model = AutoModelForQuestionAnswering.from_pretrained("microsoft/mpnet-base")
@@ -69,41 +101,17 @@ def load_model_and_tokenizer(model_name):
             raise ValueError(f"Unsupported model: {model_name}")
         
         model = model.to(device)
+        if backend != "torch":
+            try:
+                model = apply_backend(model, tokenizer, backend, model_name, device)
+            except Exception as e:
+                logging.error(f"Could not use the {backend} backend for {model_name}, falling back to fp32 torch: {str(e)}")
         logging.info(f"{model_name} model and tokeniser loaded. Using device: {device}")
         return model, tokenizer, device
     except Exception as e:
         logging.error(f"Error loading model and tokeniser: {str(e)}")
         raise
 
-# Function to get answer from model
-def get_answer(model, tokenizer, device, question, context, model_name):
-    try:
-        if model_name == 'mpnet':
-            inputs = tokenizer.encode_plus(question, context, add_special_tokens=True, return_tensors="pt", max_length=512, truncation=True, padding='max_length')
-            input_ids = inputs["input_ids"].to(device)
-            attention_mask = inputs["attention_mask"].to(device)
-
-            with torch.no_grad():
-                outputs = model(input_ids, attention_mask=attention_mask)
-                answer_start = torch.argmax(outputs.start_logits)
-                answer_end = torch.argmax(outputs.end_logits) + 1
-
-            answer = tokenizer.convert_tokens_to_string(tokenizer.convert_ids_to_tokens(input_ids[0][answer_start:answer_end]))
-            return answer, answer_start.item(), answer_end.item()
-        elif model_name in ['bart', 't5']:
-            input_text = f"question: {question} context: {context}"
-            inputs = tokenizer.encode(input_text, return_tensors="pt", max_length=1024, truncation=True)
-            inputs = inputs.to(device)
-            
-            with torch.no_grad():
-                outputs = model.generate(inputs, max_length=150, num_return_sequences=1, num_beams=4, early_stopping=True)
-            
-            answer = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            return answer, 0, len(answer)  # Return dummy start and end positions
-    except Exception as e:
-        logging.error(f"Error getting answer: {str(e)}")
-        return "", 0, 0
-
 # Function to calculate relevance score
 def calculate_relevance_score(answer, question):
     answer_words = set(answer.lower().split())
@@ -117,7 +125,7 @@ def post_process_answer(answer, question):
     answer = answer.lower().replace(question.lower(), "", 1).strip()
 
     # Tokenise the answer into sentences
-    sentences = sent_tokenize(answer)
+    sentences = get_nltk().sent_tokenize(answer)
 
     # Remove sentences that are too short or don't contain relevant information
     filtered_sentences = [s for s in sentences if len(s.split()) > 5 and any(word in s.lower() for word in question.lower().split())]
@@ -142,10 +150,11 @@ def post_process_answer(answer, question):
 
 # Function to summarise text
 def summarize_text(text, num_sentences):
-    sentences = sent_tokenize(text)
-    words = word_tokenize(text.lower())
+    nltk = get_nltk()
+    sentences = nltk.sent_tokenize(text)
+    words = nltk.word_tokenize(text.lower())
 
-    stop_words = set(stopwords.words('english'))
+    stop_words = set(nltk.corpus.stopwords.words('english'))
     words = [word for word in words if word not in stop_words]
 
     word_freq = {}
@@ -157,7 +166,7 @@ def summarize_text(text, num_sentences):
 
     sentence_scores = {}
     for i, sentence in enumerate(sentences):
-        for word in word_tokenize(sentence.lower()):
+        for word in nltk.word_tokenize(sentence.lower()):
             if word in word_freq:
                 if i not in sentence_scores:
                     sentence_scores[i] = word_freq[word]
@@ -178,30 +187,57 @@ def extract_citation(context, start, end):
 
 # Function to load and preprocess documents
 def load_and_preprocess_documents(anonymized_data_path):
-    all_text = []
-    for filename in os.listdir(anonymized_data_path):
-        if filename.endswith(".pdf"):
-            file_path = os.path.join(anonymized_data_path, filename)
-            logging.info(f"Reading file: {file_path}")
-            pdf_text = extract_text_from_pdf(file_path)
-            all_text.extend([(preprocess_text(page_text), filename, page_num) for page_text, page_num in pdf_text])
-    return all_text
-
-# Function to find best answer
-def find_best_answer(model, tokenizer, device, question, all_text, ai_model):
-    best_answer = ""
-    best_score = float('-inf')
-    best_source = ""
-    best_page = 0
-    best_citation = ""
-
-    for text, source, page_num in all_text:
-        window_size = 1000
-        stride = 500
-        for i in range(0, len(text) - window_size + 1, stride):
-            context = text[i:i+window_size]
-            answer, start, end = get_answer(model, tokenizer, device, question, context, ai_model)
-            
+    logging.info(f"Loading documents from: {anonymized_data_path}")
+    if os.path.abspath(anonymized_data_path) != os.path.abspath(ANONYMIZED_DIR):
+        return load_corpus(anonymized_data_path)
+    # The catalog already knows the distinct anonymised files, and the result holds until it changes
+    with _corpus_lock:
+        generation = corpus_catalog.generation
+        if _corpus_cache.get("generation") != generation:
+            _corpus_cache["all_text"] = load_corpus(anonymized_data_path, corpus_catalog.corpus_files())
+            _corpus_cache["generation"] = generation
+        return _corpus_cache["all_text"]
+
+# Function to rank chunks per question by embedding similarity, or None if the encoder is unavailable
+def dense_search(chunks, questions, top_k, name):
+    try:
+        return get_dense_index(chunks, name).search(questions, top_k if top_k > 0 else len(chunks))
+    except Exception as e:
+        logging.error(f"Dense retrieval unavailable, using lexical ranking only: {str(e)}")
+        return None
+
+# Function to keep only the pages most similar to any of the questions
+def select_relevant_pages(questions, all_text, top_k=DENSE_TOP_K):
+    page_ids = dense_search([text for text, _, _ in all_text], questions, top_k, "pages")
+    if page_ids is None:
+        return all_text
+    selected = sorted(set(page_ids.ravel().tolist()))
+    logging.info(f"Dense retrieval selected {len(selected)} of {len(all_text)} pages")
+    return [all_text[i] for i in selected]
+
+# Function to find best answers for several questions with batched inference
+def find_best_answers(model, tokenizer, device, questions, all_text, ai_model, batch_size=QA_BATCH_SIZE, top_k=RETRIEVAL_TOP_K, progress_callback=None, result_callback=None):
+    index = get_window_index(tokenizer, all_text)
+    logging.info(f"Scoring {len(questions)} questions against {len(index)} windows (top-k {top_k}, batch size {batch_size})")
+
+    dense_ids = dense_search(index.contexts, questions, top_k, "windows") if DENSE_RETRIEVAL else None
+
+    best_results = []
+    for q, question in enumerate(questions):
+        logging.info(f"Processing question: {question}")
+        best_answer = ""
+        best_score = float('-inf')
+        best_source = ""
+        best_page = 0
+        best_citation = ""
+
+        # Only the best lexical matches reach the QA model; ties go to the higher-ranked window
+        window_ids = index.retriever.top_k(question, top_k).tolist()
+        if dense_ids is not None:
+            window_ids = fuse_rankings([window_ids, dense_ids[q].tolist()], top_k)
+        answers = answer_windows(model, tokenizer, device, question, index, window_ids, ai_model, batch_size)
+        for w, (answer, start, end) in zip(window_ids, answers):
+            context, source, page_num = index.window(w)
             if answer and len(answer) > 5:
                 score = calculate_relevance_score(answer, question)
                 if score > best_score:
@@ -211,60 +247,111 @@ def find_best_answer(model, tokenizer, device, question, all_text, ai_model):
                     best_page = page_num
                     best_citation = extract_citation(context, start, end)
 
-    return best_answer, best_source, best_page, best_citation
+        best_results.append((best_answer, best_source, best_page, best_citation))
+        if result_callback:
+            result_callback(q, best_results[-1])
+        if progress_callback:
+            progress_callback(len(best_results) / len(questions))
+    return best_results
+
+# Function to find best answer
+def find_best_answer(model, tokenizer, device, question, all_text, ai_model):
+    return find_best_answers(model, tokenizer, device, [question], all_text, ai_model)[0]
+
+# Function to get the tokeniser used for token counts and chunking, loaded once per process
+@lru_cache(maxsize=1)
+def get_encoding():
+    import tiktoken
+    return tiktoken.get_encoding(TOKEN_ENCODING)
 
 # Function to count tokens in a string
 def num_tokens_from_string(string: str) -> int:
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(string))
+    return len(get_encoding().encode_ordinary(string))
+
+# Function to get the [start, end) token windows covering num_tokens, consecutive windows sharing overlap tokens
+def token_windows(num_tokens: int, max_tokens: int, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Tuple[int, int]]:
+    if num_tokens == 0:
+        return []
+    overlap = min(overlap, max_tokens - 1)
+    stride = max_tokens - overlap
+    return [(start, min(start + max_tokens, num_tokens)) for start in range(0, max(num_tokens - overlap, 1), stride)]
+
+# Function to chunk text on token boundaries
+def chunk_text(text: str, max_tokens: int = 90000, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
+    # A window edge can fall inside a multi-byte character; the overlap keeps the dropped bytes in the neighbouring chunk
+    return [encoding.decode(tokens[start:end], errors="ignore") for start, end in token_windows(len(tokens), max_tokens, overlap)]
+
+# Function to chunk the corpus on token boundaries, recording the document pages each chunk covers
+def chunk_corpus(all_text: List[Tuple[str, str, int]], max_tokens: int, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Dict]:
+    encoding = get_encoding()
+    # Each page is encoded once; page_starts[p] is the token offset of page p in the concatenated corpus
+    page_tokens = encoding.encode_ordinary_batch([text + " " for text, _, _ in all_text])
+    page_starts = list(accumulate((len(tokens) for tokens in page_tokens), initial=0))
+    tokens = list(chain.from_iterable(page_tokens))
 
-# Function to chunk text
-def chunk_text(text: str, max_tokens: int = 90000) -> List[str]:
     chunks = []
-    current_chunk = ""
-    current_chunk_tokens = 0
-    
-    for paragraph in text.split('\n\n'):
-        paragraph_tokens = num_tokens_from_string(paragraph)
-        
-        if current_chunk_tokens + paragraph_tokens > max_tokens:
-            chunks.append(current_chunk.strip())
-            current_chunk = paragraph
-            current_chunk_tokens = paragraph_tokens
-        else:
-            current_chunk += "\n\n" + paragraph
-            current_chunk_tokens += paragraph_tokens
-    
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    
+    for start, end in token_windows(len(tokens), max_tokens, overlap):
+        first_page = bisect_right(page_starts, start) - 1
+        last_page = bisect_left(page_starts, end) - 1
+        chunks.append({
+            "text": encoding.decode(tokens[start:end], errors="ignore"),
+            "pages": [(all_text[p][1], all_text[p][2]) for p in range(first_page, last_page + 1) if page_starts[p] < page_starts[p + 1]],
+            "token_span": (start, end),
+        })
     return chunks
 
-# Function to process with Claude
-def process_with_claude(api_key: str, questions: List[str], context: str, pdf_info: List[Tuple[str, int, str]]) -> List[Dict[str, str]]:
-    client = Anthropic(api_key=api_key)
-    chunks = chunk_text(context)
-    results = [{
-        "question": q,
-        "answer": "",
-        "source": "",
-        "citation": ""
-    } for q in questions]
-
-    system_prompt = "You are an AI assistant tasked with answering questions based on the provided context. The context is a chunk of a larger document, so some questions may not have answers in this specific chunk. If you can't find a relevant answer in this chunk, simply state 'No relevant information in this chunk.' and move to the next question. Do not make up information or guess. Always include the source document name and page number in your answer."
-
-    for i, chunk in enumerate(chunks):
-        questions_text = "\n".join([f"{j+1}. {q['question']}" for j, q in enumerate(results) if not q['answer']])
-        
-        # Find the corresponding PDF info for this chunk
-        chunk_start = i * 90000  # Assuming 90000 tokens per chunk
-        chunk_end = (i + 1) * 90000
-        relevant_pdf_info = [info for info in pdf_info if chunk_start <= info[1] < chunk_end]
-        
-        pdf_info_text = "\n".join([f"Document: {info[0]}, Page: {info[2]}" for info in relevant_pdf_info])
-        
-        user_message = f"""Context (chunk {i+1} of {len(chunks)}):
-{chunk}
+# Prompt template versions; bump one whenever its prompt or answer parsing changes so cached answers are not reused
+CLAUDE_PROMPT_VERSION = 2
+CHATGPT_PROMPT_VERSION = 2
+
+# Function to serve answers from the persistent cache and call answer_missing only for the questions it lacks
+def answer_with_cache(model: str, template_version: int, corpus_hash, questions: List[str], answer_missing, progress_callback=None, result_callback=None) -> List[Dict[str, str]]:
+    cached = {}
+    if corpus_hash:
+        try:
+            cached = answer_cache.get_many(model, template_version, corpus_hash, questions)
+        except Exception as e:
+            logging.error(f"Answer cache lookup failed: {str(e)}")
+    missing = [i for i in range(len(questions)) if i not in cached]
+    logging.info(f"Answer cache for {model}: {len(cached)} hits, {len(missing)} misses")
+    if result_callback:
+        for i in sorted(cached):
+            result_callback(i, cached[i])
+
+    results = dict(cached)
+    if missing:
+        # answer_missing numbers its questions from 0, so map its results back to the full list
+        on_result = (lambda k, result: result_callback(missing[k], result)) if result_callback else None
+        answered = answer_missing([questions[i] for i in missing], on_result)
+        for i, (result, _) in zip(missing, answered):
+            results[i] = result
+        if corpus_hash:
+            try:
+                answer_cache.put_many(model, template_version, corpus_hash, [result for result, cacheable in answered if cacheable])
+            except Exception as e:
+                logging.error(f"Answer cache update failed: {str(e)}")
+    elif progress_callback:
+        progress_callback(1.0)
+    return [results[i] for i in range(len(questions))]
+
+# Claude request settings; ANTHROPIC_BASE_URL points the client at another endpoint, such as a local stub
+CLAUDE_MODEL = os.environ.get("CLAUDE_MODEL", "claude-3-opus-20240229")
+CLAUDE_MAX_TOKENS = 3000
+CLAUDE_CHUNK_TOKENS = int(os.environ.get("CLAUDE_CHUNK_TOKENS", 90000))
+CLAUDE_SYSTEM_PROMPT = "You are an AI assistant tasked with answering questions based on the provided context. The context is a chunk of a larger document, so some questions may not have answers in this specific chunk. If you can't find a relevant answer in this chunk, simply state 'No relevant information in this chunk.' and move to the next question. Do not make up information or guess. Always include the source document name and page number in your answer."
+
+# Shared by all Claude jobs in this process so concurrent analyses stay within one budget
+claude_limiter = RateLimiter()
+
+# Function to build the user message for one chunk
+def build_claude_message(chunk: Dict, chunk_index: int, num_chunks: int, questions: List[str]) -> str:
+    questions_text = "\n".join([f"{j+1}. {q}" for j, q in enumerate(questions)])
+    pdf_info_text = "\n".join([f"Document: {filename}, Page: {page_num}" for filename, page_num in chunk["pages"]])
+
+    return f"""Context (chunk {chunk_index+1} of {num_chunks}):
+{chunk["text"]}
 
 PDF Information:
 {pdf_info_text}
@@ -274,49 +361,119 @@ Questions:
 
 Please answer each question based solely on the information provided in the context. If the answer is found, provide it along with the specific document name and page number where the information was found. Use the format 'Source: [Document Name], Page: [Page Number]' at the end of each answer."""
 
+# Function to parse a Claude response into {question index: (answer, source)}
+def parse_claude_answers(text: str, chunk_index: int, num_questions: int) -> Dict[int, Tuple[str, str]]:
+    answers = {}
+    for answer in text.strip().split('\n\n'):
+        if '. ' not in answer:
+            continue
+        question_num, answer_text = answer.split('. ', 1)
         try:
-            response = client.messages.create(
-                model="claude-3-opus-20240229",
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=3000,
-            )
-            
-            answers = response.content[0].text.strip().split('\n\n')
-            for answer in answers:
-                if '. ' in answer:
-                    question_num, answer_text = answer.split('. ', 1)
-                    question_index = int(question_num) - 1
-                    if question_index < len(results) and not results[question_index]['answer']:
-                        if "No relevant information in this chunk" not in answer_text:
-                            # Extract source and page information
-                            source_match = re.search(r'Source: (.*?), Page: (\d+)', answer_text)
-                            if source_match:
-                                source_doc = source_match.group(1)
-                                page_num = source_match.group(2)
-                                source = f"{source_doc}, Page: {page_num}"
-                                # Remove the source information from the answer text
-                                answer_text = re.sub(r'Source: .*?, Page: \d+', '', answer_text).strip()
-                            else:
-                                source = f"Information found in chunk {i+1}"
-                            
-                            results[question_index]['answer'] = answer_text
-                            results[question_index]['source'] = source
-                            results[question_index]['citation'] = f"\"{answer_text}\""  # Use the answer as the citation
-        
+            question_index = int(question_num) - 1
+        except ValueError:
+            continue
+        if not 0 <= question_index < num_questions or question_index in answers:
+            continue
+        if "No relevant information in this chunk" in answer_text:
+            continue
+        # Extract source and page information
+        source_match = re.search(r'Source: (.*?), Page: (\d+)', answer_text)
+        if source_match:
+            source = f"{source_match.group(1)}, Page: {source_match.group(2)}"
+            # Remove the source information from the answer text
+            answer_text = re.sub(r'Source: .*?, Page: \d+', '', answer_text).strip()
+        else:
+            source = f"Information found in chunk {chunk_index+1}"
+        answers[question_index] = (answer_text, source)
+    return answers
+
+# Function to build the result for a question from its merged Claude answer
+def claude_result(question: str, found) -> Dict[str, str]:
+    if found:
+        answer_text, source = found
+        return {
+            "question": question,
+            "answer": answer_text,
+            "source": source,
+            "citation": f"\"{answer_text}\""  # Use the answer as the citation
+        }
+    # For questions with no answers, keep the default "No relevant information found" response
+    return {
+        "question": question,
+        "answer": "No relevant information found in the provided context.",
+        "source": "N/A",
+        "citation": "No relevant information found in any chunk."
+    }
+
+# Function to stream every chunk from Claude concurrently into merge, returning whether each chunk succeeded
+async def query_claude_chunks(api_key: str, questions: List[str], chunks: List[Dict], merge: OrderedAnswerMerge, progress_callback=None, usage_callback=None) -> List[bool]:
+    from anthropic import AsyncAnthropic
+    client = AsyncAnthropic(api_key=api_key, max_retries=0)
+    usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+    async def stream_chunk(i, user_message):
+        buffer = ""
+        async with client.messages.stream(
+            model=CLAUDE_MODEL,
+            system=CLAUDE_SYSTEM_PROMPT,
+            messages=[
+                {"role": "user", "content": user_message}
+            ],
+            max_tokens=CLAUDE_MAX_TOKENS,
+        ) as stream:
+            async for text in stream.text_stream:
+                buffer += text
+                # Answers are separated by blank lines, so everything before the last one is complete
+                *complete, buffer = buffer.split('\n\n')
+                for segment in complete:
+                    for question_index, answer in parse_claude_answers(segment, i, len(questions)).items():
+                        merge.add(i, question_index, answer)
+            message = await stream.get_final_message()
+        for question_index, answer in parse_claude_answers(buffer, i, len(questions)).items():
+            merge.add(i, question_index, answer)
+        return message
+
+    async def query_chunk(i, chunk):
+        user_message = build_claude_message(chunk, i, len(chunks), questions)
+        tokens = num_tokens_from_string(CLAUDE_SYSTEM_PROMPT) + num_tokens_from_string(user_message)
+        try:
+            message = await call_with_retries(lambda: stream_chunk(i, user_message), claude_limiter, tokens)
         except Exception as e:
             logging.error(f"Error in Claude API call for chunk {i+1}: {str(e)}")
+            return False
+        finally:
+            merge.finish(i)
+        usage["requests"] += 1
+        usage["prompt_tokens"] += message.usage.input_tokens
+        usage["completion_tokens"] += message.usage.output_tokens
+        usage["total_tokens"] += message.usage.input_tokens + message.usage.output_tokens
+        if usage_callback:
+            usage_callback(dict(usage))
+        return True
 
-    # For questions with no answers, keep the default "No relevant information found" response
-    for result in results:
-        if not result['answer']:
-            result['answer'] = "No relevant information found in the provided context."
-            result['source'] = "N/A"
-            result['citation'] = "No relevant information found in any chunk."
+    try:
+        return await run_concurrently(chunks, query_chunk, LLM_CONCURRENCY, progress_callback)
+    finally:
+        await client.close()
+
+# Function to answer with Claude, returning (result, cacheable) per question
+def claude_answers(api_key: str, questions: List[str], all_text: List[Tuple[str, str, int]], progress_callback=None, usage_callback=None, result_callback=None) -> List[Tuple[Dict[str, str], bool]]:
+    chunks = chunk_corpus(all_text, CLAUDE_CHUNK_TOKENS)
+    # Every chunk is asked every question; the earliest chunk with an answer wins, as when chunks ran in order
+    on_final = (lambda i, found: result_callback(i, claude_result(questions[i], found))) if result_callback else None
+    merge = OrderedAnswerMerge(len(chunks), len(questions), on_final)
+    succeeded = asyncio.run(query_claude_chunks(api_key, questions, chunks, merge, progress_callback, usage_callback))
+    # A "not found" is only final if every chunk was actually asked
+    complete = all(succeeded)
+    return [(claude_result(question, merge.final.get(i)), merge.final.get(i) is not None or complete) for i, question in enumerate(questions)]
 
-    return results
+# Function to process with Claude
+def process_with_claude(api_key: str, questions: List[str], all_text: List[Tuple[str, str, int]], progress_callback=None, usage_callback=None, corpus_hash=None, result_callback=None) -> List[Dict[str, str]]:
+    return answer_with_cache(
+        CLAUDE_MODEL, CLAUDE_PROMPT_VERSION, corpus_hash, questions,
+        lambda missing, on_result: claude_answers(api_key, missing, all_text, progress_callback, usage_callback, on_result),
+        progress_callback, result_callback
+    )
 
 # Function to format results
 def format_results(results: List[Dict[str, str]]) -> str:
@@ -329,28 +486,142 @@ def format_results(results: List[Dict[str, str]]) -> str:
         formatted_output += f"**Citation:** {result['citation']}\n\n"
     return formatted_output
 
-# Function to process with ChatGPT
-def process_with_chatgpt(api_key: str, questions: List[str], context: str) -> List[Dict[str, str]]:
-    openai.api_key = api_key
-    results = []
-    for question in questions:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
+# ChatGPT request settings; OPENAI_API_BASE points the client at another endpoint, such as a local mock
+CHATGPT_MODEL = os.environ.get("CHATGPT_MODEL", "gpt-3.5-turbo")
+CHATGPT_CHUNK_TOKENS = int(os.environ.get("CHATGPT_CHUNK_TOKENS", 12000))
+CHATGPT_QUESTIONS_PER_REQUEST = int(os.environ.get("CHATGPT_QUESTIONS_PER_REQUEST", 10))
+CHATGPT_SYSTEM_PROMPT = """You are a helpful assistant answering questions based on the given context. The context is one part of a larger set of documents, so some questions may not be answered by it. Do not make up information or guess.
+Reply with a JSON object of the form {"answers": [{"id": <question number>, "found": <true or false>, "answer": "<answer>"}]} containing one entry per question. Set found to false when the context does not answer the question."""
+
+# Shared by all ChatGPT jobs in this process so concurrent analyses stay within one budget
+chatgpt_limiter = RateLimiter()
+
+# Function to build the user message for one context chunk and a batch of questions
+def build_chatgpt_message(chunk: str, chunk_index: int, num_chunks: int, questions: List[str], question_ids: List[int]) -> str:
+    questions_text = "\n".join([f"{j+1}. {questions[j]}" for j in question_ids])
+    return f"Context (part {chunk_index+1} of {num_chunks}):\n{chunk}\n\nQuestions:\n{questions_text}"
+
+# Function to turn decoded ChatGPT answer entries into {question index: answer}
+def parse_chatgpt_entries(entries: List, question_ids: List[int]) -> Dict[int, str]:
+    answers = {}
+    for entry in entries:
+        try:
+            question_index = int(entry.get("id")) - 1
+        except (TypeError, ValueError, AttributeError):
+            continue
+        answer_text = str(entry.get("answer") or "").strip()
+        if question_index in question_ids and entry.get("found") and answer_text:
+            answers.setdefault(question_index, answer_text)
+    return answers
+
+# Function to parse a JSON ChatGPT response into {question index: answer}
+def parse_chatgpt_answers(text: str, question_ids: List[int]) -> Dict[int, str]:
+    try:
+        entries = json.loads(text).get("answers", [])
+    except (ValueError, AttributeError):
+        logging.error(f"Could not parse ChatGPT response as JSON: {text[:200]}")
+        return {}
+    return parse_chatgpt_entries(entries, question_ids)
+
+# Function to build the result for a question from its merged ChatGPT answer
+def chatgpt_result(question: str, answer) -> Dict[str, str]:
+    return {
+        "question": question,
+        "answer": answer or "No relevant information found in the provided context.",
+        "source": "ChatGPT" if answer else "N/A",
+        "citation": "Generated by ChatGPT based on the provided context." if answer else "No relevant information found in any chunk."
+    }
+
+# Function to stream every batch of questions against every context chunk concurrently into merge, returning the failed question indices
+async def query_chatgpt_batches(api_key: str, questions: List[str], chunks: List[Dict], merge: OrderedAnswerMerge, progress_callback=None, usage_callback=None) -> set:
+    batches = [list(range(start, min(start + CHATGPT_QUESTIONS_PER_REQUEST, len(questions))))
+               for start in range(0, len(questions), CHATGPT_QUESTIONS_PER_REQUEST)]
+    requests = [(i, question_ids) for i in range(len(chunks)) for question_ids in batches]
+    import openai
+    usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    failed = set()
+
+    async def stream_batch(i, question_ids, user_message):
+        # Each answer object is used as soon as it has been received in full
+        parser = JsonArrayStream()
+        content = ""
+        response = await openai.ChatCompletion.acreate(
+            api_key=api_key,
+            model=CHATGPT_MODEL,
             messages=[
-                {"role": "system", "content": "You are a helpful assistant answering questions based on the given context."},
-                {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}"}
-            ]
+                {"role": "system", "content": CHATGPT_SYSTEM_PROMPT},
+                {"role": "user", "content": user_message}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0,
+            stream=True,
         )
-        results.append({
-            "question": question,
-            "answer": response.choices[0].message['content'].strip(),
-            "source": "ChatGPT",
-            "citation": "Generated by ChatGPT based on the provided context."
-        })
-    return results
+        async for event in response:
+            delta = event["choices"][0]["delta"].get("content") if event["choices"] else None
+            if delta:
+                content += delta
+                for question_index, answer in parse_chatgpt_entries(parser.feed(delta), question_ids).items():
+                    merge.add(i, question_index, answer)
+        for question_index, answer in parse_chatgpt_answers(content, question_ids).items():
+            merge.add(i, question_index, answer)
+        return content
+
+    async def query_batch(_, request):
+        i, question_ids = request
+        user_message = build_chatgpt_message(chunks[i]["text"], i, len(chunks), questions, question_ids)
+        tokens = num_tokens_from_string(CHATGPT_SYSTEM_PROMPT) + num_tokens_from_string(user_message)
+        try:
+            content = await call_with_retries(lambda: stream_batch(i, question_ids, user_message), chatgpt_limiter, tokens)
+        except Exception as e:
+            logging.error(f"Error in ChatGPT API call for chunk {i+1}: {str(e)}")
+            failed.update(question_ids)
+            return
+        finally:
+            merge.finish(i, question_ids)
+        # Streamed responses carry no usage block, so count the tokens locally
+        completion_tokens = num_tokens_from_string(content)
+        usage["requests"] += 1
+        usage["prompt_tokens"] += tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["total_tokens"] += tokens + completion_tokens
+        if usage_callback:
+            usage_callback(dict(usage))
+
+    await run_concurrently(requests, query_batch, LLM_CONCURRENCY, progress_callback)
+    logging.info(f"ChatGPT used {usage['total_tokens']} tokens over {usage['requests']} requests")
+    return failed
+
+# Function to answer with ChatGPT, returning (result, cacheable) per question
+def chatgpt_answers(api_key: str, questions: List[str], all_text: List[Tuple[str, str, int]], progress_callback=None, usage_callback=None, result_callback=None) -> List[Tuple[Dict[str, str], bool]]:
+    chunks = chunk_corpus(all_text, CHATGPT_CHUNK_TOKENS)
+    # The earliest chunk with an answer wins, so results do not depend on completion order
+    on_final = (lambda i, answer: result_callback(i, chatgpt_result(questions[i], answer))) if result_callback else None
+    merge = OrderedAnswerMerge(len(chunks), len(questions), on_final)
+    failed = asyncio.run(query_chatgpt_batches(api_key, questions, chunks, merge, progress_callback, usage_callback))
+    return [(chatgpt_result(question, merge.final.get(i)), merge.final.get(i) is not None or i not in failed) for i, question in enumerate(questions)]
+
+# Function to process with ChatGPT, batching questions per request over a chunked context
+def process_with_chatgpt(api_key: str, questions: List[str], all_text: List[Tuple[str, str, int]], progress_callback=None, usage_callback=None, corpus_hash=None, result_callback=None) -> List[Dict[str, str]]:
+    return answer_with_cache(
+        CHATGPT_MODEL, CHATGPT_PROMPT_VERSION, corpus_hash, questions,
+        lambda missing, on_result: chatgpt_answers(api_key, missing, all_text, progress_callback, usage_callback, on_result),
+        progress_callback, result_callback
+    )
+
+# Function to format a local model's best answer for a question
+def local_result(question: str, best: Tuple[str, str, int, str]) -> Dict[str, str]:
+    best_answer, best_source, best_page, best_citation = best
+    processed_answer = post_process_answer(best_answer, question)
+    formatted_citation = f"\"<i>{best_citation}</i>\""
+    return {
+        "question": question,
+        "answer": processed_answer if processed_answer else "No relevant answer found in the provided documents.",
+        "source": f"{best_source}, Page: {best_page}" if best_source else "N/A",
+        "citation": formatted_citation if best_citation else "N/A"
+    }
 
 # Main function to process security questions
-def process_security_questions(ai_model: str, api_key: str, questions: List[str], anonymized_data_path: str) -> List[Dict[str, str]]:
+def process_security_questions(ai_model: str, api_key: str, questions: List[str], anonymized_data_path: str, progress_callback=None, usage_callback=None, result_callback=None) -> List[Dict[str, str]]:
     logging.info(f"Starting processing with {ai_model} model")
     try:
         all_text = load_and_preprocess_documents(anonymized_data_path)
@@ -358,36 +629,23 @@ def process_security_questions(ai_model: str, api_key: str, questions: List[str]
             logging.error("No valid content found in the anonymised data after preprocessing")
             return [{"question": q, "answer": "Error: No valid content available after preprocessing.", "source": "N/A", "citation": "N/A"} for q in questions]
 
-        context = ""
-        pdf_info = []
-        token_count = 0
-        for text, filename, page_num in all_text:
-            context += text + " "
-            pdf_info.append((filename, token_count, page_num))
-            token_count += len(text.split())
+        # Cached LLM answers are keyed on the whole corpus, before any page selection
+        corpus_hash = corpus_fingerprint(all_text) if ai_model in ['claude', 'chatgpt'] else None
+
+        # Send only the most relevant pages to the hosted models when dense retrieval is enabled
+        if DENSE_RETRIEVAL and ai_model in ['claude', 'chatgpt']:
+            all_text = select_relevant_pages(questions, all_text)
 
         if ai_model == 'claude':
-            return process_with_claude(api_key, questions, context, pdf_info)
+            return process_with_claude(api_key, questions, all_text, progress_callback, usage_callback, corpus_hash, result_callback)
         elif ai_model == 'chatgpt':
-            return process_with_chatgpt(api_key, questions, context)
+            return process_with_chatgpt(api_key, questions, all_text, progress_callback, usage_callback, corpus_hash, result_callback)
         else:
             model, tokenizer, device = load_model_and_tokenizer(ai_model)
-            all_results = []
-            for question in questions:
-                logging.info(f"Processing question: {question}")
-                best_answer, best_source, best_page, best_citation = find_best_answer(model, tokenizer, device, question, all_text, ai_model)
-                
-                processed_answer = post_process_answer(best_answer, question)
-                formatted_citation = f"\"<i>{best_citation}</i>\""
-                
-                result = {
-                    "question": question,
-                    "answer": processed_answer if processed_answer else "No relevant answer found in the provided documents.",
-                    "source": f"{best_source}, Page: {best_page}" if best_source else "N/A",
-                    "citation": formatted_citation if best_citation else "N/A"
-                }
-                
-                all_results.append(result)
+            # Stream each answer as soon as its question is scored, like the hosted models do
+            on_result = (lambda q, best: result_callback(q, local_result(questions[q], best))) if result_callback else None
+            best_answers = find_best_answers(model, tokenizer, device, questions, all_text, ai_model, progress_callback=progress_callback, result_callback=on_result)
+            all_results = [local_result(question, best) for question, best in zip(questions, best_answers)]
 
             logging.info("All questions processed successfully")
             return all_results
@@ -1,29 +1,137 @@
+import os
 import PyPDF2
-import spacy
-import re
+import time
 import logging
 import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
 from io import BytesIO
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from decimal import Decimal
+from text_cache import cache_pdf_text
+from redaction import redact
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Load English NLP model
-try:
-    nlp = spacy.load("en_core_web_sm")
-    logger.info("Loaded spaCy model 'en_core_web_sm'")
-except OSError:
-    logger.error("Failed to load spaCy model. Ensure 'en_core_web_sm' is installed.")
-    raise
+# Batched NER settings
+NER_BATCH_SIZE = int(os.environ.get("NER_BATCH_SIZE", 32))
+NER_N_PROCESS = int(os.environ.get("NER_N_PROCESS", 1))
 
-def anonymize_pdf(input_path, output_path):
-    # Main function to anonymise PDF content
+UNUSED_PIPES = ["tagger", "parser", "lemmatizer", "attribute_ruler", "senter", "morphologizer"]
+
+def disable_unused_pipes(nlp):
+    # Only doc.ents is used, so drop the syntax components and any tok2vec NER does not listen to
+    unused = [name for name in UNUSED_PIPES if name in nlp.pipe_names]
+    if "tok2vec" in nlp.pipe_names and "ner" not in getattr(nlp.get_pipe("tok2vec"), "listening_components", []):
+        unused.append("tok2vec")
+    for name in unused:
+        nlp.disable_pipe(name)
+    return nlp
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+def get_nlp():
+    # Load the English NLP model on first use, so importing this module stays cheap
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                try:
+                    _nlp = disable_unused_pipes(spacy.load("en_core_web_sm"))
+                    logger.info(f"Loaded spaCy model 'en_core_web_sm' with pipes {_nlp.pipe_names}")
+                except OSError:
+                    logger.error("Failed to load spaCy model. Ensure 'en_core_web_sm' is installed.")
+                    raise
+    return _nlp
+
+# Page-parallel anonymisation settings
+ANONYMIZER_WORKERS = int(os.environ.get("ANONYMIZER_WORKERS", min(4, os.cpu_count() or 1)))
+ANONYMIZER_PARALLEL_MIN_PAGES = int(os.environ.get("ANONYMIZER_PARALLEL_MIN_PAGES", 4))
+# Pool workers are spawned, not forked: the app process has job threads and open
+# SQLite and file locks, and a fork of a multi-threaded process can deadlock
+ANONYMIZER_START_METHOD = os.environ.get("ANONYMIZER_START_METHOD", "spawn")
+
+_page_pool = None
+_page_pool_workers = 0
+_page_pool_lock = threading.Lock()
+# Reader for the document a pool worker process is on; only ever set inside pool workers
+_worker_reader = None
+
+def get_page_pool(workers):
+    # Reuse one process pool so workers load the spaCy model only once
+    global _page_pool, _page_pool_workers
+    with _page_pool_lock:
+        if _page_pool is None or _page_pool_workers != workers:
+            if _page_pool is not None:
+                _page_pool.shutdown(wait=False)
+            _page_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(ANONYMIZER_START_METHOD),
+                                             initializer=_init_page_worker)
+            _page_pool_workers = workers
+        return _page_pool
+
+def discard_page_pool(pool):
+    # Drop a pool whose worker died, so the next call to get_page_pool starts a new one
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _init_page_worker():
+    # Each worker process holds its own spaCy pipeline, loaded before the first page arrives
+    logger.debug(f"Anonymisation worker ready with spaCy pipeline {get_nlp().meta.get('name')}")
+
+def _open_worker_reader(input_path, mtime):
+    # Keep the reader open across pages of the same document within a pool worker
+    global _worker_reader
+    if _worker_reader is None or _worker_reader[0] != (input_path, mtime):
+        _worker_reader = ((input_path, mtime), PyPDF2.PdfReader(input_path))
+    return _worker_reader[1]
+
+def anonymise_pages(input_path, mtime, page_indices):
+    # Pool worker entry point: anonymise a run of pages of the document at input_path
+    return anonymise_reader_pages(_open_worker_reader(input_path, mtime), page_indices)
+
+def anonymise_reader_pages(reader, page_indices, n_process=1):
+    # Extract, anonymise and render watermarks for a run of pages. NER runs
+    # over the whole run in one nlp.pipe call, so anonymise_seconds is the
+    # batch time averaged over its pages.
+    page_indices = list(page_indices)
+    contents, sizes, all_timings = [], [], []
+    for page_index in page_indices:
+        start = time.perf_counter()
+        page = reader.pages[page_index]
+        contents.append(page.extract_text())
+        sizes.append((float(page.mediabox.width), float(page.mediabox.height)))
+        all_timings.append({"page": page_index + 1, "extract_seconds": time.perf_counter() - start})
+
+    start = time.perf_counter()
+    anonymised_contents = anonymise_texts(contents, n_process=n_process)
+    anonymise_seconds = (time.perf_counter() - start) / max(len(page_indices), 1)
+
+    results = []
+    for page_index, anonymised_content, (width, height), timings in zip(page_indices, anonymised_contents, sizes, all_timings):
+        timings["anonymise_seconds"] = anonymise_seconds
+        start = time.perf_counter()
+        watermark = render_watermark(anonymised_content, width, height)
+        timings["render_seconds"] = time.perf_counter() - start
+        results.append((page_index, watermark, timings))
+    return results
+
+def anonymize_pdf(input_path, output_path, workers=None, page_stats=None, progress_callback=None):
+    # Main function to anonymise PDF content; pages are processed in parallel
+    # and reassembled in order. Per-page timings are appended to page_stats and
+    # progress_callback(pages_done, num_pages) is called as pages are merged.
     try:
         logger.info(f"Anonymising PDF: {input_path}")
+        started = time.perf_counter()
+        workers = ANONYMIZER_WORKERS if workers is None else workers
         with open(input_path, 'rb') as file:
             reader = PyPDF2.PdfReader(file)
             
@@ -32,38 +140,91 @@ def anonymize_pdf(input_path, output_path):
                 raise ValueError("Encrypted PDF")
 
             writer = PyPDF2.PdfWriter()
+            num_pages = len(reader.pages)
+            mtime = os.path.getmtime(input_path)
 
-            for page_num in range(len(reader.pages)):
-                logger.debug(f"Processing page {page_num + 1}")
-                page = reader.pages[page_num]
-                content = page.extract_text()
-                anonymised_content = anonymise_text(content)
-                new_page = create_anonymised_page(page, anonymised_content)
+            if workers > 1 and num_pages >= ANONYMIZER_PARALLEL_MIN_PAGES:
+                page_results = parallel_page_results(reader, input_path, mtime, num_pages, workers)
+            else:
+                # In this process the reader opened above is used directly
+                page_results = anonymise_reader_pages(reader, range(num_pages), n_process=NER_N_PROCESS)
+
+            for page_index, watermark, timings in page_results:
+                logger.debug(f"Processing page {page_index + 1}")
+                start = time.perf_counter()
+                new_page = create_anonymised_page(reader.pages[page_index], watermark_page(watermark))
                 writer.add_page(new_page)
+                timings["merge_seconds"] = time.perf_counter() - start
+                if page_stats is not None:
+                    page_stats.append(timings)
+                if progress_callback:
+                    progress_callback(page_index + 1, num_pages)
 
         with open(output_path, 'wb') as output_file:
             writer.write(output_file)
         
-        logger.info(f"PDF anonymised: {input_path} -> {output_path}")
+        logger.info(f"PDF anonymised: {input_path} -> {output_path} ({num_pages} pages in {time.perf_counter() - started:.2f}s, {workers} workers)")
+
+        # Populate the page-text cache now so question processing never re-parses this file
+        try:
+            cache_pdf_text(output_path)
+        except Exception as e:
+            logger.warning(f"Could not cache text for {output_path}: {str(e)}")
         return True
 
     except Exception as e:
         logger.error(f"PDF anonymisation failed: {str(e)}", exc_info=True)
         return False
 
-def create_anonymised_page(original_page, anonymised_content):
-    # Create a new page with anonymised content
+def parallel_page_results(reader, input_path, mtime, num_pages, workers):
+    # Yield page results in order from the page pool. A pool that is already broken
+    # is rebuilt once; if a worker dies mid-document, the remaining pages are
+    # anonymised in this process instead.
+    # A few runs per worker balances load while keeping NER batches large
+    run_length = max(1, -(-num_pages // (workers * 4)))
+    runs = [range(i, min(i + run_length, num_pages)) for i in range(0, num_pages, run_length)]
+    for attempt in range(2):
+        pool = get_page_pool(workers)
+        try:
+            futures = [pool.submit(anonymise_pages, input_path, mtime, run) for run in runs]
+            break
+        except BrokenProcessPool:
+            logger.warning("Anonymisation worker pool is broken, starting a new one")
+            discard_page_pool(pool)
+    else:
+        yield from anonymise_reader_pages(reader, range(num_pages), n_process=NER_N_PROCESS)
+        return
+
+    for position, future in enumerate(futures):
+        try:
+            results = future.result()
+        except BrokenProcessPool:
+            logger.warning(f"Anonymisation worker died, finishing {input_path} in this process")
+            discard_page_pool(pool)
+            yield from anonymise_reader_pages(reader, chain.from_iterable(runs[position:]), n_process=NER_N_PROCESS)
+            return
+        yield from results
+
+def create_anonymised_page(original_page, watermark):
+    # Create a new page with the anonymised content watermark
     new_page = PyPDF2.PageObject.create_blank_page(
         width=float(original_page.mediabox.width),
         height=float(original_page.mediabox.height)
     )
     new_page.merge_page(original_page)
-    watermark = create_watermark(anonymised_content, float(original_page.mediabox.width), float(original_page.mediabox.height))
     new_page.merge_page(watermark)
     return new_page
 
 def create_watermark(text, width, height):
     # Create a watermark with anonymised text
+    return watermark_page(render_watermark(text, width, height))
+
+def watermark_page(watermark_bytes):
+    # Load a rendered watermark as a PDF page
+    return PyPDF2.PdfReader(BytesIO(watermark_bytes)).pages[0]
+
+def render_watermark(text, width, height):
+    # Render anonymised text to single-page PDF bytes (picklable across processes)
     logger.debug("Creating anonymised text watermark")
     packet = BytesIO()
     can = canvas.Canvas(packet, pagesize=(width, height))
@@ -73,37 +234,22 @@ def create_watermark(text, width, height):
         can.drawString(10, y, line)
         y -= 12
     can.save()
-    packet.seek(0)
-    return PyPDF2.PdfReader(packet).pages[0]
+    return packet.getvalue()
 
 def anonymise_text(text):
     # Anonymise sensitive information in text
+    return redact_text(text, get_nlp()(text))
+
+def anonymise_texts(texts, batch_size=NER_BATCH_SIZE, n_process=1):
+    # Anonymise many texts, streaming them through spaCy in batches
+    docs = get_nlp().pipe(texts, batch_size=batch_size, n_process=n_process)
+    return [redact_text(text, doc) for text, doc in zip(texts, docs)]
+
+def redact_text(text, doc):
+    # Replace entities found in doc and sensitive patterns in text
     try:
         logger.debug("Anonymising text")
-        doc = nlp(text)
-
-        # Patterns for sensitive data
-        patterns = {
-            'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-            'phone': r'\b(?:\+?1[-.\s]?)?\(?[0-9]{3}\)?[-.\s]?[0-9]{3}[-.\s]?[0-9]{4}\b',
-            'ssn': r'\b\d{3}-\d{2}-\d{4}\b',
-            'credit_card': r'\b(?:\d{4}[-\s]?){3}\d{4}\b'
-        }
-
-        # Replace named entities
-        for ent in doc.ents:
-            if ent.label_ in ['PERSON', 'ORG']:
-                text = text.replace(ent.text, f"[{ent.label_}]")
-
-        # Replace patterns
-        for key, pattern in patterns.items():
-            text = re.sub(pattern, f'[{key.upper()}]', text)
-
-        # Replace confidential terms
-        confidential_terms = ['confidential', 'secret', 'internal use only', 'proprietary']
-        for term in confidential_terms:
-            text = re.sub(r'\b' + re.escape(term) + r'\b', '[CONFIDENTIAL]', text, flags=re.IGNORECASE)
-
+        text = redact(text, ((ent.text, ent.label_) for ent in doc.ents))
         logger.debug("Text anonymisation complete")
         return text
     except Exception as e:
@@ -127,7 +273,7 @@ def preview_anonymized_pdf(input_path):
                 content = reader.pages[page_num].extract_text()
                 preview_text += f"--- Page {page_num + 1} ---\n{content}\n\n"
 
-            anonymizd_preview = anonymize_text(preview_text)
+            anonymized_preview = anonymise_text(preview_text)
             logger.info("Preview generation successful")
             return anonymized_preview
 
@@ -140,6 +286,8 @@ if __name__ == "__main__":
     parser.add_argument("input_pdf", help="Path to the input PDF file")
     parser.add_argument("-o", "--output", help="Path to the output anonymised PDF file")
     parser.add_argument("-p", "--preview", action="store_true", help="Generate a preview instead of anonymising")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of page worker processes")
+    parser.add_argument("-s", "--stats", action="store_true", help="Print per-page timing statistics")
     
     args = parser.parse_args()
 
@@ -151,5 +299,10 @@ if __name__ == "__main__":
         if not args.output:
             print("Error: Output path required for full anonymisation. Use -o or --output option.")
         else:
-            success = anonymize_pdf(args.input_pdf, args.output)
-            print("PDF anonymised successfully." if success else "PDF anonymisation failed. Check logs for details.")
\ No newline at end of file
+            page_stats = []
+            success = anonymize_pdf(args.input_pdf, args.output, workers=args.workers, page_stats=page_stats)
+            print("PDF anonymised successfully." if success else "PDF anonymisation failed. Check logs for details.")
+            if args.stats:
+                for timings in page_stats:
+                    print(f"Page {timings['page']}: extract {timings['extract_seconds']:.3f}s, anonymise {timings['anonymise_seconds']:.3f}s, "
+                          f"render {timings['render_seconds']:.3f}s, merge {timings['merge_seconds']:.3f}s")
\ No newline at end of file
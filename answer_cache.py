@@ -0,0 +1,100 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+# Persistent cache of LLM answers, keyed by model, prompt template version,
+# corpus fingerprint and normalised question. Entries expire after
+# ANSWER_CACHE_TTL seconds and the least recently used are evicted beyond
+# ANSWER_CACHE_MAX_ENTRIES.
+ANSWER_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH", "uploads/answer_cache.db")
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 20000))
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    model TEXT NOT NULL,
+    template_version INTEGER NOT NULL,
+    corpus_hash TEXT NOT NULL,
+    question TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, template_version, corpus_hash, question)
+);
+CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+"""
+
+# Function to normalise a question so trivial differences in case, spacing and trailing punctuation share an entry
+def normalize_question(question: str) -> str:
+    return re.sub(r'\s+', ' ', question).strip().rstrip('?.! ').lower()
+
+class AnswerCache:
+    def __init__(self, path: str = ANSWER_CACHE_PATH, ttl: int = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def get_many(self, model: str, template_version: int, corpus_hash: str, questions: List[str]) -> Dict[int, Dict]:
+        # Returns {question index: cached result} for the questions that hit
+        indices: Dict[str, List[int]] = {}
+        for i, question in enumerate(questions):
+            indices.setdefault(normalize_question(question), []).append(i)
+        now = time.time()
+        hits = {}
+        with self.lock:
+            conn = self._connection()
+            placeholders = ",".join("?" * len(indices))
+            rows = conn.execute(
+                f"SELECT question, result FROM answers WHERE model = ? AND template_version = ? AND corpus_hash = ? AND created_at > ? AND question IN ({placeholders})",
+                (model, template_version, corpus_hash, now - self.ttl, *indices)
+            ).fetchall() if indices else []
+            with conn:
+                conn.executemany(
+                    "UPDATE answers SET last_used = ? WHERE model = ? AND template_version = ? AND corpus_hash = ? AND question = ?",
+                    [(now, model, template_version, corpus_hash, question) for question, _ in rows]
+                )
+        for question, result in rows:
+            for i in indices[question]:
+                hits[i] = dict(json.loads(result), question=questions[i])
+        return hits
+
+    def put_many(self, model: str, template_version: int, corpus_hash: str, results: List[Dict]) -> None:
+        now = time.time()
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(model, template_version, corpus_hash, normalize_question(r["question"]), json.dumps(r), now, now) for r in results]
+                )
+                conn.execute("DELETE FROM answers WHERE created_at <= ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM answers WHERE rowid IN (SELECT rowid FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def clear(self) -> None:
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM answers")
+
+# Create a global instance of AnswerCache
+answer_cache = AnswerCache()
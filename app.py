@@ -1,23 +1,41 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Form, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Form
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from query_suggestions import router as query_suggestions_router
-from typing import List
+from query_suggestions import router as query_suggestions_router, SUGGESTION_MODE
+from typing import List, Optional
 import os
 import logging
 import json
 import shutil
-from anonymizer import anonymize_pdf, preview_anonymized_pdf
-from ai_handler import process_security_questions, get_tinybert_progress
+from anonymizer import anonymize_pdf, preview_anonymized_pdf as generate_anonymized_preview, get_nlp
+from ai_handler import process_security_questions, get_tinybert_progress, load_model_and_tokenizer, warm_up
+from model_registry import model_registry, preload_models, MODEL_PRELOAD
+from retrieval import DENSE_RETRIEVAL, check_embedding_model
+from jobs import job_manager, JobQueueFullError
+from work_pool import work_pool, PoolOverloadedError
 from users import get_users
+from text_cache import get_document_text
+from upload_store import (save_upload, safe_filename, is_allowed_upload, create_session, get_session, append_part,
+                          complete_session, remove_upload, get_upload_hash, link_anonymized, anonymization_lock,
+                          anonymized_temp_path, commit_anonymized, upload_path, sync_catalog, UploadTooLargeError,
+                          UploadSessionError, MAX_UPLOAD_SIZE)
+from corpus_catalog import corpus_catalog
 import asyncio
-import PyPDF2
+import fnmatch
+import functools
+import threading
 
-# Global variables
-analysis_results = None
-analysis_error = None
+# Number of files anonymised at once by the bulk endpoint
+BULK_ANONYMIZE_CONCURRENCY = int(os.environ.get("BULK_ANONYMIZE_CONCURRENCY", 2))
+
+# Load spaCy, torch and the other heavy libraries in a background thread after startup
+# instead of on the first request that needs them
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") == "1"
+
+# Seconds between checks for new answers on the analysis event stream
+PROCESS_EVENTS_INTERVAL = float(os.environ.get("PROCESS_EVENTS_INTERVAL", 0.25))
 
 # Logging setup
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -33,6 +51,57 @@ templates = Jinja2Templates(directory="templates")
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("uploads/anonymized", exist_ok=True)
 
+# Eagerly load configured models so the first analysis does not pay the load time
+@app.on_event("startup")
+async def preload_configured_models():
+    if MODEL_PRELOAD:
+        logger.info(f"Preloading models: {MODEL_PRELOAD}")
+        await asyncio.to_thread(preload_models, MODEL_PRELOAD, load_model_and_tokenizer)
+
+def warm_up_libraries():
+    try:
+        get_nlp()
+        warm_up()
+    except Exception as e:
+        logger.error(f"Warm-up failed, libraries will load on first use: {str(e)}")
+
+# Dense retrieval and semantic suggestions need encoder weights, so refuse to start without them
+@app.on_event("startup")
+async def check_embedding_model_configured():
+    if DENSE_RETRIEVAL or SUGGESTION_MODE == "semantic":
+        check_embedding_model()
+
+# Warm up without delaying startup, so the app serves requests straight away
+@app.on_event("startup")
+async def warm_up_in_background():
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up_libraries, name="warm-up", daemon=True).start()
+
+# Pick up files added or removed while the app was not running
+@app.on_event("startup")
+async def sync_corpus_catalog():
+    await asyncio.to_thread(sync_catalog)
+
+@app.on_event("shutdown")
+async def shutdown_work_pool():
+    work_pool.shutdown()
+
+# Reject work with 503 when the executor queue is full
+@app.exception_handler(PoolOverloadedError)
+async def pool_overloaded_handler(request: Request, exc: PoolOverloadedError):
+    logger.warning(f"Rejecting {request.url.path}: {str(exc)}")
+    return JSONResponse(content={"message": "Server is busy. Please try again later."}, status_code=503)
+
+# Reject oversized uploads from their Content-Length before the body is read
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if request.method in ("POST", "PUT") and request.url.path.startswith("/upload"):
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE:
+            logger.warning(f"Rejecting {request.url.path}: {content_length} bytes exceeds upload limit")
+            return JSONResponse(content={"message": "File too large"}, status_code=413)
+    return await call_next(request)
+
 # Pydantic model for question processing
 class ProcessQuestionsRequest(BaseModel):
     ai_model: str
@@ -63,51 +132,85 @@ async def read_root(request: Request):
 @app.get("/load_data", response_class=HTMLResponse)
 async def load_data(request: Request):
     logger.info("Accessing /load_data endpoint")
-    upload_dir = 'uploads'
-    uploaded_files = [f for f in os.listdir(upload_dir) if f.endswith(('.pdf', '.eml', '.msg'))]
-    logger.info(f"Files found in uploads directory: {uploaded_files}")
+    uploaded_files = corpus_catalog.uploaded_files()
+    logger.info(f"Files found in catalog: {uploaded_files}")
     return templates.TemplateResponse("load_data.html", {"request": request, "uploaded_files": uploaded_files})
 
 @app.post("/upload_pdf")
 async def upload_pdf(file: UploadFile = File(...)):
     logger.info(f"Uploading file: {file.filename}")
-    if not file.filename.lower().endswith(('.pdf', '.eml', '.msg')):
+    if not is_allowed_upload(file.filename):
         raise HTTPException(status_code=400, detail="Only PDF, EML, and MSG files are allowed")
-    
-    file_location = f"uploads/{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        file_object.write(file.file.read())
-    
-    return {"message": f"Successfully uploaded {file.filename}"}
+    try:
+        filename = safe_filename(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Copy in fixed-size chunks on a worker thread so large files never sit in memory
+    try:
+        upload = await asyncio.to_thread(save_upload, file.file, filename)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    return {"message": f"Successfully uploaded {filename}", **upload}
+
+# Pydantic model for starting a resumable upload
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+
+# Resumable uploads: start a session, PUT raw parts at increasing offsets, then complete
+@app.post("/uploads")
+async def start_resumable_upload(request: UploadSessionRequest):
+    if not is_allowed_upload(request.filename):
+        raise HTTPException(status_code=400, detail="Only PDF, EML, and MSG files are allowed")
+    try:
+        return await asyncio.to_thread(create_session, request.filename, request.size)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def resumable_upload_status(upload_id: str):
+    try:
+        return get_session(upload_id)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.put("/uploads/{upload_id}")
+async def upload_part(upload_id: str, request: Request, offset: int = 0):
+    try:
+        return await append_part(upload_id, offset, request.stream())
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadSessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_resumable_upload(upload_id: str, sha256: Optional[str] = None):
+    try:
+        upload = await asyncio.to_thread(complete_session, upload_id, sha256)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": f"Successfully uploaded {upload['filename']}", **upload}
 
 @app.get("/get_uploaded_pdfs")
 async def get_uploaded_pdfs():
     logger.info("Getting uploaded PDFs")
-    upload_dir = 'uploads'
-    uploaded_files = [f for f in os.listdir(upload_dir) if f.endswith(('.pdf', '.eml', '.msg'))]
+    uploaded_files = corpus_catalog.uploaded_files()
     return {"uploaded_pdfs": uploaded_files}
 
 @app.get("/get_anonymized_files")
 async def get_anonymized_files():
     logger.info("Getting anonymised PDFs")
-    anonymized_files = [f for f in os.listdir("uploads/anonymized") if f.endswith('.pdf')]
+    anonymized_files = corpus_catalog.anonymized_files()
     return {"anonymized_files": anonymized_files}
 
 @app.delete("/remove_pdf/{filename}")
 async def remove_pdf(filename: str):
     logger.info(f"Removing file: {filename}")
-    
-    original_path = f"uploads/{filename}"
-    if os.path.exists(original_path):
-        os.remove(original_path)
-        logger.info(f"Removed original file: {original_path}")
-    
-    anonymized_path = f"uploads/anonymized/anonymized_{filename}"
-    if os.path.exists(anonymized_path):
-        os.remove(anonymized_path)
-        logger.info(f"Removed anonymised file: {anonymized_path}")
-    
-    if not os.path.exists(original_path) and not os.path.exists(anonymized_path):
+    if await asyncio.to_thread(remove_upload, filename):
         return {"message": f"Successfully removed {filename}"}
     else:
         raise HTTPException(status_code=404, detail="File not found or could not be deleted")
@@ -119,13 +222,11 @@ async def preview_anonymized_pdf(filename: str):
         if not os.path.exists(anonymized_path):
             raise HTTPException(status_code=404, detail="Anonymised file not found")
 
-        with open(anonymized_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            preview_text = ""
-            for page in pdf_reader.pages:
-                preview_text += page.extract_text() + "\n\n"
+        preview_text = await work_pool.run(get_document_text, anonymized_path)
 
         return {"preview": preview_text}
+    except (HTTPException, PoolOverloadedError):
+        raise
     except Exception as e:
         logger.exception(f"Error previewing anonymised PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -139,8 +240,7 @@ async def check_anonymized(filename: str):
 @app.get("/anonymise_data", response_class=HTMLResponse)
 async def anonymise_data(request: Request):
     logger.info("Accessing /anonymise_data endpoint")
-    upload_dir = 'uploads'
-    uploaded_files = [f for f in os.listdir(upload_dir) if f.endswith(('.pdf', '.eml', '.msg'))]
+    uploaded_files = corpus_catalog.uploaded_files()
     return templates.TemplateResponse("anonymise_data.html", {"request": request, "uploaded_pdfs": uploaded_files})
 
 @app.post("/anonymize_pdf")
@@ -156,13 +256,12 @@ async def anonymize_pdf_route(request: Request):
         
         input_path = f"uploads/{filename}"
         output_filename = f"anonymized_{filename}"
-        output_path = f"uploads/anonymized/{output_filename}"
         
         if not os.path.exists(input_path):
             logger.error(f"File not found: {input_path}")
             raise HTTPException(status_code=404, detail="File not found")
         
-        success = anonymize_pdf(input_path, output_path)
+        success, _ = await anonymize_upload(filename, force=bool(json_body.get("force", False)))
         
         if success:
             logger.info(f"Successfully anonymised {filename}")
@@ -177,12 +276,97 @@ async def anonymize_pdf_route(request: Request):
                 "message": f"Failed to anonymise {filename}. Please try again."
             }, status_code=500)
     
+    except PoolOverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"Error during anonymisation process: {str(e)}")
         return JSONResponse(content={
             "message": f"An error occurred during the anonymisation process: {str(e)}"
         }, status_code=500)
 
+# Function to anonymise an upload once per distinct content, reusing the stored copy for duplicates
+async def anonymize_upload(filename, force=False, progress_callback=None):
+    sha256 = await asyncio.to_thread(get_upload_hash, filename)
+    async with anonymization_lock(sha256):
+        if not force and await asyncio.to_thread(link_anonymized, filename):
+            return True, True
+        tmp_path = anonymized_temp_path(sha256)
+        success = await work_pool.run(anonymize_pdf, upload_path(filename), tmp_path, progress_callback=progress_callback)
+        if success:
+            await asyncio.to_thread(commit_anonymized, filename, sha256, tmp_path)
+        return success, False
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/anonymize_bulk")
+async def anonymize_bulk(pattern: str = "*.pdf", force: bool = False):
+    # Anonymise every matching upload concurrently, streaming progress as Server-Sent Events
+    filenames = [f for f in corpus_catalog.uploaded_files() if f.lower().endswith('.pdf') and fnmatch.fnmatch(f, pattern)]
+    logger.info(f"Bulk anonymisation of {len(filenames)} files matching {pattern}")
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    semaphore = asyncio.Semaphore(BULK_ANONYMIZE_CONCURRENCY)
+
+    reported = set()
+
+    def report(filename, event, **data):
+        # Each file gets exactly one terminal event, which is what event_stream counts
+        if filename not in reported:
+            reported.add(filename)
+            events.put_nowait((event, {"filename": filename, **data}))
+
+    async def process_file(filename):
+        try:
+            if not force and await asyncio.to_thread(link_anonymized, filename):
+                report(filename, "file_skipped")
+                return
+            async with semaphore:
+                await events.put(("file_started", {"filename": filename}))
+
+                def on_page(pages_done, num_pages):
+                    loop.call_soon_threadsafe(events.put_nowait, ("page_progress", {"filename": filename, "page": pages_done, "pages": num_pages}))
+
+                # Callbacks cannot cross process boundaries, so page progress is thread-pool only
+                progress_callback = on_page if work_pool.kind == "thread" else None
+                success, deduplicated = await anonymize_upload(filename, force=force, progress_callback=progress_callback)
+            if success:
+                report(filename, "file_done", anonymized_file=f"/view_pdf/anonymized_{filename}", deduplicated=deduplicated)
+            else:
+                report(filename, "file_failed")
+        except Exception as e:
+            logger.exception(f"Bulk anonymisation failed for {filename}: {str(e)}")
+            report(filename, "file_failed")
+
+    def task_done(filename, task):
+        # Backstop for a task that died without reporting, so the stream still ends
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Bulk anonymisation task for {filename} died: {str(task.exception())}")
+        report(filename, "file_failed")
+
+    async def event_stream():
+        tasks = []
+        for filename in filenames:
+            task = asyncio.create_task(process_file(filename))
+            task.add_done_callback(functools.partial(task_done, filename))
+            tasks.append(task)
+        summary = {"done": 0, "skipped": 0, "failed": 0}
+        try:
+            yield sse_event("start", {"files": filenames})
+            finished = 0
+            while finished < len(filenames):
+                event, data = await events.get()
+                if event in ("file_done", "file_skipped", "file_failed"):
+                    finished += 1
+                    summary[event.split("_", 1)[1]] += 1
+                yield sse_event(event, data)
+            yield sse_event("complete", summary)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/preview_anonymized_pdf")
 async def preview_anonymized_pdf_route(request: Request):
     logger.info("Preview anonymised PDF route called")
@@ -200,12 +384,14 @@ async def preview_anonymized_pdf_route(request: Request):
             logger.error(f"File not found: {input_path}")
             raise HTTPException(status_code=404, detail="File not found")
 
-        preview_text = preview_anonymized_pdf(input_path)
+        preview_text = await work_pool.run(generate_anonymized_preview, input_path)
 
         return JSONResponse(content={
             "preview": preview_text
         }, status_code=200)
 
+    except PoolOverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"Error during preview process: {str(e)}")
         return JSONResponse(content={
@@ -223,8 +409,7 @@ async def view_pdf(filename: str):
 @app.get("/security_questions", response_class=HTMLResponse)
 async def security_questions(request: Request):
     questions = load_security_questions()
-    anonymized_dir = 'uploads/anonymized'
-    anonymized_files = [f for f in os.listdir(anonymized_dir) if f.endswith('.pdf')]
+    anonymized_files = corpus_catalog.anonymized_files()
     print(f"Anonymized files found: {anonymized_files}") 
     return templates.TemplateResponse("security_questions.html", {
         "request": request, 
@@ -233,56 +418,104 @@ async def security_questions(request: Request):
     })
 
 @app.post("/process_questions")
-async def process_questions(request: ProcessQuestionsRequest, background_tasks: BackgroundTasks):
+async def process_questions(request: ProcessQuestionsRequest):
     logger.info("Processing security questions")
-    global analysis_results, analysis_error
     try:
-        async def process_in_background():
-            global analysis_results, analysis_error
-            try:
-                results = process_security_questions(
-                    request.ai_model,
-                    request.api_key,
-                    request.questions,
-                    "uploads/anonymized"
-                )
-                analysis_results = results
-                analysis_error = None
-            except Exception as e:
-                logger.exception(f"Error in background task: {str(e)}")
-                analysis_error = str(e)
-                analysis_results = None
-
-        analysis_results = None
-        analysis_error = None
-
-        background_tasks.add_task(process_in_background)
-
-        return JSONResponse(content={"message": "Processing started in the background"}, status_code=202)
+        job_id = job_manager.submit(
+            process_security_questions,
+            request.ai_model,
+            request.api_key,
+            request.questions,
+            "uploads/anonymized"
+        )
+        return JSONResponse(content={"message": "Processing started in the background", "job_id": job_id}, status_code=202)
+    except JobQueueFullError as e:
+        logger.warning(f"Rejecting analysis request: {str(e)}")
+        raise HTTPException(status_code=503, detail="Too many analyses in progress. Please try again later.")
+    except PoolOverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"Error setting up background task: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/process_status")
-async def process_status():
-    global analysis_results, analysis_error
-    if analysis_error:
-        return JSONResponse(content={"status": "error", "message": analysis_error}, status_code=500)
-    elif analysis_results:
-        return JSONResponse(content={"status": "complete", "results": analysis_results}, status_code=200)
+def job_status_response(job):
+    if job["status"] == "error":
+        return JSONResponse(content={"status": "error", "job_id": job["job_id"], "message": job["error"]}, status_code=500)
+    elif job["status"] == "complete":
+        return JSONResponse(content={"status": "complete", "job_id": job["job_id"], "results": job["results"], "usage": job["usage"]}, status_code=200)
     else:
+        return JSONResponse(content={"status": "processing", "job_id": job["job_id"], "state": job["status"], "progress": job["progress"], "usage": job["usage"], "partial_results": job["partial_results"]}, status_code=202)
+
+@app.get("/process_status/{job_id}")
+async def process_status(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job_status_response(job)
+
+@app.get("/process_events/{job_id}")
+async def process_events(job_id: str):
+    # Stream each answer as soon as it is final, then the full results, as Server-Sent Events
+    if job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def event_stream():
+        sent = set()
+        progress = None
+        while True:
+            job = job_manager.get(job_id)
+            if job is None:
+                yield sse_event("error", {"message": "Job not found or expired"})
+                return
+            for index in sorted(set(job["partial_results"]) - sent):
+                sent.add(index)
+                yield sse_event("result", {"index": index, "result": job["partial_results"][index]})
+            if job["status"] == "complete":
+                yield sse_event("complete", {"results": job["results"], "usage": job["usage"]})
+                return
+            if job["status"] == "error":
+                yield sse_event("error", {"message": job["error"]})
+                return
+            if (job["progress"], job["usage"]) != progress:
+                progress = (job["progress"], job["usage"])
+                yield sse_event("progress", {"progress": job["progress"], "usage": job["usage"]})
+            await asyncio.sleep(PROCESS_EVENTS_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/process_status")
+async def latest_process_status():
+    # Status of the most recent job, for clients that do not track job IDs
+    job = job_manager.latest()
+    if job is None:
         return JSONResponse(content={"status": "processing"}, status_code=202)
+    return job_status_response(job)
 
 @app.get("/result", response_class=HTMLResponse)
-async def result(request: Request):
-    global analysis_results
-    return templates.TemplateResponse("result.html", {"request": request, "results": analysis_results})
+async def result(request: Request, job_id: Optional[str] = None):
+    job = job_manager.get(job_id) if job_id else job_manager.latest(status="complete")
+    results = job["results"] if job and job["status"] == "complete" else None
+    return templates.TemplateResponse("result.html", {"request": request, "results": results})
 
 @app.get("/get_users")
 async def get_users_list():
     users = get_users()
     return {"users": users}
 
+@app.get("/model_registry")
+async def model_registry_stats():
+    return model_registry.stats()
+
+@app.get("/health")
+async def health():
+    # Load and resource usage of the worker pool, document catalog and model registry
+    return {
+        "status": "ok",
+        "work_pool": work_pool.stats(),
+        "corpus": await asyncio.to_thread(corpus_catalog.stats),
+        "models": model_registry.stats(),
+    }
+
 @app.get("/get_tinybert_progress")
 async def tinybert_progress():
     progress = get_tinybert_progress()
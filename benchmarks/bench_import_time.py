@@ -0,0 +1,62 @@
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that must only load on first use or during the background warm-up
+HEAVY_MODULES = ["torch", "transformers", "spacy", "nltk", "openai", "anthropic", "tiktoken", "sklearn", "scipy", "onnxruntime"]
+
+def import_profile(module):
+    # Import module in a fresh interpreter and return ({module: cumulative seconds}, loaded heavy modules)
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, WARMUP_ON_STARTUP="0")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        if total.strip().isdigit():
+            cumulative.setdefault(name.strip(), int(total) / 1e6)
+    loaded = [m for m in result.stdout.strip().splitlines()[-1].split(",") if m] if result.stdout.strip() else []
+    return cumulative, loaded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the import time of the app and check heavy libraries stay lazy.")
+    parser.add_argument("--module", default="app", help="Module to import")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+    parser.add_argument("--budget", type=float, default=3.0, help="Fail if the import takes longer than this many seconds")
+    parser.add_argument("--libraries", action="store_true", help="Also time each heavy library on its own, i.e. what first use costs")
+    args = parser.parse_args()
+
+    cumulative, loaded = import_profile(args.module)
+    total = cumulative.get(args.module, 0.0)
+    print(f"import {args.module}: {total:.2f}s")
+    # Slowest modules by cumulative import time, the module itself excluded
+    print(f"{'module':<30} {'seconds':>8}")
+    for name, seconds in sorted(cumulative.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"{name:<30} {seconds:>8.3f}")
+
+    if args.libraries:
+        print()
+        print(f"{'library':<30} {'first use s':>11}")
+        for library in HEAVY_MODULES:
+            try:
+                seconds = import_profile(library)[0].get(library, 0.0)
+                print(f"{library:<30} {seconds:>11.2f}")
+            except RuntimeError:
+                print(f"{library:<30} {'missing':>11}")
+
+    failures = []
+    if loaded:
+        failures.append(f"heavy libraries imported eagerly: {', '.join(loaded)}")
+    if total > args.budget:
+        failures.append(f"import took {total:.2f}s, budget is {args.budget:.2f}s")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK: heavy libraries load lazily")
@@ -0,0 +1,112 @@
+import os
+import re
+import sys
+import time
+import string
+import argparse
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from model_backends import MODEL_BACKENDS, apply_backend, state_dict_bytes
+from model_registry import model_size_bytes
+from qa_engine import WindowIndex, build_windows, batched_extractive_answers
+
+# Fixed (document, question, expected answer) triples in the style of vendor security questionnaires
+FIXTURE = [
+    ("All customer data stored in our platform is encrypted at rest using AES-256. Encryption keys are managed in a dedicated hardware security module and rotated every twelve months.",
+     "What algorithm is used to encrypt data at rest?", "AES-256"),
+    ("Data in transit between clients and our services is protected with TLS 1.2 or higher. Older protocol versions are disabled on every public endpoint.",
+     "Which protocol protects data in transit?", "TLS 1.2 or higher"),
+    ("Encryption keys are stored in a hardware security module operated by the security engineering team. Keys are rotated every twelve months or immediately after a suspected compromise.",
+     "How often are encryption keys rotated?", "every twelve months"),
+    ("Backups of production databases are taken every six hours and copied to a second region. Restores are tested quarterly by the infrastructure team.",
+     "How often are production backups taken?", "every six hours"),
+    ("Access to production systems requires multi-factor authentication and is granted through single sign-on. Access rights are reviewed quarterly by system owners.",
+     "How often are access rights reviewed?", "quarterly"),
+    ("Our incident response plan requires affected customers to be notified within 72 hours of a confirmed breach. The plan is exercised twice a year.",
+     "How soon are customers notified of a breach?", "within 72 hours"),
+    ("An independent auditor performs a SOC 2 Type II assessment every year. The most recent report is available to customers under a non-disclosure agreement.",
+     "Which audit is performed by an independent auditor?", "SOC 2 Type II"),
+    ("External penetration tests are carried out annually by a CREST accredited firm. Critical findings must be remediated within 14 days.",
+     "Within what time must critical findings be remediated?", "within 14 days"),
+    ("Security awareness training is mandatory for all employees during onboarding and is repeated annually. Completion is tracked by the human resources department.",
+     "Who tracks completion of security training?", "the human resources department"),
+    ("Audit logs are retained for one year and stored in a write-once bucket. Alerts on suspicious activity are routed to the security operations centre.",
+     "How long are audit logs retained?", "one year"),
+]
+
+def normalize_answer(text):
+    # SQuAD answer normalisation: lower case, no punctuation, articles or extra whitespace
+    text = "".join(ch for ch in text.lower() if ch not in string.punctuation)
+    return " ".join(re.sub(r"\b(a|an|the)\b", " ", text).split())
+
+def f1_score(prediction, expected):
+    predicted_tokens, expected_tokens = normalize_answer(prediction).split(), normalize_answer(expected).split()
+    common = sum((Counter(predicted_tokens) & Counter(expected_tokens)).values())
+    if not common:
+        return 0.0
+    precision, recall = common / len(predicted_tokens), common / len(expected_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+def run_fixture(model, tokenizer, device, index, batch_size, repeat):
+    # Answer every question against every fixture window, as the app does with its
+    # candidate windows; a question's own document is the window it is scored on
+    window_ids = list(range(len(index)))
+    latencies = []
+    answers = []
+    for _ in range(repeat):
+        answers = []
+        for position, (_, question, _) in enumerate(FIXTURE):
+            start = time.perf_counter()
+            results = batched_extractive_answers(model, tokenizer, device, question, index, window_ids, batch_size)
+            latencies.append(time.perf_counter() - start)
+            answers.append(results[position][0])
+    return answers, latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare accuracy and throughput of the QA inference backends.")
+    # The bundled local_model directory has no weights, so the model has to be named explicitly
+    parser.add_argument("--model", required=True,
+                        help="Extractive QA model name or path with weights, e.g. distilbert-base-cased-distilled-squad")
+    parser.add_argument("--backends", default=",".join(MODEL_BACKENDS), help="Comma-separated backends to compare")
+    parser.add_argument("--batch-size", type=int, default=16, help="Windows per inference batch")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the fixture per backend")
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads, 0 keeps the default")
+    args = parser.parse_args()
+
+    import torch
+    from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cpu")
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    base_model = AutoModelForQuestionAnswering.from_pretrained(args.model).eval()
+    windows = build_windows([(document, f"doc{i}", 1) for i, (document, _, _) in enumerate(FIXTURE)])
+    assert len(windows) == len(FIXTURE), "each fixture document must fit in one window"
+    index = WindowIndex(tokenizer, windows)
+    name = os.path.basename(os.path.normpath(args.model))
+
+    print(f"model {args.model}: {len(FIXTURE)} questions x {len(windows)} windows, {torch.get_num_threads()} threads")
+    print(f"{'backend':<10} {'prepare s':>9} {'size MB':>8} {'windows/s':>10} {'p50 ms':>8} {'EM':>6} {'F1':>6} {'agree':>6}")
+    reference = None
+    for backend in args.backends.split(","):
+        try:
+            start = time.perf_counter()
+            model = apply_backend(base_model, tokenizer, backend, name, device)
+            prepare_seconds = time.perf_counter() - start
+        except Exception as e:
+            print(f"{backend:<10} unavailable: {str(e).splitlines()[0]}")
+            continue
+        size = state_dict_bytes(model) if backend == "torch" else model_size_bytes(model)
+        # One untimed pass so lazy initialisation does not count towards throughput
+        run_fixture(model, tokenizer, device, index, args.batch_size, 1)
+        answers, latencies = run_fixture(model, tokenizer, device, index, args.batch_size, args.repeat)
+        throughput = len(latencies) * len(windows) / sum(latencies)
+        p50 = sorted(latencies)[len(latencies) // 2] * 1000
+        exact = sum(normalize_answer(a) == normalize_answer(e) for a, (_, _, e) in zip(answers, FIXTURE)) / len(FIXTURE)
+        f1 = sum(f1_score(a, e) for a, (_, _, e) in zip(answers, FIXTURE)) / len(FIXTURE)
+        # Share of answers identical to the first backend's, i.e. how much the conversion changed the output
+        reference = reference or answers
+        agree = sum(a == r for a, r in zip(answers, reference)) / len(FIXTURE)
+        print(f"{backend:<10} {prepare_seconds:>9.2f} {size / 1024 / 1024:>8.1f} {throughput:>10.1f} {p50:>8.1f} {exact:>6.2f} {f1:>6.2f} {agree:>6.2f}")
@@ -0,0 +1,87 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from redaction import PATTERNS, CONFIDENTIAL_TERMS, ENTITY_LABELS, redact
+
+def legacy_redact(text, entities):
+    # Previous multi-pass implementation: one str.replace per entity, one re.sub per pattern
+    for entity_text, label in entities:
+        if label in ENTITY_LABELS:
+            text = text.replace(entity_text, f"[{label}]")
+    for key, pattern in PATTERNS.items():
+        text = re.sub(pattern, f'[{key.upper()}]', text)
+    for term in CONFIDENTIAL_TERMS:
+        text = re.sub(r'\b' + re.escape(term) + r'\b', '[CONFIDENTIAL]', text, flags=re.IGNORECASE)
+    return text
+
+def make_page(size_bytes, num_entities, seed=0):
+    # Build a synthetic page with entities, contact details and confidential markers
+    rng = random.Random(seed)
+    entities = [(f"Person{i} Surname{i}", "PERSON") for i in range(num_entities // 2)]
+    entities += [(f"Vendor{i} Holdings", "ORG") for i in range(num_entities - len(entities))]
+    filler = "the supplier encrypts data at rest and reviews access controls quarterly".split()
+    words = []
+    length = 0
+    while length < size_bytes:
+        roll = rng.random()
+        if roll < 0.02:
+            word = rng.choice(entities)[0]
+        elif roll < 0.025:
+            word = f"user{rng.randint(1, 999)}@example.com"
+        elif roll < 0.03:
+            word = f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+        elif roll < 0.032:
+            word = rng.choice(["Confidential", "internal use only", "SECRET"])
+        else:
+            word = rng.choice(filler)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words), entities
+
+# Text where entities and patterns overlap or touch, with the entities each page was given
+OVERLAP_CASES = [
+    ("Mail John.Smith@acme.com now", [("John", "PERSON")]),
+    ("Contact acme.support@acme.com or Acme Holdings", [("acme", "ORG"), ("Acme Holdings", "ORG")]),
+    ("Call John at 555-123-4567 or John555-123-4567", [("John", "PERSON")]),
+    ("SSN 123-45-6789 belongs to Jane Doe, Jane's card is 4111 1111 1111 1111", [("Jane Doe", "PERSON"), ("Jane", "PERSON")]),
+    ("Secret Labs marked this SECRET and confidential", [("Secret Labs", "ORG")]),
+    ("Ask Bob-555-123-4567@example.com about internal use only data", [("Bob", "PERSON"), ("example", "ORG")]),
+    ("Proprietary notes from Smith, Smith & Co: smith@smithco.com", [("Smith & Co", "ORG"), ("Smith", "PERSON")]),
+]
+
+def check_output(text, entities):
+    # The single-pass engine must produce exactly what the legacy passes produce
+    expected, actual = legacy_redact(text, entities), redact(text, entities)
+    if actual != expected:
+        raise AssertionError(f"Output differs from legacy redaction:\n  legacy: {expected[:200]!r}\n  engine: {actual[:200]!r}")
+
+def throughput(func, text, entities, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(text, entities)
+    elapsed = (time.perf_counter() - start) / repeat
+    return len(text.encode('utf-8')) / elapsed / 1024 / 1024, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark single-pass redaction against the legacy multi-pass version.")
+    parser.add_argument("--sizes", default="64,512,2048", help="Comma-separated page sizes in KB")
+    parser.add_argument("--entities", type=int, default=50, help="Number of distinct entities per page")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement")
+    args = parser.parse_args()
+
+    for text, entities in OVERLAP_CASES:
+        check_output(text, entities)
+    print(f"Output matches legacy redaction on {len(OVERLAP_CASES)} overlap cases")
+
+    print(f"{'page KB':>8} {'legacy MB/s':>12} {'single-pass MB/s':>17} {'speedup':>8}")
+    for size_kb in (int(size) for size in args.sizes.split(",")):
+        text, entities = make_page(size_kb * 1024, args.entities)
+        check_output(text, entities)
+        legacy_mbps, legacy_time = throughput(legacy_redact, text, entities, args.repeat)
+        engine_mbps, engine_time = throughput(redact, text, entities, args.repeat)
+        print(f"{size_kb:>8} {legacy_mbps:>12.1f} {engine_mbps:>17.1f} {legacy_time / engine_time:>7.1f}x")
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from security_questions_data import SECURITY_QUESTIONS
+from question_index import QuestionIndex, normalize_query
+
+def legacy_suggestions(questions, partial_input, limit=5):
+    # Previous implementation: lower-case and scan every question on each query
+    partial_input = partial_input.lower()
+    return [q for q in questions if partial_input in q.lower()][:limit]
+
+def make_questions(count, seed=0):
+    # Vary the bundled questions with system names and scopes to reach the requested corpus size
+    rng = random.Random(seed)
+    systems = [f"system{i}" for i in range(500)] + ["payroll", "CRM", "data warehouse", "VPN", "email", "HR portal"]
+    scopes = ["for contractors", "in production", "across regions", "for remote staff", "during audits", ""]
+    questions = list(SECURITY_QUESTIONS)
+    while len(questions) < count:
+        base = rng.choice(SECURITY_QUESTIONS).rstrip("?.")
+        questions.append(f"{base} for {rng.choice(systems)} {rng.choice(scopes)}".strip() + "?")
+    return questions[:count]
+
+def make_queries(questions, count, seed=1):
+    # Keystroke-style prefixes of words and phrases taken from the corpus, plus some misses
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        words = rng.choice(questions).split()
+        start = rng.randrange(len(words))
+        phrase = " ".join(words[start:start + rng.randint(1, 3)])
+        if rng.random() < 0.1:
+            phrase = phrase[::-1]
+        queries.append(phrase[:rng.randint(3, max(3, len(phrase)))])
+    return queries
+
+def add_typo(text, rng):
+    # Swap, drop or double one character, as a fast typist would
+    position = rng.randrange(max(1, len(text) - 1))
+    kind = rng.choice(("swap", "drop", "double"))
+    if kind == "swap":
+        return text[:position] + text[position + 1:position + 2] + text[position] + text[position + 2:]
+    if kind == "drop":
+        return text[:position] + text[position + 1:]
+    return text[:position] + text[position] + text[position:]
+
+def make_typo_queries(questions, count, seed=2):
+    # (query, intended words) pairs: one or two words from a question, with a typo in a word long enough to tolerate it
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        words = [word.strip("?,.()'") for word in rng.choice(questions).split()]
+        start = rng.randrange(len(words))
+        phrase = [word for word in words[start:start + rng.randint(1, 2)] if word]
+        long_words = [i for i, word in enumerate(phrase) if len(word) >= 5]
+        if not long_words:
+            continue
+        intended = [word.lower() for word in phrase]
+        i = rng.choice(long_words)
+        phrase[i] = add_typo(phrase[i], rng)
+        queries.append((" ".join(phrase), intended))
+    return queries
+
+def latencies(func, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indexed question suggestions against the legacy linear scan.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated corpus sizes in questions")
+    parser.add_argument("--queries", type=int, default=500, help="Queries per measurement")
+    parser.add_argument("--fuzzy-sizes", default="1000,10000,50000", help="Comma-separated corpus sizes for the typo-tolerant ranking")
+    args = parser.parse_args()
+
+    print(f"{'questions':>10} {'build ms':>9} {'scan p50':>9} {'scan p99':>9} {'index p50':>10} {'index p99':>10} {'p99 speedup':>12}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        questions = make_questions(size)
+        queries = make_queries(questions, args.queries)
+        start = time.perf_counter()
+        index = QuestionIndex(questions)
+        build_ms = (time.perf_counter() - start) * 1000
+        # Both must return the same set of matches; only their order differs
+        for query in queries[:50]:
+            expected = {normalize_query(q) for q in questions if normalize_query(query) in normalize_query(q)}
+            assert {normalize_query(q) for q in index.search(query, len(questions))} == expected, query
+        scan_p50, scan_p99 = latencies(lambda query: legacy_suggestions(questions, query), queries)
+        index_p50, index_p99 = latencies(index.search, queries)
+        print(f"{size:>10} {build_ms:>9.0f} {scan_p50:>9.2f} {scan_p99:>9.2f} {index_p50:>10.3f} {index_p99:>10.3f} {scan_p99 / index_p99:>11.1f}x")
+
+    print()
+    print(f"{'questions':>10} {'fuzzy p50':>10} {'fuzzy p99':>10} {'top-5 hit rate':>15}")
+    for size in (int(size) for size in args.fuzzy_sizes.split(",")):
+        questions = make_questions(size)
+        index = QuestionIndex(questions)
+        queries = make_typo_queries(questions, args.queries)
+        fuzzy_p50, fuzzy_p99 = latencies(index.fuzzy_search, [query for query, _ in queries])
+        # A hit means some suggestion contains every word the query was meant to have
+        hits = sum(1 for query, intended in queries
+                   if any(all(word in normalize_query(q) for word in intended) for q in index.fuzzy_search(query)))
+        print(f"{size:>10} {fuzzy_p50:>10.3f} {fuzzy_p99:>10.3f} {hits / len(queries):>14.0%}")
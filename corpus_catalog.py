@@ -0,0 +1,120 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+# Catalog of uploaded files and their anonymised copies, persisted as SQLite.
+# It is updated as files are uploaded, anonymised and removed, so listings and
+# corpus loading never have to rescan the upload directories.
+CATALOG_PATH = os.environ.get("CORPUS_CATALOG_PATH", "uploads/catalog.db")
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    uploaded_at REAL NOT NULL,
+    anonymized_sha256 TEXT,
+    page_count INTEGER,
+    extraction_status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_anonymized_sha256 ON files (anonymized_sha256);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta VALUES ('generation', 0);
+"""
+
+class CorpusCatalog:
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def _write(self, sql: str, params=()) -> None:
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(sql, params)
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    @property
+    def generation(self) -> int:
+        # Bumped on every change, by any worker process, so callers can cache anything derived from the corpus
+        return self._read("SELECT value FROM meta WHERE key = 'generation'")[0]["value"]
+
+    def _read(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self.lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def record_upload(self, filename: str, sha256: str, size: int) -> None:
+        # New content invalidates the anonymised copy of the old content
+        now = time.time()
+        self._write("""
+            INSERT INTO files (filename, sha256, size, uploaded_at, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (filename) DO UPDATE SET
+                anonymized_sha256 = CASE WHEN files.sha256 = excluded.sha256 THEN files.anonymized_sha256 END,
+                page_count = CASE WHEN files.sha256 = excluded.sha256 THEN files.page_count END,
+                extraction_status = CASE WHEN files.sha256 = excluded.sha256 THEN files.extraction_status ELSE 'pending' END,
+                error = CASE WHEN files.sha256 = excluded.sha256 THEN files.error END,
+                sha256 = excluded.sha256, size = excluded.size, uploaded_at = excluded.uploaded_at, updated_at = excluded.updated_at
+        """, (filename, sha256, size, now, now))
+
+    def record_anonymized(self, filename: str, anonymized_sha256: str, page_count: Optional[int], error: Optional[str] = None) -> None:
+        status = "failed" if error else "extracted"
+        self._write(
+            "UPDATE files SET anonymized_sha256 = ?, page_count = ?, extraction_status = ?, error = ?, updated_at = ? WHERE filename = ?",
+            (anonymized_sha256, page_count, status, error, time.time(), filename)
+        )
+
+    def clear_anonymized(self, filename: str) -> None:
+        self._write(
+            "UPDATE files SET anonymized_sha256 = NULL, page_count = NULL, extraction_status = 'pending', error = NULL, updated_at = ? WHERE filename = ?",
+            (time.time(), filename)
+        )
+
+    def remove(self, filename: str) -> None:
+        self._write("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def get(self, filename: str) -> Optional[Dict]:
+        rows = self._read("SELECT * FROM files WHERE filename = ?", (filename,))
+        return dict(rows[0]) if rows else None
+
+    def uploaded_files(self) -> List[str]:
+        return [row["filename"] for row in self._read("SELECT filename FROM files ORDER BY filename")]
+
+    def anonymized_files(self) -> List[str]:
+        rows = self._read("SELECT filename FROM files WHERE anonymized_sha256 IS NOT NULL ORDER BY filename")
+        return [f"anonymized_{row['filename']}" for row in rows]
+
+    def corpus_files(self) -> List[str]:
+        # One anonymised file per distinct content, in the order a directory listing would give
+        rows = self._read("""
+            SELECT MIN(filename) AS filename FROM files
+            WHERE anonymized_sha256 IS NOT NULL AND extraction_status = 'extracted' AND filename LIKE '%.pdf'
+            GROUP BY anonymized_sha256 ORDER BY filename
+        """)
+        return [f"anonymized_{row['filename']}" for row in rows]
+
+    def stats(self) -> Dict:
+        rows = self._read("SELECT extraction_status, COUNT(*) AS files, SUM(page_count) AS pages FROM files GROUP BY extraction_status")
+        return {row["extraction_status"]: {"files": row["files"], "pages": row["pages"] or 0} for row in rows}
+
+# Create a global instance of CorpusCatalog
+corpus_catalog = CorpusCatalog()
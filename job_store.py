@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+# Where job records live: "memory" keeps them in this process, "sqlite" shares
+# them between worker processes through JOB_STORE_PATH
+JOB_STORE = os.environ.get("JOB_STORE", "memory")
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", "uploads/jobs.db")
+
+PENDING_STATUSES = ("queued", "processing")
+
+# Job records held in a dict, visible to this process only
+class MemoryJobStore:
+    def __init__(self):
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def create(self, job: Dict[str, Any], max_pending: int) -> bool:
+        with self.lock:
+            if sum(1 for j in self.jobs.values() if j["status"] in PENDING_STATUSES) >= max_pending:
+                return False
+            self.jobs[job["job_id"]] = dict(job, partial_results={})
+            return True
+
+    def update(self, job_id: str, **fields) -> None:
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+
+    def add_partial_result(self, job_id: str, index: int, result: Any) -> None:
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id]["partial_results"][index] = result
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def latest(self, status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if status is None or job["status"] == status]
+            return self._snapshot(max(jobs, key=lambda job: job["created_at"])) if jobs else None
+
+    def evict_expired(self, ttl: float) -> None:
+        now = time.time()
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items() if job["finished_at"] and now - job["finished_at"] > ttl]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def _snapshot(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        # Copy the partial results too, since the worker keeps adding to them
+        return dict(job, partial_results=dict(job["partial_results"]))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL,
+    results TEXT,
+    usage TEXT,
+    error TEXT,
+    worker_pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    question_index INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (job_id, question_index)
+);
+"""
+
+# Columns holding JSON-encoded values
+JSON_FIELDS = ("results", "usage")
+
+# Job records in SQLite, so any worker process can report on a job started by another
+class SQLiteJobStore:
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def create(self, job: Dict[str, Any], max_pending: int) -> bool:
+        with self.lock:
+            conn = self._connection()
+            # The immediate transaction makes the capacity check and insert atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                placeholders = ",".join("?" * len(PENDING_STATUSES))
+                pending = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({placeholders})", PENDING_STATUSES).fetchone()[0]
+                if pending >= max_pending:
+                    conn.execute("ROLLBACK")
+                    return False
+                row = {key: json.dumps(value) if key in JSON_FIELDS else value for key, value in job.items()}
+                conn.execute(f"INSERT INTO jobs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", tuple(row.values()))
+                conn.execute("COMMIT")
+                return True
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def update(self, job_id: str, **fields) -> None:
+        values = [json.dumps(value) if key in JSON_FIELDS else value for key, value in fields.items()]
+        with self.lock:
+            self._connection().execute(
+                f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE job_id = ?",
+                (*values, job_id)
+            )
+
+    def add_partial_result(self, job_id: str, index: int, result: Any) -> None:
+        with self.lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO job_results (job_id, question_index, result) VALUES (?, ?, ?)",
+                (job_id, index, json.dumps(result))
+            )
+
+    def _job(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = {key: json.loads(row[key]) if key in JSON_FIELDS and row[key] is not None else row[key] for key in row.keys()}
+        partial = self._connection().execute("SELECT question_index, result FROM job_results WHERE job_id = ?", (job["job_id"],)).fetchall()
+        job["partial_results"] = {index: json.loads(result) for index, result in partial}
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self._job(self._connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+    def latest(self, status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if status is None:
+                row = self._connection().execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT 1").fetchone()
+            else:
+                row = self._connection().execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT 1", (status,)).fetchone()
+            return self._job(row)
+
+    def evict_expired(self, ttl: float) -> None:
+        cutoff = time.time() - ttl
+        with self.lock:
+            # Results go first, so an interrupted eviction never leaves results without their job
+            conn = self._connection()
+            conn.execute("DELETE FROM job_results WHERE job_id IN (SELECT job_id FROM jobs WHERE finished_at < ?)", (cutoff,))
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+
+# Function to create the job store selected by JOB_STORE
+def create_job_store(kind: str = JOB_STORE):
+    if kind == "memory":
+        return MemoryJobStore()
+    if kind == "sqlite":
+        return SQLiteJobStore()
+    raise ValueError(f"Unsupported job store: {kind}")
@@ -0,0 +1,123 @@
+import os
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from job_store import PENDING_STATUSES, create_job_store
+from work_pool import work_pool
+
+# Job subsystem settings
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", 32))
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 3600))
+JOB_EVICT_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+class JobQueueFullError(Exception):
+    pass
+
+# Background jobs run on a bounded worker pool. Every queued or running job
+# also holds a work_pool slot, so jobs and request work share one concurrency
+# limit and overload is rejected the same way. Each job has its own status,
+# progress and result record; finished jobs are kept for JOB_RESULT_TTL
+# seconds and then evicted. Records live in a job store, so with the SQLite
+# store any worker process can report on jobs started by the others.
+class JobManager:
+    def __init__(self, max_workers: int = JOB_WORKERS, max_queued: int = JOB_MAX_QUEUED, result_ttl: int = JOB_RESULT_TTL, store=None, pool=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.pool = pool if pool is not None else work_pool
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.store = store if store is not None else create_job_store()
+        self.last_eviction = 0.0
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> str:
+        # func receives a progress callback taking a fraction between 0 and 1, a
+        # usage callback taking the API token usage so far and a result callback
+        # taking (question index, result) as soon as an answer is final
+        self._evict_expired()
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "progress": 0.0,
+            "results": None,
+            "usage": None,
+            "error": None,
+            "worker_pid": os.getpid(),
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        # Raises PoolOverloadedError, answered with a 503, when the shared limit is reached
+        self.pool.acquire()
+        try:
+            if not self.store.create(job, self.max_queued):
+                raise JobQueueFullError(f"Too many pending jobs (limit {self.max_queued})")
+            self.executor.submit(self._run, job_id, func, args, kwargs)
+        except BaseException:
+            self.pool.release()
+            raise
+        logger.info(f"Queued job {job_id}")
+        return job_id
+
+    def _run(self, job_id: str, func: Callable[..., Any], args, kwargs) -> None:
+        try:
+            self._update(job_id, status="processing", started_at=time.time())
+            results = func(
+                *args,
+                progress_callback=lambda fraction: self._update(job_id, progress=round(100.0 * fraction, 1)),
+                usage_callback=lambda usage: self._update(job_id, usage=usage),
+                result_callback=lambda index, result: self.store.add_partial_result(job_id, index, result),
+                **kwargs
+            )
+            self._update(job_id, status="complete", progress=100.0, results=results, finished_at=time.time())
+            logger.info(f"Job {job_id} complete")
+        except Exception as e:
+            logger.exception(f"Error in job {job_id}: {str(e)}")
+            self._update(job_id, status="error", error=str(e), finished_at=time.time())
+        finally:
+            self.pool.release()
+
+    def _update(self, job_id: str, **fields) -> None:
+        self.store.update(job_id, **fields)
+
+    def _evict_expired(self) -> None:
+        # Status polls are frequent, so expired jobs are swept at most once per JOB_EVICT_INTERVAL
+        now = time.time()
+        if now - self.last_eviction >= JOB_EVICT_INTERVAL:
+            self.last_eviction = now
+            self.store.evict_expired(self.result_ttl)
+
+    def _check_worker(self, job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # A job whose worker process has exited will never finish, so report it as failed
+        if job is None or job["status"] not in PENDING_STATUSES or process_alive(job["worker_pid"]):
+            return job
+        fields = {"status": "error", "error": "The worker running this job exited before it finished", "finished_at": time.time()}
+        self._update(job["job_id"], **fields)
+        return dict(job, **fields)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._evict_expired()
+        return self._check_worker(self.store.get(job_id))
+
+    def latest(self, status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        self._evict_expired()
+        return self._check_worker(self.store.latest(status))
+
+# Function to check whether a process on this host is still running
+def process_alive(pid: Optional[int]) -> bool:
+    if not pid or pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Create a global instance of JobManager
+job_manager = JobManager()
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Dispatcher settings for concurrent LLM API calls
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 4))
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", 50))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 400000))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 5))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 1.0))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 60.0))
+
+# HTTP statuses worth retrying: timeouts, rate limits and server-side overload
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+logger = logging.getLogger(__name__)
+
+# Token bucket refilled continuously at rate_per_minute, holding at most one minute's
+# budget. Callers reserve tokens up front (the balance may go negative) and sleep
+# until their reservation is covered, so the bucket can be shared by jobs running
+# on different threads and event loops.
+class TokenBucket:
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        # Requests larger than the bucket wait for a full bucket rather than forever
+        amount = min(amount, self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+# Request-per-minute and token-per-minute budgets for one API
+class RateLimiter:
+    def __init__(self, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens: int) -> None:
+        await asyncio.sleep(max(self.requests.reserve(1), self.tokens.reserve(tokens)))
+
+# Function to decide whether an API error is transient
+def is_retryable(error: Exception) -> bool:
+    # Anthropic errors carry status_code, legacy OpenAI errors http_status
+    status_code = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    # Connection errors and timeouts carry no status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "Timeout", "TimeoutError", "TryAgain", "ServiceUnavailableError", "ConnectionError")
+
+# Function to read a server-provided retry delay, if any
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+# Function to compute a full-jitter exponential backoff delay
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE, maximum: float = LLM_BACKOFF_MAX) -> float:
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+# Function to run an API call under the rate limiter, retrying transient failures with jittered backoff
+async def call_with_retries(call: Callable[[], Awaitable[Any]], limiter: RateLimiter, tokens: int, max_retries: int = LLM_MAX_RETRIES) -> Any:
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens)
+        try:
+            return await call()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = max(backoff_delay(attempt), retry_after_seconds(e) or 0)
+            logger.warning(f"Retrying LLM call after {type(e).__name__} (attempt {attempt + 1}/{max_retries}, waiting {delay:.1f}s)")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+# Function to run one coroutine per item with bounded concurrency, returning results in input order
+async def run_concurrently(items: List[Any], worker: Callable[[int, Any], Awaitable[Any]], concurrency: int = LLM_CONCURRENCY,
+                           progress_callback: Optional[Callable[[float], None]] = None) -> List[Any]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    completed = 0
+
+    async def run(index, item):
+        nonlocal completed
+        async with semaphore:
+            result = await worker(index, item)
+        completed += 1
+        if progress_callback:
+            progress_callback(completed / len(items))
+        return result
+
+    return await asyncio.gather(*(run(index, item) for index, item in enumerate(items)))
+
+# Merges answers streamed from several chunks. The answer to a question comes
+# from the earliest chunk that has one, so it is final once every earlier chunk
+# has finished that question without answering it. on_final is called exactly
+# once per question, with None if no chunk answered it.
+class OrderedAnswerMerge:
+    def __init__(self, num_chunks: int, num_questions: int, on_final: Optional[Callable[[int, Any], None]] = None):
+        self.answers: List[Dict[int, Any]] = [{} for _ in range(num_chunks)]
+        self.done = set()
+        self.final: Dict[int, Any] = {}
+        self.num_questions = num_questions
+        self.on_final = on_final
+
+    def add(self, chunk: int, question: int, answer: Any) -> None:
+        self.answers[chunk].setdefault(question, answer)
+        self._resolve([question])
+
+    def finish(self, chunk: int, questions: Optional[List[int]] = None) -> None:
+        questions = range(self.num_questions) if questions is None else questions
+        self.done.update((chunk, question) for question in questions)
+        self._resolve(questions)
+
+    def _resolve(self, questions) -> None:
+        for question in questions:
+            if question in self.final:
+                continue
+            for chunk, answers in enumerate(self.answers):
+                if question in answers:
+                    self._finalise(question, answers[question])
+                    break
+                if (chunk, question) not in self.done:
+                    break
+            else:
+                self._finalise(question, None)
+
+    def _finalise(self, question: int, answer: Any) -> None:
+        self.final[question] = answer
+        if self.on_final:
+            self.on_final(question, answer)
+
+# Incrementally decodes the items of the first JSON array in a streamed document,
+# so each object can be used as soon as its closing brace arrives
+class JsonArrayStream:
+    def __init__(self):
+        self.buffer = ""
+        self.position: Optional[int] = None
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text: str) -> List[Any]:
+        self.buffer += text
+        items = []
+        if self.position is None:
+            start = self.buffer.find("[")
+            if start < 0:
+                return items
+            self.position = start + 1
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n,":
+                self.position += 1
+            if self.position >= len(self.buffer) or self.buffer[self.position] == "]":
+                return items
+            try:
+                item, self.position = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # The next item is still incomplete
+                return items
+            items.append(item)
@@ -0,0 +1,145 @@
+import os
+import re
+import logging
+from typing import Dict
+
+# Inference backends for the local models: "torch" runs the fp32 model as loaded,
+# "int8" quantises its linear layers to int8 on the fly, and "onnx" / "onnx-int8"
+# export an extractive QA model to ONNX (optionally int8 quantised) and run it with
+# ONNX Runtime. Everything but "torch" runs on the CPU only.
+MODEL_BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "torch")
+
+# Per-model backend choice, e.g. "mpnet=int8,t5=torch"; other models use MODEL_BACKEND
+MODEL_BACKEND_OVERRIDES: Dict[str, str] = dict(
+    item.strip().split("=", 1) for item in os.environ.get("MODEL_BACKEND_OVERRIDES", "").split(",") if "=" in item
+)
+
+# Exported ONNX models are cached here; delete a file to re-export after the model changes
+ONNX_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", "onnx_models")
+ONNX_OPSET = 17
+
+logger = logging.getLogger(__name__)
+
+# Function to pick the backend configured for a model
+def model_backend(model_name: str) -> str:
+    backend = MODEL_BACKEND_OVERRIDES.get(model_name, MODEL_BACKEND)
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unsupported backend {backend} for {model_name}, expected one of: {', '.join(MODEL_BACKENDS)}")
+    return backend
+
+# Function to measure a model's weights from its state dict, which unlike its
+# parameters also holds the packed int8 weights of quantised layers
+def state_dict_bytes(model) -> int:
+    def size(value):
+        if isinstance(value, (tuple, list)):
+            return sum(size(item) for item in value)
+        if hasattr(value, "numel") and hasattr(value, "element_size"):
+            return value.numel() * value.element_size()
+        return 0
+    return sum(size(value) for value in model.state_dict().values())
+
+# Function to quantise a model's linear layers to int8; activations are quantised per batch at run time
+def quantize_int8(model):
+    import torch
+    quantized = torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+    quantized.size_bytes = state_dict_bytes(quantized)
+    return quantized
+
+# Returns the start and end logits as a tuple, which is what the ONNX exporter can trace
+def _logits_module(model, input_names):
+    import torch
+
+    class QuestionAnsweringLogits(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            outputs = self.model(**dict(zip(input_names, inputs)))
+            return outputs.start_logits, outputs.end_logits
+
+    return QuestionAnsweringLogits()
+
+# Function to export an extractive QA model to ONNX, reusing an earlier export of the same model
+def export_onnx(model, tokenizer, name: str, quantize: bool = False) -> str:
+    import torch
+    key = re.sub(r"[^\w.-]", "_", name)
+    path = os.path.join(ONNX_CACHE_DIR, f"{key}.onnx")
+    if not os.path.exists(path):
+        os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+        sample = tokenizer("What is encrypted?", "Customer data is encrypted at rest.", return_tensors="pt")
+        input_names = list(sample.keys())
+        axes = {0: "batch", 1: "sequence"}
+        # Written under a temporary name so a concurrent load never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.onnx.export(
+            _logits_module(model.eval(), input_names),
+            tuple(sample[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=["start_logits", "end_logits"],
+            dynamic_axes={name: axes for name in input_names + ["start_logits", "end_logits"]},
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+        os.replace(tmp_path, path)
+        logger.info(f"Exported {name} to {path}")
+    if not quantize:
+        return path
+
+    quantized_path = os.path.join(ONNX_CACHE_DIR, f"{key}.int8.onnx")
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        tmp_path = f"{quantized_path}.{os.getpid()}.tmp"
+        quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+        logger.info(f"Quantised {name} to {quantized_path}")
+    return quantized_path
+
+# Extractive QA model run by ONNX Runtime. It is called like the transformers
+# model it was exported from and returns torch logits, so the QA code can use
+# either one.
+class ONNXQuestionAnsweringModel:
+    def __init__(self, path: str):
+        import torch
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Follow torch's thread count, which serve.py splits between worker processes
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.size_bytes = os.path.getsize(path)
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids=None, attention_mask=None, **inputs):
+        import torch
+        from transformers.modeling_outputs import QuestionAnsweringModelOutput
+        inputs.update(input_ids=input_ids, attention_mask=attention_mask)
+        # Callers that leave out token type ids get the single-segment default
+        feed = {
+            name: (inputs[name] if inputs.get(name) is not None else torch.zeros_like(input_ids)).cpu().numpy()
+            for name in self.input_names
+        }
+        start_logits, end_logits = self.session.run(["start_logits", "end_logits"], feed)
+        return QuestionAnsweringModelOutput(start_logits=torch.from_numpy(start_logits), end_logits=torch.from_numpy(end_logits))
+
+# Function to convert a loaded fp32 model for the given backend
+def apply_backend(model, tokenizer, backend: str, name: str, device):
+    if backend == "torch":
+        return model
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unsupported backend: {backend}")
+    if device.type != "cpu":
+        raise ValueError(f"The {backend} backend runs on the CPU only")
+    if backend == "int8":
+        return quantize_int8(model)
+    if model.config.is_encoder_decoder:
+        raise ValueError(f"The {backend} backend only supports extractive QA models")
+    return ONNXQuestionAnsweringModel(export_onnx(model, tokenizer, name, quantize=backend == "onnx-int8"))
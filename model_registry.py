@@ -0,0 +1,129 @@
+import os
+import gc
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+# Registry settings: resident model budget and models to load at startup
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("MODEL_MEMORY_BUDGET_MB", 4096))
+MODEL_PRELOAD = [name.strip() for name in os.environ.get("MODEL_PRELOAD", "").split(",") if name.strip()]
+
+logger = logging.getLogger(__name__)
+
+# Function to estimate the resident size of a model's weights and buffers
+def model_size_bytes(model) -> int:
+    # Quantised and ONNX models report their own size
+    if hasattr(model, "size_bytes"):
+        return model.size_bytes
+    if not hasattr(model, "parameters"):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+# Process-wide cache of loaded models. Each model is loaded once and kept warm;
+# when the total resident size exceeds the budget the least recently used
+# models are evicted.
+class ModelRegistry:
+    def __init__(self, memory_budget_mb: int = MODEL_MEMORY_BUDGET_MB):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.load_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, key: str, loader: Callable[[], Tuple]) -> Tuple:
+        with self.lock:
+            entry = self._touch(key)
+            if entry is not None:
+                return entry["value"]
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+
+        # Concurrent requests for the same model wait for a single load
+        with load_lock:
+            with self.lock:
+                entry = self._touch(key)
+                if entry is not None:
+                    return entry["value"]
+
+            start = time.perf_counter()
+            value = loader()
+            load_seconds = time.perf_counter() - start
+            size = model_size_bytes(value[0])
+            logger.info(f"Loaded {key} in {load_seconds:.2f}s ({size / 1024 / 1024:.1f} MB)")
+
+            with self.lock:
+                self.entries[key] = {
+                    "value": value,
+                    "load_seconds": load_seconds,
+                    "size_bytes": size,
+                    "loaded_at": time.time(),
+                    "last_used": time.time(),
+                    "hits": 0,
+                }
+                self._evict(keep=key)
+            return value
+
+    def _touch(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            entry["last_used"] = time.time()
+            entry["hits"] += 1
+        return entry
+
+    def _evict(self, keep: str) -> None:
+        evicted = False
+        while self.resident_bytes() > self.memory_budget and len(self.entries) > 1:
+            key = next(k for k in self.entries if k != keep)
+            logger.info(f"Evicting {key} from model registry (memory budget exceeded)")
+            del self.entries[key]
+            evicted = True
+        if evicted:
+            self._release_memory()
+
+    def _release_memory(self) -> None:
+        gc.collect()
+        # Without torch imported no model can be holding GPU memory
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def resident_bytes(self) -> int:
+        return sum(entry["size_bytes"] for entry in self.entries.values())
+
+    def remove(self, key: str) -> None:
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                logger.info(f"Removed {key} from model registry")
+                self._release_memory()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "memory_budget_mb": self.memory_budget / 1024 / 1024,
+                "resident_mb": round(self.resident_bytes() / 1024 / 1024, 1),
+                "models": [
+                    {
+                        "name": key,
+                        "load_seconds": round(entry["load_seconds"], 3),
+                        "size_mb": round(entry["size_bytes"] / 1024 / 1024, 1),
+                        "loaded_at": entry["loaded_at"],
+                        "last_used": entry["last_used"],
+                        "hits": entry["hits"],
+                    }
+                    for key, entry in self.entries.items()
+                ],
+            }
+
+# Create a global instance of ModelRegistry
+model_registry = ModelRegistry()
+
+def preload_models(model_names: List[str], loader: Callable[[str], Tuple]) -> None:
+    # Eagerly load models so the first request does not pay the load time
+    for name in model_names:
+        try:
+            loader(name)
+        except Exception as e:
+            logger.error(f"Failed to preload {name}: {str(e)}")
@@ -0,0 +1,177 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from itertools import chain
+from typing import List, Tuple
+import numpy as np
+from text_cache import corpus_fingerprint
+from retrieval import BM25Index
+
+# Batched inference settings for the local QA models
+QA_BATCH_SIZE = int(os.environ.get("QA_BATCH_SIZE", 16))
+WINDOW_SIZE = 1000
+WINDOW_STRIDE = 500
+MAX_SEQ_LENGTH = 512
+MAX_GENERATIVE_LENGTH = 1024
+WINDOW_INDEX_CACHE_SIZE = int(os.environ.get("WINDOW_INDEX_CACHE_SIZE", 4))
+
+logger = logging.getLogger(__name__)
+
+# Function to split pages into overlapping character windows
+def build_windows(all_text: List[Tuple[str, str, int]], window_size: int = WINDOW_SIZE, stride: int = WINDOW_STRIDE) -> List[Tuple[str, str, int]]:
+    windows = []
+    for text, source, page_num in all_text:
+        if not text:
+            continue
+        # Pages shorter than one window still contribute a single window
+        last_start = max(len(text) - window_size, 0)
+        for i in range(0, last_start + 1, stride):
+            windows.append((text[i:i + window_size], source, page_num))
+    return windows
+
+# Function to yield index batches ordered by length so padding stays small
+def length_sorted_batches(lengths: List[int], batch_size: int) -> List[List[int]]:
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+# Pre-tokenised context windows for one corpus and tokeniser. Token IDs and
+# character offsets of all windows are stored in flat arrays, with
+# token_offsets[w]:token_offsets[w + 1] delimiting window w. A BM25 index
+# over the same windows selects candidates before QA inference.
+class WindowIndex:
+    def __init__(self, tokenizer, windows: List[Tuple[str, str, int]]):
+        self.contexts = [context for context, _, _ in windows]
+        self.sources = sorted({source for _, source, _ in windows})
+        source_lookup = {source: i for i, source in enumerate(self.sources)}
+        self.source_ids = np.array([source_lookup[source] for _, source, _ in windows], dtype=np.int32)
+        self.page_nums = np.array([page_num for _, _, page_num in windows], dtype=np.int32)
+
+        encodings = tokenizer(self.contexts, add_special_tokens=False, return_offsets_mapping=True) if windows else {"input_ids": [], "offset_mapping": []}
+        lengths = np.fromiter((len(ids) for ids in encodings["input_ids"]), dtype=np.int64, count=len(windows))
+        self.token_offsets = np.zeros(len(windows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.token_offsets[1:])
+        total = int(self.token_offsets[-1])
+        self.token_ids = np.fromiter(chain.from_iterable(encodings["input_ids"]), dtype=np.int32, count=total)
+        self.char_spans = np.fromiter(chain.from_iterable(chain.from_iterable(encodings["offset_mapping"])), dtype=np.int32, count=2 * total).reshape(total, 2)
+        self.retriever = BM25Index(self.contexts)
+
+    def __len__(self) -> int:
+        return len(self.contexts)
+
+    def window(self, w: int) -> Tuple[str, str, int]:
+        return self.contexts[w], self.sources[self.source_ids[w]], int(self.page_nums[w])
+
+    def context_ids(self, w: int) -> np.ndarray:
+        return self.token_ids[self.token_offsets[w]:self.token_offsets[w + 1]]
+
+    def char_span(self, w: int, first_token: int, last_token: int) -> Tuple[int, int]:
+        base = self.token_offsets[w]
+        return int(self.char_spans[base + first_token][0]), int(self.char_spans[base + last_token][1])
+
+_index_cache: "OrderedDict[Tuple[str, str], WindowIndex]" = OrderedDict()
+_index_lock = threading.Lock()
+
+# Function to get the window index for a corpus, building it only when the corpus or tokeniser changes
+def get_window_index(tokenizer, all_text: List[Tuple[str, str, int]]) -> WindowIndex:
+    key = (tokenizer.name_or_path, corpus_fingerprint(all_text))
+    with _index_lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+
+    windows = build_windows(all_text)
+    logger.info(f"Building window index: {len(windows)} windows for {tokenizer.name_or_path}")
+    index = WindowIndex(tokenizer, windows)
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > WINDOW_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+# Function to run an extractive QA model over the given indexed windows for one question
+def batched_extractive_answers(model, tokenizer, device, question: str, index: WindowIndex, window_ids: List[int], batch_size: int = QA_BATCH_SIZE) -> List[Tuple[str, int, int]]:
+    import torch
+    # Only the question is tokenised here; window tokens come from the index.
+    # Encoding the question against a one-token probe context yields the
+    # special-token layout around the context for this tokeniser.
+    probe = tokenizer(question, "context")
+    sequence_ids = probe.sequence_ids(0)
+    context_start = sequence_ids.index(1)
+    context_end = len(sequence_ids) - sequence_ids[::-1].index(1)
+    prefix_ids, suffix_ids = probe["input_ids"][:context_start], probe["input_ids"][context_end:]
+    budget = max(MAX_SEQ_LENGTH - len(prefix_ids) - len(suffix_ids), 0)
+    if "token_type_ids" in probe:
+        type_ids = probe["token_type_ids"]
+        prefix_types, context_type, suffix_types = type_ids[:context_start], type_ids[context_start], type_ids[context_end:]
+
+    features = []
+    for w in window_ids:
+        context_ids = index.context_ids(w)[:budget].tolist()
+        input_ids = prefix_ids + context_ids + suffix_ids
+        feature = {"input_ids": input_ids, "attention_mask": [1] * len(input_ids)}
+        if "token_type_ids" in probe:
+            feature["token_type_ids"] = prefix_types + [context_type] * len(context_ids) + suffix_types
+        features.append((feature, len(context_ids)))
+
+    results = [("", 0, 0)] * len(window_ids)
+    for batch in length_sorted_batches([len(f["input_ids"]) for f, _ in features], batch_size):
+        padded = tokenizer.pad([features[i][0] for i in batch], return_tensors="pt").to(device)
+        attention_mask = padded["attention_mask"]
+
+        with torch.inference_mode():
+            outputs = model(**padded)
+        # Padding positions must never be picked as a span boundary
+        mask = attention_mask == 0
+        starts = outputs.start_logits.masked_fill(mask, float('-inf')).argmax(dim=-1).tolist()
+        ends = (outputs.end_logits.masked_fill(mask, float('-inf')).argmax(dim=-1) + 1).tolist()
+
+        for row, i in enumerate(batch):
+            feature, context_length = features[i]
+            start, end = starts[row], ends[row]
+            answer = tokenizer.convert_tokens_to_string(tokenizer.convert_ids_to_tokens(feature["input_ids"][start:end]))
+            # Map the token span back to character offsets in the window
+            first = max(start, context_start) - context_start
+            last = min(end, context_start + context_length) - context_start - 1
+            char_start, char_end = index.char_span(window_ids[i], first, last) if first <= last else (0, 0)
+            results[i] = (answer, char_start, char_end)
+    return results
+
+# Function to run a generative QA model over the given indexed windows for one question
+def batched_generative_answers(model, tokenizer, device, question: str, index: WindowIndex, window_ids: List[int], batch_size: int = QA_BATCH_SIZE) -> List[Tuple[str, int, int]]:
+    import torch
+    # Generation dominates here, so the prompt is tokenised as a whole string
+    input_texts = [f"question: {question} context: {index.contexts[w]}" for w in window_ids]
+    results = [("", 0, 0)] * len(window_ids)
+    lengths = [len(text) for text in input_texts]
+
+    for batch in length_sorted_batches(lengths, batch_size):
+        inputs = tokenizer(
+            [input_texts[i] for i in batch],
+            return_tensors="pt",
+            max_length=MAX_GENERATIVE_LENGTH,
+            truncation=True,
+            padding=True,
+        ).to(device)
+
+        with torch.inference_mode():
+            outputs = model.generate(**inputs, max_length=150, num_return_sequences=1, num_beams=4, early_stopping=True)
+
+        for row, i in enumerate(batch):
+            answer = tokenizer.decode(outputs[row], skip_special_tokens=True)
+            results[i] = (answer, 0, len(answer))  # Return dummy start and end positions
+    return results
+
+# Function to answer one question against the given indexed windows in batches
+def answer_windows(model, tokenizer, device, question: str, index: WindowIndex, window_ids: List[int], model_name: str, batch_size: int = QA_BATCH_SIZE) -> List[Tuple[str, int, int]]:
+    if not len(window_ids):
+        return []
+    try:
+        if model_name == 'mpnet':
+            return batched_extractive_answers(model, tokenizer, device, question, index, window_ids, batch_size)
+        elif model_name in ['bart', 't5']:
+            return batched_generative_answers(model, tokenizer, device, question, index, window_ids, batch_size)
+        raise ValueError(f"Unsupported model: {model_name}")
+    except Exception as e:
+        logger.error(f"Error in batched inference: {str(e)}")
+        return [("", 0, 0)] * len(window_ids)
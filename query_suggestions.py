@@ -1,37 +1,146 @@
 from fastapi import APIRouter, HTTPException
 from cachetools import TTLCache
 from typing import List
+import os
+import asyncio
 import logging
+import threading
 from security_questions_data import SECURITY_QUESTIONS
+from question_index import QuestionIndex, normalize_query
 
 # Set up router, cache, and logger
 router = APIRouter()
 cache = TTLCache(maxsize=1000, ttl=3600)  # Cache for 1 hour
 logger = logging.getLogger(__name__)
 
-def get_suggestions(partial_input: str) -> List[str]:
-    # Find matching questions based on partial input
-    partial_input = partial_input.lower()
-    return [q for q in SECURITY_QUESTIONS if partial_input in q.lower()]
+# Maximum number of suggestions returned per query
+MAX_SUGGESTIONS = 5
+
+# Ranking modes: "exact" only matches substrings, "fuzzy" fills up with typo-tolerant
+# matches and "semantic" also blends in embedding similarity when it answers in time
+SUGGESTION_MODES = ("exact", "fuzzy", "semantic")
+SUGGESTION_MODE = os.environ.get("SUGGESTION_MODE", "fuzzy")
+SUGGESTION_SEMANTIC_BUDGET_MS = float(os.environ.get("SUGGESTION_SEMANTIC_BUDGET_MS", 50))
+
+# Questions produced by question_generation/question_generation.py, suggested alongside the built-in ones
+GENERATED_QUESTIONS_PATH = os.environ.get(
+    "GENERATED_QUESTIONS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "question_generation", "generated_security_questions.txt")
+)
+
+# Function to load the generated questions, one per line
+def load_generated_questions(path: str = GENERATED_QUESTIONS_PATH) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+# Index of every question that can be suggested, built once at import
+question_index = QuestionIndex(SECURITY_QUESTIONS + load_generated_questions())
+
+# Embedding index over the suggestible questions. Embedding them can take a
+# while, so it is built in the background on first use and semantic requests
+# fall back to fuzzy ranking until it is ready.
+class SemanticRanker:
+    def __init__(self):
+        self.index = None
+        self.questions: List[str] = []
+        self.state = "idle"
+        self.error = None
+        self.lock = threading.Lock()
+
+    def _build(self, questions: List[str]) -> None:
+        try:
+            # Imported here so the encoder and torch only load when semantic ranking is used
+            from retrieval import get_dense_index
+            index = get_dense_index(questions, "questions")
+            with self.lock:
+                self.index, self.questions, self.state = index, questions, "ready"
+            logger.info(f"Question embeddings ready for {len(questions)} questions")
+        except Exception as e:
+            logger.error(f"Could not build question embeddings, semantic suggestions disabled: {str(e)}")
+            with self.lock:
+                self.state, self.error = "failed", str(e)
+
+    def ready(self) -> bool:
+        with self.lock:
+            if self.state == "idle":
+                self.state = "building"
+                threading.Thread(target=self._build, args=(list(question_index.questions),), daemon=True).start()
+            return self.state == "ready"
+
+    def failed(self) -> bool:
+        with self.lock:
+            return self.state == "failed"
+
+    def search(self, query: str, limit: int) -> List[str]:
+        return [self.questions[i] for i in self.index.search([query], limit)[0]]
+
+# Create a global instance of SemanticRanker
+semantic_ranker = SemanticRanker()
+
+def get_suggestions(partial_input: str, mode: str = SUGGESTION_MODE, limit: int = MAX_SUGGESTIONS) -> List[str]:
+    # Substring matches come first; other modes fill the remaining slots with typo-tolerant matches
+    suggestions = question_index.search(partial_input, limit)
+    if mode != "exact" and len(suggestions) < limit:
+        exact = set(suggestions)
+        fuzzy = [q for q in question_index.fuzzy_search(partial_input, 2 * limit) if q not in exact]
+        suggestions += fuzzy[:limit - len(suggestions)]
+    return suggestions
+
+async def get_semantic_suggestions(partial_input: str, limit: int = MAX_SUGGESTIONS):
+    # Blend fuzzy and embedding rankings; returns None if the embeddings are not ready or too slow
+    if not semantic_ranker.ready():
+        return None
+    try:
+        semantic = await asyncio.wait_for(asyncio.to_thread(semantic_ranker.search, partial_input, limit), SUGGESTION_SEMANTIC_BUDGET_MS / 1000)
+    except asyncio.TimeoutError:
+        logger.debug(f"Semantic suggestions exceeded {SUGGESTION_SEMANTIC_BUDGET_MS} ms for query: {partial_input}")
+        return None
+    from retrieval import fuse_rankings
+    suggestions = question_index.search(partial_input, limit)
+    exact = set(suggestions)
+    fuzzy = question_index.fuzzy_search(partial_input, 2 * limit)
+    fused = [q for q in fuse_rankings([fuzzy, semantic], 0) if q not in exact]
+    return suggestions + fused[:limit - len(suggestions)]
 
 @router.get("/suggest_questions")
-async def suggest_questions(partial_input: str) -> dict:
+async def suggest_questions(partial_input: str, mode: str = SUGGESTION_MODE) -> dict:
+    if mode not in SUGGESTION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode, expected one of: {', '.join(SUGGESTION_MODES)}")
+
+    # Queries differing only in case or spacing share a cache entry
+    query = normalize_query(partial_input)
+
+    # Semantic ranking that cannot be built (for example without encoder weights) is reported, not hidden behind fuzzy results
+    if mode == "semantic" and semantic_ranker.failed():
+        raise HTTPException(status_code=503, detail=f"Semantic suggestions unavailable: {semantic_ranker.error}")
+
     # Return empty list for short inputs
-    if len(partial_input) < 3:
+    if len(query) < 3:
         return {"suggestions": []}
-    
+
     try:
         # Return cached results if available
-        if partial_input in cache:
-            logger.info(f"Cache hit for query: {partial_input}")
-            return {"suggestions": cache[partial_input]}
-        
-        # Generate and cache new suggestions
-        suggestions = get_suggestions(partial_input)[:5]  # Limit to 5 suggestions
-        cache[partial_input] = suggestions
-        logger.info(f"Generated suggestions for query: {partial_input}")
+        key = (mode, query)
+        if key in cache:
+            logger.debug(f"Cache hit for query: {query}")
+            return {"suggestions": cache[key]}
+
+        # Generate and cache new suggestions; fuzzy fallbacks for semantic requests are not cached
+        if mode == "semantic":
+            suggestions = await get_semantic_suggestions(query)
+            cacheable = suggestions is not None
+            if suggestions is None:
+                suggestions = get_suggestions(query, "fuzzy")
+        else:
+            suggestions = get_suggestions(query, mode)
+            cacheable = True
+        if cacheable:
+            cache[key] = suggestions
+        logger.debug(f"Generated suggestions for query: {query}")
         return {"suggestions": suggestions}
     except Exception as e:
         # Log error and raise HTTP exception
         logger.error(f"Error generating suggestions: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
@@ -0,0 +1,247 @@
+import re
+import math
+import bisect
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# Length of the substrings indexed for each question
+NGRAM_SIZE = 3
+
+# Fuzzy matching: each query word matches at most FUZZY_MAX_EXPANSIONS vocabulary
+# words, found by aligning at most FUZZY_MAX_CANDIDATES of them
+FUZZY_MAX_EXPANSIONS = 64
+FUZZY_MAX_CANDIDATES = 32
+FUZZY_MATCH_CACHE_SIZE = 10000
+
+# Function to normalise text for matching: lower case with runs of whitespace collapsed
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+# Function to split normalised text into words
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text)
+
+# Function to list the trigrams of a word, anchored at its start
+def word_ngrams(word: str) -> set:
+    padded = " " + word
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+# Function to choose how many edits a query word of this length may contain
+def max_edits(length: int) -> int:
+    return 0 if length < 4 else 1 if length < 8 else 2
+
+# Function to compute the optimal string alignment distance between a and b, or
+# with prefix=True between a and the closest prefix of b. Only the diagonal band
+# of width max_distance is filled, and max_distance + 1 is returned as soon as
+# the distance is known to exceed max_distance.
+def edit_distance(a: str, b: str, max_distance: int, prefix: bool = False) -> int:
+    over = max_distance + 1
+    if not prefix and abs(len(a) - len(b)) > max_distance:
+        return over
+    previous = None
+    row = [j if j <= max_distance else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        low, high = max(1, i - max_distance), min(len(b), i + max_distance)
+        for j in range(low, high + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + cost)
+            if previous is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous[j - 2] + 1)
+        if min(current[low - 1:high + 1]) > max_distance:
+            return over
+        previous, row = row, current
+    distance = min(row) if prefix else row[-1]
+    return min(distance, over)
+
+# Substring index over a list of questions, ranking prefix matches first (in
+# alphabetical order), then matches at the start of a word, then any other
+# substring match (both in the order questions were added). Questions are
+# normalised once; trigram postings narrow each query to the questions sharing
+# its rarest trigram, and separate postings of the trigrams at word starts serve
+# the word-start tier, so common queries stop as soon as enough matches are found.
+# fuzzy_search tolerates typos instead: each query word is matched against the
+# vocabulary within a small edit distance and questions are scored by the IDF of
+# the words they share with the query.
+class QuestionIndex:
+    def __init__(self, questions: Iterable[str] = ()):
+        self.questions: List[str] = []
+        # Stored with a leading space so " " + query finds matches at word starts
+        self.normalized: List[str] = []
+        self.postings: Dict[str, array] = {}
+        self.word_postings: Dict[str, array] = {}
+        self.seen = set()
+        self.sorted_keys: Optional[List[str]] = None
+        self.sorted_ids: List[int] = []
+        self.vocabulary: Dict[str, int] = {}
+        self.words: List[str] = []
+        self.word_questions: List[array] = []
+        self.word_grams: Dict[str, List[int]] = {}
+        self.sorted_words: Optional[List[str]] = None
+        self.match_cache: Dict[Tuple[str, bool], List[Tuple[int, int]]] = {}
+        self.lock = threading.Lock()
+        self.add(questions)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def add(self, questions: Iterable[str]) -> int:
+        # Ids only ever grow, so every posting list stays sorted
+        added = 0
+        with self.lock:
+            for question in questions:
+                normalized = normalize_query(question)
+                if not normalized or normalized in self.seen:
+                    continue
+                question_id = len(self.questions)
+                text = " " + normalized
+                self.seen.add(normalized)
+                self.questions.append(question)
+                self.normalized.append(text)
+                for gram in {text[i:i + NGRAM_SIZE] for i in range(1, len(text) - NGRAM_SIZE + 1)}:
+                    self.postings.setdefault(gram, array("I")).append(question_id)
+                for gram in {text[i + 1:i + 1 + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE) if text[i] == " "}:
+                    self.word_postings.setdefault(gram, array("I")).append(question_id)
+                for word in set(tokenize(normalized)):
+                    self._word_id(word)
+                    self.word_questions[self.vocabulary[word]].append(question_id)
+                added += 1
+            if added:
+                self.sorted_keys = None
+                self.match_cache.clear()
+        return added
+
+    def _word_id(self, word: str) -> int:
+        word_id = self.vocabulary.get(word)
+        if word_id is None:
+            word_id = self.vocabulary[word] = len(self.words)
+            self.words.append(word)
+            self.word_questions.append(array("I"))
+            self.sorted_words = None
+            for gram in word_ngrams(word):
+                self.word_grams.setdefault(gram, []).append(word_id)
+        return word_id
+
+    def _sorted(self):
+        # Rebuilt lazily so adding many questions does not re-sort after each one
+        with self.lock:
+            if self.sorted_keys is None:
+                self.sorted_ids = sorted(range(len(self.normalized)), key=self.normalized.__getitem__)
+                self.sorted_keys = [self.normalized[i] for i in self.sorted_ids]
+            return self.sorted_keys, self.sorted_ids
+
+    def _prefix_matches(self, query: str, limit: int) -> List[int]:
+        keys, ids = self._sorted()
+        prefix = " " + query
+        matches = []
+        for position in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if len(matches) >= limit or not keys[position].startswith(prefix):
+                break
+            matches.append(ids[position])
+        return matches
+
+    def _candidates(self, query: str, postings: Dict[str, array]):
+        if len(query) < NGRAM_SIZE:
+            return range(len(self.normalized))
+        grams = [query[i:i + NGRAM_SIZE] for i in range(len(query) - NGRAM_SIZE + 1)]
+        lists = [postings.get(gram, ()) for gram in grams]
+        return min(lists, key=len)
+
+    def search(self, query: str, limit: int = 5) -> List[str]:
+        query = normalize_query(query)
+        if not query or limit <= 0:
+            return []
+        results = self._prefix_matches(query, limit)
+        found = set(results)
+        word_query = " " + query
+        tiers = [(word_query, self._candidates(query[:NGRAM_SIZE], self.word_postings)),
+                 (query, self._candidates(query, self.postings))]
+        for needle, candidates in tiers:
+            if len(results) >= limit:
+                break
+            normalized = self.normalized
+            for question_id in candidates:
+                if needle in normalized[question_id] and question_id not in found:
+                    results.append(question_id)
+                    found.add(question_id)
+                    if len(results) >= limit:
+                        break
+        return [self.questions[question_id] for question_id in results]
+
+    def _words_with_prefix(self, prefix: str) -> List[int]:
+        with self.lock:
+            if self.sorted_words is None:
+                self.sorted_words = sorted(self.words)
+            sorted_words = self.sorted_words
+        matches = []
+        for position in range(bisect.bisect_left(sorted_words, prefix), len(sorted_words)):
+            if not sorted_words[position].startswith(prefix):
+                break
+            matches.append(self.vocabulary[sorted_words[position]])
+        return matches
+
+    def _match_word(self, word: str, prefix: bool) -> List[Tuple[int, int]]:
+        # Vocabulary words matching a query word, as (word id, edit distance). Words
+        # spelled correctly so far only match exactly; the others are aligned against
+        # the vocabulary words sharing the most trigrams with them.
+        key = (word, prefix)
+        matches = self.match_cache.get(key)
+        if matches is not None:
+            return matches
+        if prefix:
+            matches = [(word_id, 0) for word_id in self._words_with_prefix(word)]
+        else:
+            matches = [(self.vocabulary[word], 0)] if word in self.vocabulary else []
+        edits = max_edits(len(word))
+        if not matches and edits:
+            # A word within k edits still shares all but at most 3k of its trigrams
+            grams = word_ngrams(word)
+            shared = Counter(word_id for gram in grams for word_id in self.word_grams.get(gram, ()))
+            threshold = max(1, len(grams) - NGRAM_SIZE * edits)
+            distances = {}
+            for word_id, count in shared.most_common(FUZZY_MAX_CANDIDATES):
+                if count < threshold:
+                    break
+                candidate = self.words[word_id]
+                # Words sharing a prefix share its distance, so each prefix is only aligned once
+                target = candidate[:len(word) + edits] if prefix else candidate
+                if target not in distances:
+                    distances[target] = edit_distance(word, target, edits, prefix)
+                if distances[target] <= edits:
+                    matches.append((word_id, distances[target]))
+        matches = sorted(matches, key=lambda match: (match[1], -len(self.word_questions[match[0]])))[:FUZZY_MAX_EXPANSIONS]
+        if len(self.match_cache) >= FUZZY_MATCH_CACHE_SIZE:
+            self.match_cache.clear()
+        self.match_cache[key] = matches
+        return matches
+
+    def fuzzy_search(self, query: str, limit: int = 5) -> List[str]:
+        words = tokenize(normalize_query(query))
+        num_questions = len(self.questions)
+        if not words or not num_questions or limit <= 0:
+            return []
+        scores = np.zeros(num_questions, dtype=np.float32)
+        for position, word in enumerate(words):
+            # The last word may still be incomplete, so it also matches as a prefix
+            prefix = position == len(words) - 1
+            if len(word) < NGRAM_SIZE and prefix and len(words) > 1:
+                continue
+            word_scores = np.zeros(num_questions, dtype=np.float32)
+            for word_id, distance in self._match_word(word, prefix):
+                # Copied rather than viewed, since a view would stop add() from growing the posting
+                question_ids = np.array(self.word_questions[word_id], dtype=np.uint32)
+                idf = math.log1p(num_questions / len(question_ids))
+                weight = idf * (1.0 - distance / (len(word) + 1))
+                word_scores[question_ids] = np.maximum(word_scores[question_ids], weight)
+            scores += word_scores
+        matched = np.flatnonzero(scores)
+        if len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        # Ties keep the order the questions were added in
+        ranked = matched[np.lexsort((matched, -scores[matched]))]
+        return [self.questions[question_id] for question_id in ranked]
@@ -0,0 +1,66 @@
+import re
+from typing import Iterable, List, Tuple
+
+# Patterns for sensitive data
+PATTERNS = {
+    'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
+    'phone': r'\b(?:\+?1[-.\s]?)?\(?[0-9]{3}\)?[-.\s]?[0-9]{3}[-.\s]?[0-9]{4}\b',
+    'ssn': r'\b\d{3}-\d{2}-\d{4}\b',
+    'credit_card': r'\b(?:\d{4}[-\s]?){3}\d{4}\b'
+}
+CONFIDENTIAL_TERMS = ['confidential', 'secret', 'internal use only', 'proprietary']
+ENTITY_LABELS = ['PERSON', 'ORG']
+
+# Each pattern is compiled once and scanned independently (a single combined
+# alternation is slower with the re module); confidential terms share one
+# case-insensitive alternation. Scanners run in the original replacement order.
+_SCANNERS = [(re.compile(pattern), f"[{key.upper()}]") for key, pattern in PATTERNS.items()]
+_SCANNERS.append((
+    re.compile(r"\b(?:" + "|".join(re.escape(term) for term in sorted(CONFIDENTIAL_TERMS, key=len, reverse=True)) + r")\b", re.IGNORECASE),
+    '[CONFIDENTIAL]'
+))
+
+# Function to find every occurrence of the entity strings with one combined regex
+def _entity_spans(text: str, entities: Iterable[Tuple[str, str]]) -> List[Tuple[int, int, str]]:
+    labels = {}
+    for entity_text, label in entities:
+        if label in ENTITY_LABELS and entity_text:
+            labels.setdefault(entity_text, label)
+    if not labels:
+        return []
+    # Longest literals first so the alternation prefers the longest entity at a position
+    literal_regex = re.compile("|".join(re.escape(literal) for literal in sorted(labels, key=len, reverse=True)))
+    return [(m.start(), m.end(), f"[{labels[m.group()]}]") for m in literal_regex.finditer(text)]
+
+# Function to collect all redaction spans. Each scanner only sees the text left
+# between earlier redactions, as if they had already been replaced: a match
+# overlapping an earlier redaction is matched again on what remains of it
+# instead of being dropped, so "John.Smith@acme.com" with the entity "John"
+# becomes "[PERSON].[EMAIL]". No pattern can match the brackets of a
+# replacement, so this gives the same spans as replacing pass by pass.
+def find_redaction_spans(text: str, entities: Iterable[Tuple[str, str]] = ()) -> List[Tuple[int, int, str]]:
+    spans = _entity_spans(text, entities)
+    for regex, replacement in _SCANNERS:
+        found = []
+        position = 0
+        for start, end, _ in spans + [(len(text), len(text), "")]:
+            if start > position:
+                # Sliced rather than scanned with pos/endpos, so \b sees the segment edge as the
+                # replacement's bracket instead of the redacted character next to it
+                segment = text[position:start] if position or start < len(text) else text
+                found.extend((position + m.start(), position + m.end(), replacement) for m in regex.finditer(segment))
+            position = end
+        if found:
+            spans = sorted(spans + found)
+    return spans
+
+# Function to redact entities and sensitive patterns in a single pass over the text
+def redact(text: str, entities: Iterable[Tuple[str, str]] = ()) -> str:
+    pieces = []
+    position = 0
+    for start, end, replacement in find_redaction_spans(text, entities):
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces)
@@ -0,0 +1,241 @@
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import numpy as np
+from model_registry import model_registry
+
+# Number of candidate windows passed to the QA model per question (0 = all windows)
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 32))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Optional dense retrieval over sentence embeddings
+DENSE_RETRIEVAL = os.environ.get("DENSE_RETRIEVAL", "0") == "1"
+DENSE_TOP_K = int(os.environ.get("DENSE_TOP_K", 8))
+EMBEDDING_MODEL_PATH = os.environ.get("EMBEDDING_MODEL_PATH", "local_model")
+EMBEDDING_INDEX_DIR = os.environ.get("EMBEDDING_INDEX_DIR", "uploads/index")
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_MAX_LENGTH = 256
+IVF_MIN_VECTORS = int(os.environ.get("IVF_MIN_VECTORS", 20000))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 8))
+# Dense indexes kept in memory, one per index name
+DENSE_INDEX_CACHE_SIZE = int(os.environ.get("DENSE_INDEX_CACHE_SIZE", 4))
+# Files from_pretrained loads weights from; the bundled local_model directory has none of them
+MODEL_WEIGHT_FILES = ("model.safetensors", "model.safetensors.index.json", "pytorch_model.bin", "pytorch_model.bin.index.json")
+
+logger = logging.getLogger(__name__)
+
+# Index name -> (fingerprint, DenseIndex), least recently used first
+_dense_indexes: "OrderedDict[str, Tuple[str, DenseIndex]]" = OrderedDict()
+_dense_indexes_lock = threading.Lock()
+# Serialises building, so threads asking for the same index embed it only once
+_dense_build_lock = threading.Lock()
+
+# Okapi BM25 index over a fixed list of documents. Term weights are
+# precomputed into a sparse document-term matrix, so scoring a query is a
+# single sparse matrix-vector product.
+class BM25Index:
+    def __init__(self, documents: List[str], k1: float = BM25_K1, b: float = BM25_B):
+        from scipy import sparse
+        from sklearn.feature_extraction.text import CountVectorizer
+        self.num_documents = len(documents)
+        self.vectorizer = CountVectorizer(lowercase=True, stop_words='english', token_pattern=r"(?u)\b\w+\b")
+        try:
+            term_counts = self.vectorizer.fit_transform(documents).tocsr().astype(np.float32)
+        except ValueError:
+            # Empty corpus or no indexable terms: every query scores zero
+            self.weights = None
+            return
+
+        doc_lengths = np.asarray(term_counts.sum(axis=1)).ravel()
+        avg_length = doc_lengths.mean() if self.num_documents else 0.0
+        doc_freq = np.bincount(term_counts.indices, minlength=term_counts.shape[1])
+        idf = np.log1p((self.num_documents - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+        rows = np.repeat(np.arange(self.num_documents), np.diff(term_counts.indptr))
+        tf = term_counts.data
+        norm = k1 * (1 - b + b * doc_lengths[rows] / max(avg_length, 1e-9))
+        data = idf[term_counts.indices] * tf * (k1 + 1) / (tf + norm)
+        self.weights = sparse.csr_matrix((data, term_counts.indices, term_counts.indptr), shape=term_counts.shape)
+
+    def scores(self, query: str) -> np.ndarray:
+        if self.weights is None:
+            return np.zeros(self.num_documents, dtype=np.float32)
+        query_terms = self.vectorizer.transform([query])
+        query_terms.data[:] = 1
+        return np.asarray((self.weights @ query_terms.T).todense()).ravel()
+
+    def top_k(self, query: str, k: int = RETRIEVAL_TOP_K) -> np.ndarray:
+        # Document ids ordered by descending score; k <= 0 returns every document
+        scores = self.scores(query)
+        if k <= 0 or k >= self.num_documents:
+            return np.argsort(-scores, kind='stable')
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+# Function to fail with a clear message when EMBEDDING_MODEL_PATH is a local directory without weights
+def check_embedding_model() -> None:
+    if os.path.isdir(EMBEDDING_MODEL_PATH) and not any(
+            os.path.exists(os.path.join(EMBEDDING_MODEL_PATH, name)) for name in MODEL_WEIGHT_FILES):
+        raise RuntimeError(f"EMBEDDING_MODEL_PATH={EMBEDDING_MODEL_PATH} has no model weights; point it at a sentence "
+                           f"encoder such as sentence-transformers/all-MiniLM-L6-v2 to use dense retrieval")
+
+# Function to load the sentence encoder through the model registry
+def load_encoder():
+    from transformers import AutoModel, AutoTokenizer
+    check_embedding_model()
+    model, tokenizer = model_registry.get(f"encoder:{EMBEDDING_MODEL_PATH}", lambda: (
+        AutoModel.from_pretrained(EMBEDDING_MODEL_PATH).eval(),
+        AutoTokenizer.from_pretrained(EMBEDDING_MODEL_PATH),
+    ))
+    return tokenizer, model
+
+# Function to embed texts as L2-normalised mean-pooled vectors
+def embed_texts(texts: List[str]) -> np.ndarray:
+    import torch
+    tokenizer, model = load_encoder()
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        inputs = tokenizer(texts[i:i + EMBEDDING_BATCH_SIZE], padding=True, truncation=True, max_length=EMBEDDING_MAX_LENGTH, return_tensors="pt")
+        with torch.inference_mode():
+            hidden = model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        vectors.append(torch.nn.functional.normalize(pooled, dim=-1).numpy().astype(np.float32))
+    hidden_size = model.config.hidden_size
+    return np.concatenate(vectors) if vectors else np.zeros((0, hidden_size), dtype=np.float32)
+
+# Function to pick the k highest-scoring ids per row of a score matrix
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+# Embedding index over a list of chunks. Vectors are normalised, so cosine
+# similarity is a plain dot product; the matrix is saved as .npy and
+# memory-mapped on reuse. Large corpora get an IVF partitioning so a query
+# only scans the closest clusters.
+class DenseIndex:
+    def __init__(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None, assignments: Optional[np.ndarray] = None):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.lists = None
+        if centroids is not None:
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+            self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(centroids))]
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def search(self, queries: List[str], k: int = DENSE_TOP_K) -> np.ndarray:
+        # Chunk ids per query, best first, shape (len(queries), min(k, len(self)))
+        query_vectors = embed_texts(queries)
+        if self.lists is None:
+            return top_k_rows(query_vectors @ self.vectors.T, k)
+
+        probes = top_k_rows(query_vectors @ self.centroids.T, IVF_NPROBE)
+        results = np.zeros((len(queries), min(k, len(self))), dtype=np.int64)
+        for row, clusters in enumerate(probes):
+            candidates = np.concatenate([self.lists[c] for c in clusters])
+            # Fall back to an exact scan when the probed clusters are too small
+            if len(candidates) < results.shape[1]:
+                candidates = np.arange(len(self))
+            scores = self.vectors[candidates] @ query_vectors[row]
+            results[row] = candidates[top_k_rows(scores[None, :], results.shape[1])[0]]
+        return results
+
+# Function to build the IVF partitioning for a vector matrix
+def _build_ivf(vectors: np.ndarray):
+    from sklearn.cluster import MiniBatchKMeans
+    num_lists = max(int(np.sqrt(len(vectors))), 1)
+    kmeans = MiniBatchKMeans(n_clusters=num_lists, random_state=0, n_init=3).fit(vectors)
+    centroids = kmeans.cluster_centers_.astype(np.float32)
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-9)
+    return centroids, kmeans.labels_.astype(np.int32)
+
+# Function to delete the saved files of an index name other than the current fingerprint
+def _remove_stale_index_files(name: str, key: str) -> None:
+    if not os.path.isdir(EMBEDDING_INDEX_DIR):
+        return
+    current = {f"{name}_embeddings_{key}.npy", f"{name}_ivf_{key}.npz"}
+    for filename in os.listdir(EMBEDDING_INDEX_DIR):
+        # Temp files belong to a build in progress, possibly in another process
+        if filename.startswith((f"{name}_embeddings_", f"{name}_ivf_")) and filename not in current and ".tmp." not in filename:
+            try:
+                os.remove(os.path.join(EMBEDDING_INDEX_DIR, filename))
+                logger.info(f"Removed stale dense index file {filename}")
+            except OSError as e:
+                logger.warning(f"Could not remove stale dense index file {filename}: {str(e)}")
+
+# Function to get the dense index for a list of chunks, embedding them only once. Each
+# name keeps one index, so a changed corpus replaces the previous index and its files.
+def get_dense_index(chunks: List[str], name: str = "corpus") -> DenseIndex:
+    sha = hashlib.sha256(EMBEDDING_MODEL_PATH.encode('utf-8'))
+    for chunk in chunks:
+        sha.update(chunk.encode('utf-8'))
+        sha.update(b'\0')
+    key = sha.hexdigest()
+    index = _cached_dense_index(name, key)
+    if index is not None:
+        return index
+
+    with _dense_build_lock:
+        index = _cached_dense_index(name, key)
+        if index is None:
+            index = _load_dense_index(chunks, name, key)
+            with _dense_indexes_lock:
+                _dense_indexes[name] = (key, index)
+                _dense_indexes.move_to_end(name)
+                while len(_dense_indexes) > DENSE_INDEX_CACHE_SIZE:
+                    _dense_indexes.popitem(last=False)
+    return index
+
+def _cached_dense_index(name: str, key: str) -> Optional[DenseIndex]:
+    with _dense_indexes_lock:
+        cached = _dense_indexes.get(name)
+        if cached is None or cached[0] != key:
+            return None
+        _dense_indexes.move_to_end(name)
+        return cached[1]
+
+# Function to load an index from its saved files, embedding the chunks and building the IVF lists if needed
+def _load_dense_index(chunks: List[str], name: str, key: str) -> DenseIndex:
+    vectors_path = os.path.join(EMBEDDING_INDEX_DIR, f"{name}_embeddings_{key}.npy")
+    ivf_path = os.path.join(EMBEDDING_INDEX_DIR, f"{name}_ivf_{key}.npz")
+    if not os.path.exists(vectors_path):
+        logger.info(f"Embedding {len(chunks)} chunks for the {name} dense index")
+        os.makedirs(EMBEDDING_INDEX_DIR, exist_ok=True)
+        vectors = embed_texts(chunks)
+        # Written under a unique name and renamed, so readers never see a partial file
+        tmp_path = f"{vectors_path}.{uuid.uuid4().hex}.tmp.npy"
+        np.save(tmp_path, vectors)
+        os.replace(tmp_path, vectors_path)
+    _remove_stale_index_files(name, key)
+
+    vectors = np.load(vectors_path, mmap_mode='r')
+    if len(vectors) >= IVF_MIN_VECTORS and not os.path.exists(ivf_path):
+        centroids, assignments = _build_ivf(np.asarray(vectors))
+        tmp_path = f"{ivf_path}.{uuid.uuid4().hex}.tmp.npz"
+        np.savez(tmp_path, centroids=centroids, assignments=assignments)
+        os.replace(tmp_path, ivf_path)
+    if os.path.exists(ivf_path):
+        ivf = np.load(ivf_path)
+        return DenseIndex(vectors, ivf["centroids"], ivf["assignments"])
+    return DenseIndex(vectors)
+
+# Function to merge ranked id lists with reciprocal rank fusion
+def fuse_rankings(rankings: List[List[int]], k: int, rrf_k: int = 60) -> List[int]:
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    ranked = sorted(fused, key=lambda doc_id: -fused[doc_id])
+    return ranked[:k] if k > 0 else ranked
@@ -0,0 +1,116 @@
+import os
+
+# Workers are separate processes, so job state has to live somewhere they all see
+os.environ.setdefault("JOB_STORE", "sqlite")
+
+import gc
+import sys
+import time
+import socket
+import signal
+import logging
+import argparse
+import uvicorn
+from app import app, warm_up_libraries
+from ai_handler import load_model_and_tokenizer, get_device
+from model_registry import preload_models, MODEL_PRELOAD
+
+# Number of worker processes serving requests
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", os.cpu_count() or 1))
+
+# Seconds to wait before restarting a worker that exited unexpectedly
+WORKER_RESTART_DELAY = float(os.environ.get("WORKER_RESTART_DELAY", 1.0))
+
+logger = logging.getLogger(__name__)
+
+# Pre-fork server. The parent loads spaCy, torch and the MODEL_PRELOAD models once,
+# then forks the workers: the loaded weights are shared copy-on-write instead of
+# every worker holding its own copy. The parent never runs inference and opens no
+# threads or database connections before forking, so the children start clean.
+
+# Function to open the listening socket shared by all workers
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+# Function to run one worker process on the shared socket
+def run_worker(sock: socket.socket, workers: int) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Split the cores between workers instead of every worker using all of them
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    config = uvicorn.Config(app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+# Function to fork a worker and return its pid
+def spawn_worker(sock: socket.socket, workers: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(sock, workers)
+        except BaseException as e:
+            logger.error(f"Worker {os.getpid()} failed: {str(e)}")
+            code = 1
+        finally:
+            os._exit(code)
+    logger.info(f"Started worker {pid}")
+    return pid
+
+# Function to load shared state, fork the workers and restart any that die
+def serve(host: str, port: int, workers: int) -> None:
+    warm_up_libraries()
+    # A CUDA context does not survive fork, so on a GPU each worker loads its own models at startup
+    if MODEL_PRELOAD and str(get_device()) == "cpu":
+        logger.info(f"Preloading models: {MODEL_PRELOAD}")
+        preload_models(MODEL_PRELOAD, load_model_and_tokenizer)
+    # Move everything loaded so far out of the collector's reach, so collections in
+    # the workers do not write to (and so copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(host, port)
+    logger.info(f"Serving on {host}:{port} with {workers} workers")
+    pids = {spawn_worker(sock, workers) for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        pids.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting")
+            time.sleep(WORKER_RESTART_DELAY)
+        if not stopping:
+            pids.add(spawn_worker(sock, workers))
+    sock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the app in several worker processes sharing preloaded models.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Number of worker processes")
+    args = parser.parse_args()
+    serve(args.host, args.port, max(1, args.workers))
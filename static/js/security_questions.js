@@ -111,7 +111,7 @@ function runAnalysis() {
     })
     .then(response => {
         console.log('Process started:', response.data);
-        checkProcessStatus();
+        streamProcessEvents(response.data.job_id, questions);
     })
     .catch(error => {
         console.error('Error starting question processing:', error);
@@ -120,9 +120,52 @@ function runAnalysis() {
     });
 }
 
-// Checks the status of the analysis process
-function checkProcessStatus() {
-    axios.get('/process_status')
+// Shows each answer as soon as it is ready, falling back to polling if the event stream fails
+function streamProcessEvents(jobId, questions) {
+    if (!window.EventSource) {
+        checkProcessStatus(jobId);
+        return;
+    }
+    const partialResults = questions.map(question => ({
+        question: question,
+        answer: 'Pending...',
+        source: '',
+        citation: ''
+    }));
+    displayResults(partialResults);
+
+    const events = new EventSource(`/process_events/${jobId}`);
+    events.addEventListener('result', event => {
+        const data = JSON.parse(event.data);
+        partialResults[data.index] = data.result;
+        displayResults(partialResults);
+    });
+    events.addEventListener('progress', event => {
+        const data = JSON.parse(event.data);
+        document.getElementById('run-analysis-btn').textContent = `Processing (${Math.round(data.progress)}%)...`;
+    });
+    events.addEventListener('complete', event => {
+        events.close();
+        const data = JSON.parse(event.data);
+        localStorage.setItem('analysisResults', JSON.stringify(data.results));
+        displayResults(data.results);
+        resetAnalysisUI();
+    });
+    events.addEventListener('error', event => {
+        events.close();
+        if (event.data) {
+            alert('An error occurred during analysis: ' + JSON.parse(event.data).message);
+            resetAnalysisUI();
+        } else {
+            console.warn('Analysis event stream interrupted, polling for status instead');
+            checkProcessStatus(jobId);
+        }
+    });
+}
+
+// Checks the status of the analysis job
+function checkProcessStatus(jobId) {
+    axios.get(`/process_status/${jobId}`)
     .then(response => {
         console.log('Process status response:', response.data);
         if (response.data.status === 'complete') {
@@ -133,7 +176,10 @@ function checkProcessStatus() {
             alert('An error occurred during analysis: ' + response.data.message);
             resetAnalysisUI();
         } else {
-            setTimeout(checkProcessStatus, 10000);
+            if (response.data.progress !== undefined) {
+                document.getElementById('run-analysis-btn').textContent = `Processing (${Math.round(response.data.progress)}%)...`;
+            }
+            setTimeout(() => checkProcessStatus(jobId), 10000);
         }
     })
     .catch(error => {
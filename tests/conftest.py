@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import socket
+import threading
+from collections import OrderedDict
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def stub_server():
+    # Serve an ASGI app on a free local port for the duration of a test, returning its base URL
+    import uvicorn
+    servers = []
+
+    def start(app):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(app, log_level="error"))
+        thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Stub server did not start")
+            time.sleep(0.01)
+        servers.append((server, thread))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    yield start
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+@pytest.fixture
+def byte_tokens(monkeypatch):
+    # Count tokens with a byte-level encoding, so the tests need no tokeniser download
+    import tiktoken
+    import ai_handler
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\w+| ?[^\s\w]+|\s+(?!\S)|\s+""",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr(ai_handler, "get_encoding", lambda: encoding)
+    return encoding
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    # Record the backoff attempts instead of sleeping for them
+    import llm_dispatch
+    attempts = []
+
+    def backoff_delay(attempt, *args, **kwargs):
+        attempts.append(attempt)
+        return 0.01
+
+    monkeypatch.setattr(llm_dispatch, "backoff_delay", backoff_delay)
+    return attempts
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    # Run the upload store in an empty directory with fresh manifests and catalog
+    monkeypatch.chdir(ROOT)
+    import app
+    import text_cache
+    import upload_store
+    from corpus_catalog import corpus_catalog
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(upload_store, "_manifest", None)
+    monkeypatch.setattr(upload_store, "_manifest_version", None)
+    monkeypatch.setattr(upload_store, "_hashers", {})
+    monkeypatch.setattr(text_cache, "_manifest", None)
+    monkeypatch.setattr(text_cache, "_manifest_version", None)
+    monkeypatch.setattr(text_cache, "_memory_cache", OrderedDict())
+    monkeypatch.setattr(corpus_catalog, "conn", None)
+    return app, upload_store
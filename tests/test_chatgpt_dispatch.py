@@ -0,0 +1,156 @@
+import re
+import json
+import time
+import asyncio
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import ai_handler
+from llm_dispatch import OrderedAnswerMerge, RateLimiter
+
+QUESTIONS = ["Is data encrypted at rest?", "Is MFA enforced?", "Are backups tested?"]
+
+def completion_stream(answers, delay=0.0):
+    # A streamed chat completion whose JSON content arrives a few characters per event
+    content = json.dumps({"answers": answers})
+
+    def event(delta, finish_reason=None):
+        chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    async def events():
+        await asyncio.sleep(delay)
+        yield event({"role": "assistant", "content": ""})
+        for start in range(0, len(content), 5):
+            yield event({"content": content[start:start + 5]})
+            await asyncio.sleep(0.001)
+        yield event({}, "stop")
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def chatgpt_stub(reply):
+    # reply(part number, question ids, attempt for that request) returns a response; every request is recorded
+    app = FastAPI()
+    app.state.requests = []
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        assert body["stream"] is True
+        message = body["messages"][1]["content"]
+        part = int(re.search(r"part (\d+) of", message).group(1))
+        question_ids = [int(number) for number in re.findall(r"^(\d+)\. ", message, re.M)]
+        key = (part, tuple(question_ids))
+        attempt = sum(1 for k, _ in app.state.requests if k == key)
+        app.state.requests.append((key, time.monotonic()))
+        return reply(part, question_ids, attempt)
+
+    return app
+
+def error_response(status, retry_after=None):
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    return JSONResponse({"error": {"message": f"status {status}", "type": "server_error", "code": None}}, status_code=status, headers=headers)
+
+@pytest.fixture
+def chatgpt(stub_server, byte_tokens, monkeypatch):
+    # Point the OpenAI client at a stub, two questions per request, and give each test its own rate limiter
+    import openai
+
+    def start(reply, limiter=None):
+        app = chatgpt_stub(reply)
+        monkeypatch.setattr(openai, "api_base", stub_server(app) + "/v1")
+        monkeypatch.setattr(ai_handler, "CHATGPT_QUESTIONS_PER_REQUEST", 2)
+        monkeypatch.setattr(ai_handler, "chatgpt_limiter", limiter or RateLimiter())
+        return app
+    return start
+
+def run_batches(num_chunks, usage=None):
+    chunks = [{"text": f"Context of part {i + 1}.", "pages": [("policy.pdf", i + 1)]} for i in range(num_chunks)]
+    finalised = []
+    merge = OrderedAnswerMerge(num_chunks, len(QUESTIONS), lambda question, answer: finalised.append((question, answer)))
+    failed = asyncio.run(ai_handler.query_chatgpt_batches("key", QUESTIONS, chunks, merge, usage_callback=usage.append if usage is not None else None))
+    return failed, merge, finalised
+
+def answer(question_id, text=None):
+    return {"id": question_id, "found": text is not None, "answer": text or ""}
+
+def test_streamed_json_answers_take_the_earliest_part(chatgpt):
+    replies = {
+        # Part 1 answers question 3 only, and finishes last
+        1: ([answer(1), answer(2)], [answer(3, "Backups are tested quarterly.")], 0.3),
+        2: ([answer(1, "AES-256."), answer(2, "MFA is optional.")], [answer(3, "Backups are tested.")], 0.0),
+    }
+
+    def reply(part, question_ids, attempt):
+        first_batch, second_batch, delay = replies[part]
+        return completion_stream(first_batch if question_ids == [1, 2] else second_batch, delay)
+
+    app = chatgpt(reply)
+    usage = []
+    failed, merge, finalised = run_batches(2, usage)
+
+    assert failed == set()
+    # Two parts with two batches of questions each
+    assert len(app.state.requests) == 4
+    assert merge.final == {0: "AES-256.", 1: "MFA is optional.", 2: "Backups are tested quarterly."}
+    assert sorted(question for question, _ in finalised) == [0, 1, 2]
+    assert usage[-1]["requests"] == 4
+    assert usage[-1]["total_tokens"] == usage[-1]["prompt_tokens"] + usage[-1]["completion_tokens"] > 0
+
+def test_rate_limits_and_server_errors_are_retried(chatgpt, fast_backoff):
+    statuses = [429, 503]
+
+    def reply(part, question_ids, attempt):
+        if attempt < len(statuses):
+            return error_response(statuses[attempt], retry_after=0.05 if attempt == 0 else None)
+        return completion_stream([answer(i, f"Answer {i}") for i in question_ids])
+
+    app = chatgpt(reply)
+    failed, merge, _ = run_batches(1)
+
+    assert failed == set()
+    assert merge.final == {0: "Answer 1", 1: "Answer 2", 2: "Answer 3"}
+    # Each of the two batches failed twice before succeeding
+    assert len(app.state.requests) == 6
+    assert sorted(fast_backoff) == [0, 0, 1, 1]
+    first_batch = [at for key, at in app.state.requests if key == (1, (1, 2))]
+    assert first_batch[1] - first_batch[0] >= 0.05
+
+def test_failed_batches_are_reported(chatgpt, fast_backoff):
+    def reply(part, question_ids, attempt):
+        if question_ids == [3]:
+            return error_response(400)
+        return completion_stream([answer(i, f"Answer {i}") for i in question_ids])
+
+    app = chatgpt(reply)
+    failed, merge, _ = run_batches(1)
+
+    # The bad request is not retried, and only its question counts as failed
+    assert failed == {2}
+    assert len(app.state.requests) == 2
+    assert fast_backoff == []
+    assert merge.final == {0: "Answer 1", 1: "Answer 2", 2: None}
+
+def test_rate_limiter_spaces_out_requests(chatgpt):
+    # 600 requests per minute is one every 0.1s once the initial budget is spent
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10 ** 9)
+    limiter.requests.tokens = 0
+    app = chatgpt(lambda part, question_ids, attempt: completion_stream([answer(i, "Yes") for i in question_ids]), limiter)
+    start = time.monotonic()
+    failed, _, _ = run_batches(3)
+
+    assert failed == set()
+    arrivals = sorted(at for _, at in app.state.requests)
+    assert len(arrivals) == 6
+    # Six requests at ten per second cannot all start within half a second
+    assert arrivals[-1] - start >= 0.5
+    assert min(later - earlier for earlier, later in zip(arrivals, arrivals[1:])) >= 0.05
+
+def test_token_budget_limits_requests():
+    # A budget of 600 tokens per minute refills 10 tokens per second
+    limiter = RateLimiter(requests_per_minute=10 ** 6, tokens_per_minute=600)
+    limiter.tokens.tokens = 0
+    start = time.monotonic()
+    asyncio.run(limiter.acquire(3))
+    assert 0.25 <= time.monotonic() - start < 1.0
@@ -0,0 +1,124 @@
+import re
+import json
+import time
+import asyncio
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import ai_handler
+from llm_dispatch import OrderedAnswerMerge, RateLimiter
+
+QUESTIONS = ["Is data encrypted at rest?", "Is MFA enforced?"]
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def message_stream(text, delay=0.0):
+    # The event sequence of a streamed Anthropic Messages API response, sent in small pieces
+    async def events():
+        yield sse("message_start", {"type": "message_start", "message": {
+            "id": "msg_stub", "type": "message", "role": "assistant", "model": "stub", "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 10, "output_tokens": 0}}})
+        yield sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        await asyncio.sleep(delay)
+        for start in range(0, len(text), 7):
+            yield sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text[start:start + 7]}})
+            await asyncio.sleep(0.001)
+        yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield sse("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 5}})
+        yield sse("message_stop", {"type": "message_stop"})
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def claude_stub(reply):
+    # reply(chunk number, attempt for that chunk) returns a response; every request is recorded
+    app = FastAPI()
+    app.state.requests = []
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        assert body["stream"] is True
+        chunk = int(re.search(r"chunk (\d+) of", body["messages"][0]["content"]).group(1))
+        attempt = sum(1 for c, _ in app.state.requests if c == chunk)
+        app.state.requests.append((chunk, time.monotonic()))
+        return reply(chunk, attempt)
+
+    return app
+
+def error_response(status, error_type, retry_after=None):
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    return JSONResponse({"type": "error", "error": {"type": error_type, "message": error_type}}, status_code=status, headers=headers)
+
+@pytest.fixture
+def claude(stub_server, byte_tokens, monkeypatch):
+    # Point the Anthropic client at a stub and give each test its own rate limiter
+    def start(reply):
+        app = claude_stub(reply)
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", stub_server(app))
+        monkeypatch.setattr(ai_handler, "claude_limiter", RateLimiter())
+        return app
+    return start
+
+def make_chunks(count):
+    return [{"text": f"Context of chunk {i + 1}.", "pages": [("policy.pdf", i + 1)]} for i in range(count)]
+
+def run_chunks(num_chunks, usage=None):
+    finalised = []
+    merge = OrderedAnswerMerge(num_chunks, len(QUESTIONS), lambda question, answer: finalised.append((question, answer)))
+    succeeded = asyncio.run(ai_handler.query_claude_chunks("key", QUESTIONS, make_chunks(num_chunks), merge, usage_callback=usage.append if usage is not None else None))
+    return succeeded, merge, finalised
+
+def test_streamed_answers_take_the_earliest_chunk(claude):
+    replies = {
+        # Chunk 1 only answers question 2, and finishes last
+        1: ("1. No relevant information in this chunk.\n\n2. MFA is enforced for all staff. Source: policy.pdf, Page: 1", 0.3),
+        2: ("1. AES-256 at rest. Source: policy.pdf, Page: 2\n\n2. MFA is optional. Source: policy.pdf, Page: 2", 0.0),
+        3: ("1. Data is encrypted. Source: policy.pdf, Page: 3\n\n2. No relevant information in this chunk.", 0.0),
+    }
+    claude(lambda chunk, attempt: message_stream(*replies[chunk]))
+    usage = []
+    succeeded, merge, finalised = run_chunks(3, usage)
+
+    assert succeeded == [True, True, True]
+    # Chunk 2 wins question 1 over chunk 3; chunk 1 wins question 2 although chunk 2 answered first
+    assert merge.final == {0: ("AES-256 at rest.", "policy.pdf, Page: 2"), 1: ("MFA is enforced for all staff.", "policy.pdf, Page: 1")}
+    assert sorted(question for question, _ in finalised) == [0, 1]
+    assert usage[-1] == {"requests": 3, "prompt_tokens": 30, "completion_tokens": 15, "total_tokens": 45}
+
+def test_rate_limits_and_overload_are_retried(claude, fast_backoff):
+    statuses = [(429, "rate_limit_error"), (529, "overloaded_error"), (500, "api_error")]
+
+    def reply(chunk, attempt):
+        if attempt < len(statuses):
+            return error_response(*statuses[attempt], retry_after=0.05 if attempt == 0 else None)
+        return message_stream("1. Yes. Source: policy.pdf, Page: 1\n\n2. Yes. Source: policy.pdf, Page: 1")
+
+    app = claude(reply)
+    succeeded, merge, _ = run_chunks(1)
+
+    assert succeeded == [True]
+    assert merge.final[0] == ("Yes.", "policy.pdf, Page: 1")
+    assert len(app.state.requests) == 4
+    # Backoff grows per attempt, and the first retry waited for the server's retry-after
+    assert fast_backoff == [0, 1, 2]
+    assert app.state.requests[1][1] - app.state.requests[0][1] >= 0.05
+
+def test_client_errors_are_not_retried(claude, fast_backoff):
+    app = claude(lambda chunk, attempt: error_response(400, "invalid_request_error"))
+    succeeded, merge, finalised = run_chunks(2)
+
+    assert succeeded == [False, False]
+    assert len(app.state.requests) == 2
+    assert fast_backoff == []
+    # Failed chunks still finish, so every question is finalised as not found
+    assert merge.final == {0: None, 1: None}
+    assert sorted(finalised) == [(0, None), (1, None)]
+
+def test_retries_stop_after_the_limit(claude, fast_backoff):
+    from llm_dispatch import LLM_MAX_RETRIES
+    app = claude(lambda chunk, attempt: error_response(503, "api_error"))
+    succeeded, _, _ = run_chunks(1)
+
+    assert succeeded == [False]
+    assert len(app.state.requests) == LLM_MAX_RETRIES + 1
+    assert fast_backoff == list(range(LLM_MAX_RETRIES))
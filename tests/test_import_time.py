@@ -0,0 +1,17 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that must only load on first use or during the background warm-up
+HEAVY_MODULES = ["torch", "transformers", "spacy"]
+
+def test_importing_the_app_does_not_load_heavy_libraries():
+    code = f"import sys, app; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, WARMUP_ON_STARTUP="0")
+    # A fresh interpreter, since other tests may already have imported these libraries
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    loaded = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ""
+    assert loaded == ""
@@ -0,0 +1,41 @@
+import time
+import threading
+import pytest
+from jobs import JobManager, JobQueueFullError
+from job_store import MemoryJobStore
+from work_pool import WorkPool, PoolOverloadedError
+
+def blocking_job(release, progress_callback=None, usage_callback=None, result_callback=None):
+    release.wait(5)
+    return ["done"]
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_jobs_share_the_work_pool_limit():
+    pool = WorkPool(max_workers=1, max_queued=1)
+    jobs = JobManager(max_workers=1, max_queued=10, store=MemoryJobStore(), pool=pool)
+    release = threading.Event()
+    job_ids = [jobs.submit(blocking_job, release) for _ in range(2)]
+    # A running and a queued job fill the pool, so request work and further jobs are turned away
+    assert pool.stats()["in_flight"] == 2
+    with pytest.raises(PoolOverloadedError):
+        jobs.submit(blocking_job, release)
+    with pytest.raises(PoolOverloadedError):
+        pool.acquire()
+
+    release.set()
+    wait_for(lambda: all(jobs.get(job_id)["status"] == "complete" for job_id in job_ids))
+    wait_for(lambda: pool.stats()["in_flight"] == 0)
+    pool.shutdown()
+
+def test_rejected_jobs_release_their_slot():
+    pool = WorkPool(max_workers=1, max_queued=1)
+    jobs = JobManager(max_workers=1, max_queued=0, store=MemoryJobStore(), pool=pool)
+    with pytest.raises(JobQueueFullError):
+        jobs.submit(blocking_job, threading.Event())
+    assert pool.stats()["in_flight"] == 0
+    pool.shutdown()
@@ -0,0 +1,64 @@
+import json
+from llm_dispatch import JsonArrayStream, OrderedAnswerMerge, is_retryable, retry_after_seconds
+
+ANSWERS = [
+    {"id": 1, "found": True, "answer": "Keys rotate yearly [see 4.2], stored in an {HSM}."},
+    {"id": 2, "found": False, "answer": ""},
+    {"id": 3, "found": True, "answer": "Quoted \"MFA\", with a \\ backslash, ] and }"},
+]
+
+def test_json_array_stream_yields_each_item_once_complete():
+    document = json.dumps({"answers": ANSWERS}, indent=1)
+    stream = JsonArrayStream()
+    seen = []
+    for position, character in enumerate(document):
+        for item in stream.feed(character):
+            # An item is yielded as soon as its closing brace arrives, not at the end of the document
+            assert document[position] == "}"
+            seen.append(item)
+    assert seen == ANSWERS
+
+def test_json_array_stream_ignores_text_before_the_array():
+    stream = JsonArrayStream()
+    assert stream.feed('{"note": "no array yet", ') == []
+    assert stream.feed('"answers": [{"id": 1}, {"id"') == [{"id": 1}]
+    assert stream.feed(': 2}]}') == [{"id": 2}]
+    assert stream.feed("") == []
+
+def test_merge_takes_the_earliest_chunk_with_an_answer():
+    finalised = []
+    merge = OrderedAnswerMerge(3, 2, lambda question, answer: finalised.append((question, answer)))
+    merge.add(2, 0, "from chunk 3")
+    merge.add(1, 0, "from chunk 2")
+    merge.finish(2)
+    merge.finish(1)
+    # Chunk 1 may still answer, so nothing is final yet
+    assert finalised == []
+    merge.add(0, 1, "from chunk 1")
+    assert finalised == [(1, "from chunk 1")]
+    merge.finish(0)
+    assert finalised == [(1, "from chunk 1"), (0, "from chunk 2")]
+    assert merge.final == {0: "from chunk 2", 1: "from chunk 1"}
+
+def test_merge_finalises_unanswered_questions_once_every_chunk_finished():
+    finalised = []
+    merge = OrderedAnswerMerge(2, 2, lambda question, answer: finalised.append((question, answer)))
+    merge.finish(1, [0, 1])
+    merge.finish(0, [0])
+    assert finalised == [(0, None)]
+    merge.add(0, 1, "late")
+    merge.add(0, 1, "ignored duplicate")
+    merge.finish(0, [1])
+    assert finalised == [(0, None), (1, "late")]
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def test_retryable_statuses_and_retry_after():
+    assert all(is_retryable(StatusError(status)) for status in (408, 429, 500, 503, 529))
+    assert not any(is_retryable(StatusError(status)) for status in (400, 401, 404))
+    assert retry_after_seconds(StatusError(429, {"retry-after": "1.5"})) == 1.5
+    assert retry_after_seconds(StatusError(429)) is None
@@ -0,0 +1,57 @@
+import numpy as np
+import ai_handler
+
+PAGES = [
+    ("Customer data is encrypted at rest with AES-256 keys.", "policy.pdf", 1),
+    ("Multi-factor authentication is enforced for every administrator.", "policy.pdf", 2),
+]
+ANSWERS = {
+    "How is data encrypted at rest?": "encrypted at rest with AES-256 keys",
+    "Is multi-factor authentication enforced?": "Multi-factor authentication is enforced",
+}
+
+class StubRetriever:
+    def top_k(self, question, k):
+        return np.arange(len(PAGES))
+
+class StubIndex:
+    retriever = StubRetriever()
+
+    def __len__(self):
+        return len(PAGES)
+
+    def window(self, w):
+        return PAGES[w]
+
+def stub_answer_windows(model, tokenizer, device, question, index, window_ids, ai_model, batch_size):
+    # Each window answers only if it contains the expected answer
+    expected = ANSWERS[question]
+    results = []
+    for w in window_ids:
+        context = PAGES[w][0]
+        start = context.find(expected)
+        results.append((expected, start, start + len(expected)) if start >= 0 else ("", 0, 0))
+    return results
+
+def test_local_model_streams_each_answer_before_the_job_finishes(monkeypatch):
+    monkeypatch.setattr(ai_handler, "load_and_preprocess_documents", lambda path: PAGES)
+    monkeypatch.setattr(ai_handler, "load_model_and_tokenizer", lambda ai_model: (None, None, "cpu"))
+    monkeypatch.setattr(ai_handler, "get_window_index", lambda tokenizer, all_text: StubIndex())
+    monkeypatch.setattr(ai_handler, "answer_windows", stub_answer_windows)
+    monkeypatch.setattr(ai_handler, "DENSE_RETRIEVAL", False)
+    # Answer clean-up needs NLTK data downloads, which this test does not exercise
+    monkeypatch.setattr(ai_handler, "post_process_answer", lambda answer, question: answer)
+    events = []
+    questions = list(ANSWERS)
+
+    results = ai_handler.process_security_questions(
+        "distilbert", "", questions, "uploads/anonymized",
+        progress_callback=lambda fraction: events.append(("progress", fraction)),
+        result_callback=lambda index, result: events.append(("result", index, result)),
+    )
+
+    # Every answer is sent before the progress update for its question
+    assert [event[:2] for event in events] == [("result", 0), ("progress", 0.5), ("result", 1), ("progress", 1.0)]
+    assert [event[2] for event in events if event[0] == "result"] == results
+    assert results[0]["source"] == "policy.pdf, Page: 1"
+    assert results[1]["source"] == "policy.pdf, Page: 2"
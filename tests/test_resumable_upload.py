@@ -0,0 +1,93 @@
+import os
+import asyncio
+import hashlib
+import pytest
+
+CONTENT = b"%PDF-1.4 resumable upload test content " * 4
+
+def sha256_of(data):
+    return hashlib.sha256(data).hexdigest()
+
+@pytest.fixture
+def client(uploads):
+    from fastapi.testclient import TestClient
+    return TestClient(uploads[0].app)
+
+def start(client, size=len(CONTENT), filename="policy.pdf"):
+    response = client.post("/uploads", json={"filename": filename, "size": size})
+    assert response.status_code == 200
+    return response.json()["upload_id"]
+
+def put(client, upload_id, offset, data):
+    return client.put(f"/uploads/{upload_id}", params={"offset": offset}, content=data)
+
+def test_offset_mismatch_is_rejected(client):
+    upload_id = start(client)
+    assert put(client, upload_id, 0, CONTENT[:10]).status_code == 200
+    response = put(client, upload_id, 0, CONTENT[:10])
+    assert response.status_code == 409
+    assert client.get(f"/uploads/{upload_id}").json()["offset"] == 10
+
+def test_oversized_part_is_rejected_and_can_be_retried(client):
+    upload_id = start(client)
+    assert put(client, upload_id, 0, CONTENT[:10]).status_code == 200
+    assert put(client, upload_id, 10, CONTENT[10:] + b"extra").status_code == 413
+    # The rejected part is discarded, so the client resumes from the last good offset
+    assert client.get(f"/uploads/{upload_id}").json()["offset"] == 10
+    assert put(client, upload_id, 10, CONTENT[10:]).status_code == 200
+    response = client.post(f"/uploads/{upload_id}/complete", params={"sha256": sha256_of(CONTENT)})
+    assert response.status_code == 200
+    assert response.json()["sha256"] == sha256_of(CONTENT)
+
+def test_checksum_mismatch_is_rejected(client):
+    upload_id = start(client)
+    assert put(client, upload_id, 0, CONTENT).status_code == 200
+    response = client.post(f"/uploads/{upload_id}/complete", params={"sha256": sha256_of(b"other")})
+    assert response.status_code == 409
+    assert not os.path.exists("uploads/policy.pdf")
+
+def test_resume_after_a_partial_part(client):
+    upload_id = start(client)
+    half = len(CONTENT) // 2
+    assert put(client, upload_id, 0, CONTENT[:half]).json()["offset"] == half
+    # An incomplete upload cannot be completed
+    assert client.post(f"/uploads/{upload_id}/complete").status_code == 409
+    offset = client.get(f"/uploads/{upload_id}").json()["offset"]
+    assert put(client, upload_id, offset, CONTENT[offset:]).json()["offset"] == len(CONTENT)
+    response = client.post(f"/uploads/{upload_id}/complete", params={"sha256": sha256_of(CONTENT)})
+    assert response.status_code == 200
+    with open("uploads/policy.pdf", "rb") as f:
+        assert f.read() == CONTENT
+    assert os.listdir("uploads/.partial") == []
+
+def test_completion_deduplicates_against_stored_content(client):
+    for filename, deduplicated in (("policy.pdf", False), ("copy.pdf", True)):
+        upload_id = start(client, filename=filename)
+        assert put(client, upload_id, 0, CONTENT).status_code == 200
+        response = client.post(f"/uploads/{upload_id}/complete")
+        assert response.json()["deduplicated"] is deduplicated
+    assert os.path.samefile("uploads/policy.pdf", "uploads/copy.pdf")
+    assert len(os.listdir("uploads/store/blobs")) == 1
+
+def test_overrun_after_flushed_bytes_does_not_corrupt_the_hash(uploads, monkeypatch):
+    _, upload_store = uploads
+    # Small write batches, so part of the oversized part reaches the file before the overrun
+    monkeypatch.setattr(upload_store, "UPLOAD_CHUNK_SIZE", 8)
+
+    async def stream(data):
+        for start in range(0, len(data), 8):
+            yield data[start:start + 8]
+
+    async def upload():
+        upload_id = upload_store.create_session("policy.pdf", len(CONTENT))["upload_id"]
+        await upload_store.append_part(upload_id, 0, stream(CONTENT[:16]))
+        with pytest.raises(upload_store.UploadTooLargeError):
+            await upload_store.append_part(upload_id, 16, stream(b"x" * (len(CONTENT) + 8)))
+        await upload_store.append_part(upload_id, 16, stream(CONTENT[16:]))
+        return upload_id
+
+    upload_id = asyncio.run(upload())
+    stored = upload_store.complete_session(upload_id, sha256_of(CONTENT))
+    assert stored["sha256"] == sha256_of(CONTENT)
+    with open("uploads/policy.pdf", "rb") as f:
+        assert sha256_of(f.read()) == stored["sha256"]
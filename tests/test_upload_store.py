@@ -0,0 +1,24 @@
+import os
+import io
+
+CONTENT = b"%PDF-1.4 shared content " * 4
+
+def test_content_stored_under_several_extensions_is_collected(uploads):
+    _, upload_store = uploads
+    upload_store.save_upload(io.BytesIO(CONTENT), "policy.pdf")
+    upload_store.save_upload(io.BytesIO(CONTENT), "policy.eml")
+    assert len(os.listdir(upload_store.BLOB_DIR)) == 2
+
+    upload_store.remove_upload("policy.pdf")
+    # Still referenced by policy.eml
+    assert len(os.listdir(upload_store.BLOB_DIR)) == 2
+    upload_store.remove_upload("policy.eml")
+    assert os.listdir(upload_store.BLOB_DIR) == []
+
+def test_replacing_content_collects_the_old_blob(uploads):
+    _, upload_store = uploads
+    upload_store.save_upload(io.BytesIO(CONTENT), "policy.pdf")
+    upload_store.save_upload(io.BytesIO(CONTENT), "copy.eml")
+    upload_store.save_upload(io.BytesIO(b"new content"), "policy.pdf")
+    upload_store.remove_upload("copy.eml")
+    assert sorted(os.listdir(upload_store.BLOB_DIR)) == [upload_store.get_upload_hash("policy.pdf") + ".pdf"]
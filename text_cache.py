@@ -0,0 +1,264 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import tempfile
+from collections import OrderedDict
+from typing import List, Tuple, Dict, Optional
+import PyPDF2
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Persistent page-text cache for PDFs. Entries are stored per content hash
+# (SHA-256), and a path manifest records the mtime/size each hash was computed
+# for, so unchanged files are neither re-hashed nor re-parsed.
+TEXT_CACHE_DIR = os.environ.get("TEXT_CACHE_DIR", "uploads/text_cache")
+TEXT_CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+# Number of parsed documents each process keeps in memory
+TEXT_MEMORY_CACHE_SIZE = int(os.environ.get("TEXT_MEMORY_CACHE_SIZE", 256))
+
+logger = logging.getLogger(__name__)
+
+# Reentrant lock held across the threads of this process and, through flock on
+# lock_path, across processes such as serve.py's workers
+class FileLock:
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.depth == 0 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+                self.file = open(self.lock_path, 'a')
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except BaseException:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                self.lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0 and self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.lock.release()
+
+# Function to identify the current version of a file that is only ever replaced
+# atomically, so a changed version means another process rewrote it
+def file_version(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+_lock = FileLock(os.path.join(TEXT_CACHE_DIR, "manifest.lock"))
+_manifest: Optional[Dict[str, Dict]] = None
+_manifest_version = None
+_memory_cache: "OrderedDict[str, Dict]" = OrderedDict()
+
+# Function to preprocess text
+def preprocess_text(text):
+    text = re.sub(r'[^\w\s.,?!]', '', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+# Function to hash a file in fixed-size chunks
+def file_sha256(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+# Function to write JSON atomically so readers never see a partial file
+def write_json_atomic(path: str, data) -> None:
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            json.dump(data, tmp_file)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _manifest_path() -> str:
+    return os.path.join(TEXT_CACHE_DIR, "manifest.json")
+
+def _entry_path(sha256: str) -> str:
+    return os.path.join(TEXT_CACHE_DIR, f"{sha256}.json")
+
+def _load_manifest() -> Dict[str, Dict]:
+    # Reloaded whenever another process has replaced the file since it was read
+    global _manifest, _manifest_version
+    version = file_version(_manifest_path())
+    if _manifest is None or version != _manifest_version:
+        try:
+            with open(_manifest_path(), 'r', encoding='utf-8') as f:
+                _manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _manifest = {}
+        _manifest_version = version
+    return _manifest
+
+def _save_manifest() -> None:
+    global _manifest_version
+    write_json_atomic(_manifest_path(), _manifest)
+    _manifest_version = file_version(_manifest_path())
+
+# Function to get the content hash of a file, reusing it while mtime and size are unchanged
+def get_file_hash(file_path: str) -> str:
+    key = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    with _lock:
+        record = _load_manifest().get(key)
+        if record and record["mtime_ns"] == stat.st_mtime_ns and record["size"] == stat.st_size:
+            return record["sha256"]
+
+    sha256 = file_sha256(file_path)
+    with _lock:
+        _load_manifest()[key] = {"sha256": sha256, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        _save_manifest()
+    return sha256
+
+# Function to record a hash that is already known, such as one computed while the file was uploaded
+def record_file_hash(file_path: str, sha256: str) -> None:
+    stat = os.stat(file_path)
+    with _lock:
+        _load_manifest()[os.path.abspath(file_path)] = {"sha256": sha256, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        _save_manifest()
+
+# Function to extract raw page text from a PDF
+def extract_pages(file_path: str) -> List[Tuple[str, int]]:
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        return [(page.extract_text() or "", page_num) for page_num, page in enumerate(reader.pages, 1)]
+
+def _remember_entry(sha256: str, entry: Dict) -> None:
+    # Least recently used documents leave memory first; they stay on disk
+    _memory_cache[sha256] = entry
+    _memory_cache.move_to_end(sha256)
+    while len(_memory_cache) > TEXT_MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+def _load_entry(sha256: str) -> Optional[Dict]:
+    entry = _memory_cache.get(sha256)
+    if entry is not None:
+        _memory_cache.move_to_end(sha256)
+        return entry
+    try:
+        with open(_entry_path(sha256), 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if entry.get("version") != TEXT_CACHE_VERSION:
+        return None
+    _remember_entry(sha256, entry)
+    return entry
+
+# Function to parse a PDF and store its page text in the cache
+def cache_pdf_text(file_path: str) -> Dict:
+    sha256 = get_file_hash(file_path)
+    with _lock:
+        entry = _load_entry(sha256)
+        if entry is not None:
+            return entry
+
+    logger.info(f"Extracting text for cache: {file_path}")
+    pages = extract_pages(file_path)
+    entry = {
+        "version": TEXT_CACHE_VERSION,
+        "sha256": sha256,
+        "pages": [[text, page_num] for text, page_num in pages],
+        "clean_pages": [[preprocess_text(text), page_num] for text, page_num in pages],
+    }
+    with _lock:
+        write_json_atomic(_entry_path(sha256), entry)
+        _remember_entry(sha256, entry)
+    return entry
+
+# Function to get raw page text, parsing the PDF only on a cache miss
+def get_page_texts(file_path: str) -> List[Tuple[str, int]]:
+    entry = cache_pdf_text(file_path)
+    return [(text, page_num) for text, page_num in entry["pages"]]
+
+# Function to get preprocessed page text, parsing the PDF only on a cache miss
+def get_clean_page_texts(file_path: str) -> List[Tuple[str, int]]:
+    entry = cache_pdf_text(file_path)
+    return [(text, page_num) for text, page_num in entry["clean_pages"]]
+
+# Function to get the full text of a PDF with pages separated by blank lines
+def get_document_text(file_path: str) -> str:
+    return "\n\n".join(text for text, _ in get_page_texts(file_path))
+
+# Function to drop the manifest record for a removed file
+def evict_pdf_text(file_path: str) -> None:
+    key = os.path.abspath(file_path)
+    with _lock:
+        manifest = _load_manifest()
+        record = manifest.pop(key, None)
+        if record is None:
+            return
+        _save_manifest()
+        # Keep the entry if another path still shares the same content
+        if not any(r["sha256"] == record["sha256"] for r in manifest.values()):
+            _memory_cache.pop(record["sha256"], None)
+            if os.path.exists(_entry_path(record["sha256"])):
+                os.remove(_entry_path(record["sha256"]))
+
+# Function to list the PDFs in a directory, keeping only the first file for each distinct content
+def unique_pdf_files(directory: str) -> List[str]:
+    filenames = []
+    seen = set()
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".pdf"):
+            try:
+                sha256 = get_file_hash(os.path.join(directory, filename))
+            except OSError as e:
+                logger.error(f"Error hashing {filename}: {str(e)}")
+                continue
+            if sha256 in seen:
+                logger.debug(f"Skipping duplicate content: {filename}")
+                continue
+            seen.add(sha256)
+            filenames.append(filename)
+    return filenames
+
+# Function to load preprocessed pages for the given PDFs, or every distinct PDF in the directory
+def load_corpus(directory: str, filenames: Optional[List[str]] = None) -> List[Tuple[str, str, int]]:
+    all_text = []
+    for filename in unique_pdf_files(directory) if filenames is None else filenames:
+        file_path = os.path.join(directory, filename)
+        try:
+            pages = get_clean_page_texts(file_path)
+        except Exception as e:
+            logger.error(f"Error extracting text from PDF {file_path}: {str(e)}")
+            continue
+        all_text.extend([(text, filename, page_num) for text, page_num in pages])
+    return all_text
+
+# Function to fingerprint a loaded corpus so derived indexes can be reused while it is unchanged
+def corpus_fingerprint(all_text: List[Tuple[str, str, int]]) -> str:
+    sha = hashlib.sha256()
+    for text, source, page_num in all_text:
+        sha.update(f"{source}\0{page_num}\0{len(text)}\0".encode('utf-8'))
+        sha.update(text.encode('utf-8'))
+    return sha.hexdigest()
@@ -7,6 +7,7 @@ from typing import List, Dict
 from transformers import AutoTokenizer, AutoModelForQuestionAnswering, Trainer, TrainingArguments
 from datasets import Dataset
 from torch.utils.data import DataLoader
+from model_registry import model_registry
 from multiprocessing import Process, Value, Lock
 
 # Set up logging
@@ -18,6 +19,7 @@ class TinyBERTHandler:
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
         self.model = AutoModelForQuestionAnswering.from_pretrained(self.model_name)
         self.fine_tuned_model_path = "./fine_tuned_tinybert"
+        self.registry_key = None
         self.progress = Value('d', 0.0)
         self.lock = Lock()
         self.process = None
@@ -99,8 +101,16 @@ class TinyBERTHandler:
         if not os.path.exists(self.fine_tuned_model_path):
             raise ValueError("Fine-tuned model not found. Please run fine-tuning first.")
 
-        self.model = AutoModelForQuestionAnswering.from_pretrained(self.fine_tuned_model_path)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.fine_tuned_model_path)
+        # Keyed by modification time so a new fine-tuning run is picked up
+        registry_key = f"tinybert:{os.path.abspath(self.fine_tuned_model_path)}:{os.path.getmtime(self.fine_tuned_model_path)}"
+        # Drop the model of an earlier fine-tuning run instead of waiting for it to be evicted
+        if self.registry_key is not None and self.registry_key != registry_key:
+            model_registry.remove(self.registry_key)
+        self.registry_key = registry_key
+        self.model, self.tokenizer = model_registry.get(registry_key, lambda: (
+            AutoModelForQuestionAnswering.from_pretrained(self.fine_tuned_model_path),
+            AutoTokenizer.from_pretrained(self.fine_tuned_model_path),
+        ))
 
         results = []
         for question in questions:
@@ -141,4 +151,4 @@ def process_with_tinybert(questions: List[str], anonymised_pdfs: List[str]) -> L
     combined_context = " ".join(anonymised_pdfs)
     
     # Answer the questions
-    return tinybert_handler.answer_questions(questions, combined_context)
\ No newline at end of file
+    return tinybert_handler.answer_questions(questions, combined_context)
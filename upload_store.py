@@ -0,0 +1,466 @@
+import os
+import glob
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional
+from text_cache import file_sha256, record_file_hash, get_file_hash, evict_pdf_text, write_json_atomic, cache_pdf_text, FileLock, file_version
+from corpus_catalog import corpus_catalog
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Upload settings. Content is stored once per SHA-256 under STORE_DIR and the
+# per-filename paths in uploads/ and uploads/anonymized/ are hard links to it.
+UPLOAD_DIR = "uploads"
+ANONYMIZED_DIR = os.path.join(UPLOAD_DIR, "anonymized")
+STORE_DIR = os.path.join(UPLOAD_DIR, "store")
+BLOB_DIR = os.path.join(STORE_DIR, "blobs")
+ANONYMIZED_BLOB_DIR = os.path.join(STORE_DIR, "anonymized")
+PARTIAL_DIR = os.path.join(UPLOAD_DIR, ".partial")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE_MB", 200)) * 1024 * 1024
+ALLOWED_EXTENSIONS = ('.pdf', '.eml', '.msg')
+# Resumable uploads that receive no data for this many seconds are deleted
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+
+logger = logging.getLogger(__name__)
+
+class UploadTooLargeError(Exception):
+    pass
+
+class UploadSessionError(Exception):
+    pass
+
+# Guards the manifest and blobs between threads and worker processes
+_store_lock = FileLock(os.path.join(STORE_DIR, "manifest.lock"))
+_manifest: Optional[Dict[str, Dict]] = None
+# Identity of manifest.json when _manifest was read, to notice writes by other worker processes
+_manifest_version = None
+# Lock and number of holders or waiters per content hash, dropped when the last one releases
+_anonymize_locks: Dict[str, List] = {}
+
+# Hash state of in-progress resumable uploads, valid while its offset matches the part file
+_hashers: Dict[str, Dict] = {}
+_hashers_lock = threading.Lock()
+# Uploads with a part being written by this process
+_active_parts = set()
+
+# Function to reduce a client-supplied filename to a safe base name
+def safe_filename(filename: str) -> str:
+    name = os.path.basename(filename or "").strip()
+    if not name or name.startswith("."):
+        raise ValueError("Invalid filename")
+    return name
+
+def is_allowed_upload(filename: str) -> bool:
+    return filename.lower().endswith(ALLOWED_EXTENSIONS)
+
+def upload_path(filename: str) -> str:
+    return os.path.join(UPLOAD_DIR, filename)
+
+def anonymized_path(filename: str) -> str:
+    return os.path.join(ANONYMIZED_DIR, f"anonymized_{filename}")
+
+def _blob_path(sha256: str, filename: str) -> str:
+    return os.path.join(BLOB_DIR, sha256 + os.path.splitext(filename)[1].lower())
+
+def _anonymized_blob_path(sha256: str) -> str:
+    return os.path.join(ANONYMIZED_BLOB_DIR, f"{sha256}.pdf")
+
+def _manifest_path() -> str:
+    return os.path.join(STORE_DIR, "manifest.json")
+
+def _load_manifest() -> Dict[str, Dict]:
+    # manifest.json is replaced atomically on every write, so a changed version means another process wrote it
+    global _manifest, _manifest_version
+    version = file_version(_manifest_path())
+    if _manifest is None or version != _manifest_version:
+        try:
+            with open(_manifest_path(), 'r', encoding='utf-8') as f:
+                _manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _manifest = {}
+        _manifest_version = version
+    return _manifest
+
+def _save_manifest() -> None:
+    global _manifest_version
+    write_json_atomic(_manifest_path(), _manifest)
+    _manifest_version = file_version(_manifest_path())
+
+# Function to point a path at stored content, falling back to a copy where hard links are unsupported
+def _link(source: str, destination: str) -> None:
+    tmp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+def _remove_if_exists(path: str) -> bool:
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
+
+# Function to delete stored content that no filename refers to any more
+def _collect_garbage(sha256: str) -> None:
+    if any(record["sha256"] == sha256 for record in _load_manifest().values()):
+        return
+    # The content may be stored under any extension it was uploaded with
+    for blob_path in glob.glob(os.path.join(BLOB_DIR, f"{sha256}.*")):
+        _remove_if_exists(blob_path)
+    _remove_if_exists(_anonymized_blob_path(sha256))
+    logger.info(f"Removed unreferenced content {sha256}")
+
+# Function to file a fully written temp file under its content hash and link it to the filename
+def store_upload(tmp_path: str, filename: str, sha256: str, size: int) -> Dict:
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    blob_path = _blob_path(sha256, filename)
+    with _store_lock:
+        deduplicated = os.path.exists(blob_path)
+        if deduplicated:
+            os.remove(tmp_path)
+            logger.info(f"Upload {filename} duplicates stored content {sha256}")
+        else:
+            os.replace(tmp_path, blob_path)
+        _link(blob_path, upload_path(filename))
+
+        manifest = _load_manifest()
+        previous = manifest.get(filename)
+        stat = os.stat(blob_path)
+        manifest[filename] = {"sha256": sha256, "size": size, "mtime_ns": stat.st_mtime_ns, "uploaded_at": time.time()}
+        if previous and previous["sha256"] != sha256:
+            # The old anonymised copy belongs to the replaced content
+            evict_pdf_text(anonymized_path(filename))
+            _remove_if_exists(anonymized_path(filename))
+            _collect_garbage(previous["sha256"])
+        _save_manifest()
+    record_file_hash(upload_path(filename), sha256)
+    corpus_catalog.record_upload(filename, sha256, size)
+    return {"filename": filename, "sha256": sha256, "size": size, "deduplicated": deduplicated}
+
+# Function to stream a file object to disk in chunks, hashing as it goes, and store it
+def save_upload(source: BinaryIO, filename: str, max_size: int = MAX_UPLOAD_SIZE) -> Dict:
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=BLOB_DIR, suffix=".part")
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLargeError(f"Upload exceeds {max_size // (1024 * 1024)} MB limit")
+                sha.update(chunk)
+                tmp_file.write(chunk)
+        return store_upload(tmp_path, filename, sha.hexdigest(), size)
+    except Exception:
+        _remove_if_exists(tmp_path)
+        raise
+
+# Function to get the content hash of an upload, adopting files that were placed in uploads/ directly
+def get_upload_hash(filename: str) -> str:
+    path = upload_path(filename)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    stat = os.stat(path)
+    with _store_lock:
+        record = _load_manifest().get(filename)
+        if record and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+            return record["sha256"]
+
+        sha256 = file_sha256(path)
+        os.makedirs(BLOB_DIR, exist_ok=True)
+        blob_path = _blob_path(sha256, filename)
+        if os.path.exists(blob_path):
+            _link(blob_path, path)
+        else:
+            _link(path, blob_path)
+        # Keep an existing anonymised copy if it was produced from this content
+        legacy_output = anonymized_path(filename)
+        if not os.path.exists(_anonymized_blob_path(sha256)) and os.path.exists(legacy_output) and os.stat(legacy_output).st_mtime >= stat.st_mtime:
+            os.makedirs(ANONYMIZED_BLOB_DIR, exist_ok=True)
+            _link(legacy_output, _anonymized_blob_path(sha256))
+        stat = os.stat(blob_path)
+        _load_manifest()[filename] = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "uploaded_at": time.time()}
+        _save_manifest()
+    record_file_hash(path, sha256)
+    corpus_catalog.record_upload(filename, sha256, stat.st_size)
+    logger.info(f"Adopted {filename} into the upload store as {sha256}")
+    return sha256
+
+# Function to record an anonymised copy in the catalog with its page count and extraction status
+def _catalog_anonymized(filename: str, output_sha256: str) -> None:
+    try:
+        page_count = len(cache_pdf_text(anonymized_path(filename))["pages"])
+        corpus_catalog.record_anonymized(filename, output_sha256, page_count)
+    except Exception as e:
+        logger.error(f"Error extracting text from {anonymized_path(filename)}: {str(e)}")
+        corpus_catalog.record_anonymized(filename, output_sha256, None, error=str(e))
+
+# Function to hold the lock that serialises anonymisation of one content hash
+@asynccontextmanager
+async def anonymization_lock(sha256: str):
+    entry = _anonymize_locks.setdefault(sha256, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _anonymize_locks[sha256]
+
+# Function to reuse an existing anonymised copy of the same content, returning False if there is none
+def link_anonymized(filename: str) -> bool:
+    sha256 = get_upload_hash(filename)
+    blob_path = _anonymized_blob_path(sha256)
+    with _store_lock:
+        if not os.path.exists(blob_path):
+            return False
+        output_path = anonymized_path(filename)
+        if not (os.path.exists(output_path) and os.path.samefile(blob_path, output_path)):
+            _link(blob_path, output_path)
+            logger.info(f"Reused anonymised content for {filename}")
+    output_sha256 = get_file_hash(blob_path)
+    record_file_hash(output_path, output_sha256)
+    record = corpus_catalog.get(filename)
+    if record is None or record["anonymized_sha256"] != output_sha256:
+        _catalog_anonymized(filename, output_sha256)
+    return True
+
+# Function to get a fresh path for the anonymiser to write to
+def anonymized_temp_path(sha256: str) -> str:
+    os.makedirs(ANONYMIZED_BLOB_DIR, exist_ok=True)
+    return os.path.join(ANONYMIZED_BLOB_DIR, f"{sha256}.{uuid.uuid4().hex}.tmp.pdf")
+
+# Function to store a finished anonymised file and link it to the filename and every other
+# name with the same content that already has an anonymised copy
+def commit_anonymized(filename: str, sha256: str, tmp_path: str) -> None:
+    output_sha256 = get_file_hash(tmp_path)
+    blob_path = _anonymized_blob_path(sha256)
+    with _store_lock:
+        # Replacing the blob gives it a new inode, so names still linked to the old one would keep stale output
+        filenames = [filename] + sorted(name for name, record in _load_manifest().items()
+                                        if name != filename and record["sha256"] == sha256 and os.path.exists(anonymized_path(name)))
+        os.replace(tmp_path, blob_path)
+        for name in filenames:
+            _link(blob_path, anonymized_path(name))
+    evict_pdf_text(tmp_path)
+    for name in filenames:
+        evict_pdf_text(anonymized_path(name))
+        record_file_hash(anonymized_path(name), output_sha256)
+        _catalog_anonymized(name, output_sha256)
+
+# Function to remove an upload and its anonymised copy, deleting the content once nothing refers to it
+def remove_upload(filename: str) -> bool:
+    removed = False
+    with _store_lock:
+        manifest = _load_manifest()
+        record = manifest.pop(filename, None)
+        if _remove_if_exists(upload_path(filename)):
+            logger.info(f"Removed original file: {upload_path(filename)}")
+            removed = True
+        evict_pdf_text(anonymized_path(filename))
+        if _remove_if_exists(anonymized_path(filename)):
+            logger.info(f"Removed anonymised file: {anonymized_path(filename)}")
+            removed = True
+        if record is not None:
+            _save_manifest()
+            _collect_garbage(record["sha256"])
+            removed = True
+    corpus_catalog.remove(filename)
+    return removed
+
+# Function to reconcile the catalog with the upload directories, for files added or removed outside the app
+def sync_catalog() -> None:
+    on_disk = {f for f in os.listdir(UPLOAD_DIR) if is_allowed_upload(f) and os.path.isfile(upload_path(f))}
+    for filename in set(corpus_catalog.uploaded_files()) - on_disk:
+        logger.info(f"Dropping {filename} from the catalog: file no longer exists")
+        corpus_catalog.remove(filename)
+    for filename in sorted(on_disk):
+        try:
+            sha256 = get_upload_hash(filename)
+            record = corpus_catalog.get(filename)
+            if record is None or record["sha256"] != sha256:
+                corpus_catalog.record_upload(filename, sha256, os.path.getsize(upload_path(filename)))
+                record = corpus_catalog.get(filename)
+            if record["anonymized_sha256"] is None or not os.path.exists(anonymized_path(filename)):
+                if not link_anonymized(filename) and record["anonymized_sha256"] is not None:
+                    corpus_catalog.clear_anonymized(filename)
+        except Exception as e:
+            logger.error(f"Error cataloguing {filename}: {str(e)}")
+
+def _session_paths(upload_id: str):
+    if not upload_id.isalnum():
+        raise UploadSessionError("Invalid upload ID")
+    base = os.path.join(PARTIAL_DIR, upload_id)
+    return f"{base}.json", f"{base}.part"
+
+# Function to start a resumable upload of a file of known size
+def create_session(filename: str, size: int) -> Dict:
+    filename = safe_filename(filename)
+    if size > MAX_UPLOAD_SIZE:
+        raise UploadTooLargeError(f"Upload exceeds {MAX_UPLOAD_SIZE // (1024 * 1024)} MB limit")
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    expire_sessions()
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _session_paths(upload_id)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({"filename": filename, "size": size}, f)
+    with _hashers_lock:
+        _hashers[upload_id] = {"sha": hashlib.sha256(), "offset": 0}
+    logger.info(f"Started resumable upload {upload_id} for {filename} ({size} bytes)")
+    return get_session(upload_id)
+
+# Function to get a resumable upload's metadata and the offset to resume from
+def get_session(upload_id: str) -> Dict:
+    meta_path, part_path = _session_paths(upload_id)
+    if not os.path.exists(meta_path):
+        raise UploadSessionError("Upload not found")
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        session = json.load(f)
+    session["upload_id"] = upload_id
+    session["offset"] = os.path.getsize(part_path)
+    return session
+
+# Function to delete resumable uploads that have received no data for ttl seconds
+def expire_sessions(ttl: int = UPLOAD_SESSION_TTL) -> int:
+    if not os.path.isdir(PARTIAL_DIR):
+        return 0
+    cutoff = time.time() - ttl
+    expired = 0
+    for name in os.listdir(PARTIAL_DIR):
+        upload_id, extension = os.path.splitext(name)
+        if extension != ".json" or not upload_id.isalnum():
+            continue
+        meta_path, part_path = _session_paths(upload_id)
+        try:
+            last_active = max(os.path.getmtime(path) for path in (meta_path, part_path) if os.path.exists(path))
+        except ValueError:
+            continue
+        if last_active >= cutoff:
+            continue
+        with _hashers_lock:
+            if upload_id in _active_parts:
+                continue
+            _hashers.pop(upload_id, None)
+        _remove_if_exists(part_path)
+        _remove_if_exists(meta_path)
+        expired += 1
+    if expired:
+        logger.info(f"Expired {expired} abandoned resumable uploads")
+    return expired
+
+# Function to open a part file for appending, failing if another process is writing to it
+def _open_part(part_path: str) -> BinaryIO:
+    part_file = open(part_path, 'ab')
+    if fcntl is not None:
+        try:
+            fcntl.flock(part_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            part_file.close()
+            raise UploadSessionError("Another part of this upload is in progress")
+    return part_file
+
+def _write_part(part_file: BinaryIO, data: bytes, sha) -> None:
+    part_file.write(data)
+    if sha is not None:
+        sha.update(data)
+
+def _sync_part(part_file: BinaryIO) -> None:
+    # The returned offset is what the client resumes from, so it must survive a crash
+    part_file.flush()
+    os.fsync(part_file.fileno())
+
+# Function to append a streamed part at the given offset. One part per upload is
+# accepted at a time; file writes run in worker threads so the event loop keeps serving.
+async def append_part(upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict:
+    _, part_path = _session_paths(upload_id)
+    with _hashers_lock:
+        if upload_id in _active_parts:
+            raise UploadSessionError("Another part of this upload is in progress")
+        _active_parts.add(upload_id)
+    part_file = None
+    try:
+        session = await asyncio.to_thread(get_session, upload_id)
+        part_file = await asyncio.to_thread(_open_part, part_path)
+        # Checked while holding the part file, so a concurrent part cannot also pass
+        session = await asyncio.to_thread(get_session, upload_id)
+        if offset != session["offset"]:
+            raise UploadSessionError(f"Offset mismatch: expected {session['offset']}, got {offset}")
+        with _hashers_lock:
+            hasher = _hashers.get(upload_id)
+        if hasher is not None and hasher["offset"] != offset:
+            hasher = None
+        # Hash into a copy, kept only once the whole part is on disk
+        sha = hasher["sha"].copy() if hasher is not None else None
+
+        received = offset
+        buffer = bytearray()
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > session["size"]:
+                # Drop the partial part so the client can retry from the last good offset
+                await asyncio.to_thread(part_file.truncate, offset)
+                raise UploadTooLargeError("Upload is larger than declared")
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(_write_part, part_file, bytes(buffer), sha)
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(_write_part, part_file, bytes(buffer), sha)
+        await asyncio.to_thread(_sync_part, part_file)
+        if hasher is not None:
+            with _hashers_lock:
+                hasher["sha"], hasher["offset"] = sha, received
+        session["offset"] = received
+        return session
+    except BaseException:
+        # The part file may not match any hash state now, so complete_session rehashes it
+        with _hashers_lock:
+            _hashers.pop(upload_id, None)
+        raise
+    finally:
+        if part_file is not None:
+            await asyncio.to_thread(part_file.close)
+        with _hashers_lock:
+            _active_parts.discard(upload_id)
+
+# Function to finish a resumable upload and store it
+def complete_session(upload_id: str, expected_sha256: Optional[str] = None) -> Dict:
+    session = get_session(upload_id)
+    meta_path, part_path = _session_paths(upload_id)
+    if session["offset"] != session["size"]:
+        raise UploadSessionError(f"Upload incomplete: {session['offset']} of {session['size']} bytes received")
+
+    with _hashers_lock:
+        hasher = _hashers.pop(upload_id, None)
+    if hasher is not None and hasher["offset"] == session["size"]:
+        sha256 = hasher["sha"].hexdigest()
+    else:
+        # Hash state was lost (for example after a restart), so rehash the part file
+        sha = hashlib.sha256()
+        with open(part_path, 'rb') as part_file:
+            for block in iter(lambda: part_file.read(UPLOAD_CHUNK_SIZE), b''):
+                sha.update(block)
+        sha256 = sha.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != sha256:
+        raise UploadSessionError("Checksum mismatch")
+
+    upload = store_upload(part_path, session["filename"], sha256, session["size"])
+    os.remove(meta_path)
+    logger.info(f"Completed resumable upload {upload_id}: {session['filename']}")
+    return upload
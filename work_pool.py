@@ -0,0 +1,62 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+# Executor settings for blocking work called from request handlers
+WORK_POOL_KIND = os.environ.get("WORK_POOL_KIND", "thread")
+WORK_POOL_WORKERS = int(os.environ.get("WORK_POOL_WORKERS", os.cpu_count() or 2))
+WORK_POOL_MAX_QUEUED = int(os.environ.get("WORK_POOL_MAX_QUEUED", 16))
+
+logger = logging.getLogger(__name__)
+
+class PoolOverloadedError(Exception):
+    pass
+
+# Runs blocking PDF, spaCy and torch work off the event loop. At most
+# max_workers + max_queued calls may be in flight; further calls are
+# rejected immediately instead of piling up behind the workers.
+class WorkPool:
+    def __init__(self, kind: str = WORK_POOL_KIND, max_workers: int = WORK_POOL_WORKERS, max_queued: int = WORK_POOL_MAX_QUEUED):
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="work")
+        else:
+            raise ValueError(f"Unsupported work pool kind: {kind}")
+        self.kind = kind
+        self.capacity = max_workers + max_queued
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        self.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        finally:
+            self.release()
+
+    # Takes a slot for work that runs elsewhere but shares this bound, such as background jobs
+    def acquire(self) -> None:
+        with self.lock:
+            if self.in_flight >= self.capacity:
+                raise PoolOverloadedError(f"Work pool is full ({self.in_flight} calls in flight)")
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"kind": self.kind, "in_flight": self.in_flight, "capacity": self.capacity}
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Create a global instance of WorkPool
+work_pool = WorkPool()